@@ -0,0 +1,33 @@
+"""
+Micro-benchmarks. Run from the project root, e.g.
+
+    python -m benchmarks.exclusion
+
+Importing this package configures Django with the project settings.
+"""
+import os
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'suedwest_project.settings')
+django.setup()
+
+
+@contextmanager
+def test_database():
+    """Run against a throwaway copy of the database, like the test runner."""
+    from django.db import connection, connections
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    # Other aliases, like the read-only 'analytics' one, read the same database
+    for alias in connections:
+        if alias != connection.alias:
+            connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
@@ -0,0 +1,150 @@
+"""
+Response time of the visit changelist in the admin on a large table: the
+admin as it was (exact counts, distinct-values method filter, LIKE search
+over the joined tables, user agents truncated in Python) against the
+current VisitAdmin.
+
+    python -m benchmarks.admin_changelist [rows]
+
+The default is 5 million visits with 2,000 user agents, 500 referers and
+300 paths over 90 days. On SQLite the test database is a temporary file,
+building it takes a minute or two.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+
+from pages.admin import VisitAdmin
+from pages.models import Referer, UserAgent, Visit
+
+from . import test_database
+
+USER_AGENTS = 2000
+REFERERS = 500
+PATHS = 300
+DAYS = 90
+
+
+class StockVisitAdmin(admin.ModelAdmin):
+    """VisitAdmin before the changes for large tables."""
+    list_display = ('timestamp', 'path', 'method', 'ip_address_anonymized', 'user_agent_truncated')
+    list_filter = ('method', 'timestamp')
+    search_fields = ('path', 'user_agent__value', 'referer__value')
+    list_select_related = ('user_agent',)
+
+    def user_agent_truncated(self, obj):
+        user_agent = obj.user_agent.value if obj.user_agent else None
+        return user_agent[:50] + '...' if user_agent and len(user_agent) > 50 else user_agent
+
+
+stock_site = admin.AdminSite(name='stock')
+stock_site.register(Visit, StockVisitAdmin)
+fast_site = admin.AdminSite(name='fast')
+fast_site.register(Visit, VisitAdmin)
+
+urlpatterns = [
+    path('stock/', stock_site.urls),
+    path('fast/', fast_site.urls),
+]
+
+SCENARIOS = [
+    ('first page', {}, {}),
+    ('method filter', {'method__exact': 'HEAD'}, {'method': 'HEAD'}),
+    ('search user agent', {'q': 'Firefox/1234.'}, {'q': 'Firefox/1234.'}),
+    ('search path', {'q': '/seite-17/'}, {'q': '/seite-17/'}),
+    ('search referer', {'q': 'partner-42.'}, {'q': 'partner-42.'}),
+]
+
+
+def populate(rows):
+    UserAgent.objects.bulk_create([
+        UserAgent(value=value, digest=UserAgent.make_digest(value)) for value in (
+            f'Mozilla/5.0 (X11; Linux x86_64; rv:{i}.0) Gecko/20100101 Firefox/{i}.0' for i in range(USER_AGENTS))
+    ])
+    Referer.objects.bulk_create([
+        Referer(value=value, digest=Referer.make_digest(value))
+        for value in (f'https://partner-{i}.example.com/links' for i in range(REFERERS))
+    ])
+    first_agent = UserAgent.objects.order_by('id').first().id
+    first_referer = Referer.objects.order_by('id').first().id
+    step = DAYS * 86400 // rows or 1
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"""
+                WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {rows - 1})
+                INSERT INTO pages_visit (timestamp, path, method, user_agent_id, referer_id, ip_address_anonymized, weight)
+                SELECT datetime('now', '-{DAYS} days', '+' || (i * {step}) || ' seconds'),
+                       '/seite-' || (i * 7 % {PATHS}) || '/', CASE WHEN i % 50 = 0 THEN 'HEAD' ELSE 'GET' END,
+                       {first_agent} + i % {USER_AGENTS},
+                       CASE WHEN i % 4 = 0 THEN {first_referer} + i / 4 % {REFERERS} END,
+                       '192.168.' || (i % 256) || '.0', 1
+                FROM n
+            """)
+            cursor.execute("""
+                INSERT INTO pages_visitdaily (day, path, count)
+                SELECT date(timestamp), path, COUNT(*) FROM pages_visit GROUP BY 1, 2
+            """)
+            cursor.execute('ANALYZE')
+        else:
+            cursor.execute(f"""
+                INSERT INTO pages_visit (timestamp, path, method, user_agent_id, referer_id, ip_address_anonymized, weight)
+                SELECT now() - interval '{DAYS} days' + i * interval '{step} seconds',
+                       '/seite-' || (i * 7 % {PATHS}) || '/', CASE WHEN i % 50 = 0 THEN 'HEAD' ELSE 'GET' END,
+                       {first_agent} + i % {USER_AGENTS},
+                       CASE WHEN i % 4 = 0 THEN {first_referer} + i / 4 % {REFERERS} END,
+                       ('192.168.' || (i % 256) || '.0')::inet, 1
+                FROM generate_series(0, {rows - 1}) AS i
+            """)
+            cursor.execute("""
+                INSERT INTO pages_visitdaily (day, path, count)
+                SELECT timestamp::date, path, COUNT(*) FROM pages_visit GROUP BY 1, 2
+            """)
+            cursor.execute('ANALYZE')
+
+
+def measure(client, url, params, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        # Cold, without the cached counts
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url, params)
+            timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return statistics.median(timings) * 1000, len(queries), response.context['cl'].result_count
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        if connection.vendor == 'sqlite':
+            # On disk like a real database, not the in-memory test default
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+        with test_database(), override_settings(ROOT_URLCONF='benchmarks.admin_changelist', DEBUG=False):
+            start = time.perf_counter()
+            populate(rows)
+            print(f'{rows:,} visits on {connection.vendor}, built in {time.perf_counter() - start:.0f} s\n')
+            User.objects.create_superuser(username='bench', password='bench')
+            client = Client()
+            client.login(username='bench', password='bench')
+            print(f'{"":<20} {"before":>22} {"after":>22}')
+            for name, stock_params, fast_params in SCENARIOS:
+                before = measure(client, '/stock/pages/visit/', stock_params)
+                after = measure(client, '/fast/pages/visit/', fast_params)
+                print(f'{name:<20} {before[0]:9.0f} ms {before[1]:2d} queries {after[0]:9.0f} ms {after[1]:2d} queries'
+                      f'   ({before[2]:,} / {after[2]:,} results)')
+
+
+if __name__ == '__main__':
+    main()
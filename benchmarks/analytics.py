@@ -0,0 +1,122 @@
+"""
+Query plans and timings of the dashboard analytics (pages/analytics.py)
+on a synthetic visit table. Also compares them with the naive forms:
+filtering on ``timestamp__date`` and paginating with OFFSET.
+
+    python -m benchmarks.analytics [rows]
+
+The default of 10 million rows takes several minutes to generate and
+about 1.5 GB of disk; pass a smaller number for a quick run.
+"""
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks import test_database
+
+PATHS = ['/', '/ueber-uns/', '/leistungen/', '/ablauf/', '/kontakt/', '/impressum/', '/datenschutz/', '/agb/']
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def populate(rows):
+    from django.db import connection, transaction
+
+    rng = random.Random(1)
+    # About one visit every 3 seconds, so 10M rows cover roughly a year
+    step = max(1, 365 * 24 * 3600 // rows)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO pages_referer (value, digest) VALUES (%s, %s)',
+            [(f'https://www.google.de/search?q={i}', f'{i:040d}') for i in range(1, 501)])
+        batch = []
+        for i in range(rows):
+            batch.append((
+                (START + timedelta(seconds=i * step)).strftime('%Y-%m-%d %H:%M:%S'),
+                rng.choice(PATHS), 'GET', rng.choice([None] * 4 + list(range(1, 501))),
+            ))
+            if len(batch) == 50_000:
+                cursor.executemany(
+                    'INSERT INTO pages_visit (timestamp, path, method, referer_id, weight) '
+                    'VALUES (%s, %s, %s, %s, 1)', batch)
+                batch = []
+        if batch:
+            cursor.executemany(
+                'INSERT INTO pages_visit (timestamp, path, method, referer_id, weight) '
+                'VALUES (%s, %s, %s, %s, 1)', batch)
+        # Rollups straight in SQL, days in UTC, which is close enough here
+        cursor.execute(
+            "INSERT INTO pages_visithourly (hour, path, count) "
+            "SELECT strftime('%Y-%m-%d %H:00:00', timestamp), path, SUM(weight) "
+            "FROM pages_visit GROUP BY 1, 2")
+        cursor.execute(
+            'INSERT INTO pages_visitdaily (day, path, count) '
+            'SELECT date(timestamp), path, SUM(weight) FROM pages_visit GROUP BY 1, 2')
+        cursor.execute('ANALYZE')
+
+
+def measure(label, run, queryset=None, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    print(f'{label:<38} {statistics.median(timings) * 1000:10.2f} ms')
+    if queryset is not None:
+        for line in queryset.explain().splitlines():
+            print(f'    {line}')
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+
+    with test_database():
+        from django.db.models import Q, Sum
+        from pages import analytics
+        from pages.models import Visit, VisitDaily, VisitHourly
+
+        started = time.perf_counter()
+        populate(rows)
+        print(f'{rows} visits generated in {time.perf_counter() - started:.0f} s\n')
+
+        last = Visit.objects.order_by('-timestamp').values_list('timestamp', flat=True).first()
+        end = last.date()
+        week = end - timedelta(days=7)
+        since = analytics.day_start(week)
+        until = analytics.day_start(end)
+
+        measure('time_series, hourly, 7 days', lambda: analytics.time_series(since, until),
+                VisitHourly.objects.filter(hour__gte=since, hour__lt=until).values('hour').annotate(Sum('count')))
+        measure('time_series, hourly, one path', lambda: analytics.time_series(since, until, path='/kontakt/'),
+                VisitHourly.objects.filter(hour__gte=since, hour__lt=until, path='/kontakt/'))
+        measure('time_series, daily, 1 year',
+                lambda: analytics.time_series(end - timedelta(days=365), end, analytics.DAY))
+        measure('top_paths, 30 days', lambda: analytics.top_paths(end - timedelta(days=30), end),
+                VisitDaily.objects.filter(day__gte=end - timedelta(days=30), day__lt=end)
+                .values('path').annotate(Sum('count')))
+        measure('top_referers, 7 days', lambda: analytics.top_referers(week, end),
+                Visit.objects.filter(timestamp__gte=since, timestamp__lt=until).values('referer').annotate(Sum('weight')))
+        measure('raw count per day via __date (naive)',
+                lambda: Visit.objects.filter(timestamp__date=week).count(),
+                Visit.objects.filter(timestamp__date=week), repeat=1)
+        measure('raw count per day via range',
+                lambda: Visit.objects.filter(timestamp__gte=since, timestamp__lt=since + timedelta(days=1)).count(),
+                Visit.objects.filter(timestamp__gte=since, timestamp__lt=since + timedelta(days=1)))
+
+        # Page 2000 of 50 visits each
+        depth = min(2000 * 50, rows - 50)
+        anchor = Visit.objects.order_by('-timestamp', '-id').values('id', 'timestamp')[depth - 1]
+        cursor = analytics.encode_cursor(anchor)
+        measure('visits page at depth, OFFSET (naive)',
+                lambda: list(Visit.objects.order_by('-timestamp', '-id').values('id')[depth:depth + 50]))
+        timestamp, visit_id = analytics.decode_cursor(cursor)
+        keyset = Visit.objects.filter(
+            Q(timestamp__lt=timestamp) | Q(id__lt=visit_id), timestamp__lte=timestamp).order_by('-timestamp', '-id')
+        measure('visits page at depth, keyset', lambda: analytics.visit_page(cursor), keyset)
+        measure('visits page at depth, keyset, one path', lambda: analytics.visit_page(cursor, path='/'),
+                keyset.filter(path='/'))
+
+
+if __name__ == '__main__':
+    main()
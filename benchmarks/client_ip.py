@@ -0,0 +1,89 @@
+"""
+Time per request to find and anonymize the client address: the string
+splitting the middleware did before (first X-Forwarded-For hop, IPv6 cut
+after two groups) against pages.client_ip, without and with its cache.
+
+    python -m benchmarks.client_ip [requests] [clients]
+
+The default is 200,000 requests from 5,000 clients, 80 % IPv4, half of
+them through a trusted proxy. Visitors load several pages, so addresses
+repeat; the cached column is what a worker sees in production.
+"""
+import ipaddress
+import random
+import sys
+import time
+from unittest.mock import patch
+
+from django.test import override_settings
+
+from pages import client_ip as module
+from pages.client_ip import anonymize_ip, client_ip, is_trusted_proxy
+
+
+def stock_client_ip(meta):
+    x_forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return meta.get('REMOTE_ADDR')
+
+
+def stock_anonymize_ip(ip):
+    if not ip:
+        return None
+    if ':' in ip:
+        parts = ip.split(':')
+        if len(parts) > 2:
+            try:
+                return str(ipaddress.ip_address(':'.join(parts[:2]) + '::'))
+            except ValueError:
+                return None
+        return ip
+    parts = ip.split('.')
+    if len(parts) == 4:
+        return '.'.join(parts[:3]) + '.0'
+    return ip
+
+
+def workload(requests, clients, seed=1):
+    rng = random.Random(seed)
+    addresses = [
+        f'203.0.{rng.randrange(256)}.{rng.randrange(1, 255)}' if rng.random() < 0.8
+        else f'2001:db8:{rng.randrange(65536):x}:{rng.randrange(65536):x}::{rng.randrange(1, 65536):x}'
+        for _ in range(clients)
+    ]
+    metas = []
+    for _ in range(requests):
+        # A few clients make most of the requests
+        address = addresses[min(int(rng.paretovariate(0.5)) - 1, clients - 1)]
+        if rng.random() < 0.5:
+            metas.append({'REMOTE_ADDR': '127.0.0.1', 'HTTP_X_FORWARDED_FOR': f'{address}, 10.0.0.2'})
+        else:
+            metas.append({'REMOTE_ADDR': address})
+    return metas
+
+
+def measure(metas, resolve, anonymize):
+    start = time.perf_counter()
+    for meta in metas:
+        anonymize(resolve(meta))
+    return (time.perf_counter() - start) / len(metas) * 1e9
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    metas = workload(requests, clients)
+    print(f'{requests:,} requests from {clients:,} clients\n')
+    with override_settings(VISIT_TRUSTED_PROXIES=['127.0.0.1', '::1', '10.0.0.0/8']):
+        print(f'{"before (split)":<18} {measure(metas, stock_client_ip, stock_anonymize_ip):8.0f} ns per request')
+        with patch.object(module, 'is_trusted_proxy', is_trusted_proxy.__wrapped__):
+            print(f'{"after, uncached":<18} {measure(metas, client_ip, anonymize_ip.__wrapped__):8.0f} ns per request')
+        anonymize_ip.cache_clear()
+        print(f'{"after, cached":<18} {measure(metas, client_ip, anonymize_ip):8.0f} ns per request')
+        info = anonymize_ip.cache_info()
+        print(f'\ncache hit rate {info.hits / max(info.hits + info.misses, 1):.0%} ({info.currsize:,} of {info.maxsize:,})')
+
+
+if __name__ == '__main__':
+    main()
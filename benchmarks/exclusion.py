@@ -0,0 +1,59 @@
+"""Per-request cost of the visit exclusion check with a growing rule set."""
+import random
+import string
+import timeit
+
+from django.conf import settings
+
+from pages.exclusion import ExclusionRules
+
+SAMPLE_PATHS = [
+    '/', '/ueber-uns/', '/leistungen/', '/kontakt/', '/static/img/logo.png',
+    '/admin/pages/visit/', '/wp-login.php', '/a/very/long/path/that/matches/nothing/at/all/',
+]
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+
+
+def random_rules(count, rng):
+    word = lambda: ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12)))
+    prefixes = [f'/{word()}/' for _ in range(count // 2)]
+    paths = [f'/{word()}/{word()}.html' for _ in range(count - count // 2)]
+    return prefixes, paths
+
+
+def naive_excludes(path, prefixes, paths):
+    return any(path.startswith(p) for p in prefixes) or path in paths
+
+
+def main():
+    rng = random.Random(42)
+    defaults = settings.VISIT_TRACKING_EXCLUDE
+    print(f'{"rules":>6} {"paths, compiled":>16} {"paths, startswith":>18} {"full check":>11}   (ns/request)')
+    for count in (4, 16, 100, 250, 1000):
+        prefixes, paths = random_rules(count, rng)
+        prefixes += defaults['prefixes']
+        paths += defaults['paths']
+        rules = ExclusionRules(**dict(defaults, prefixes=prefixes, paths=paths))
+
+        def compiled():
+            for path in SAMPLE_PATHS:
+                rules.excludes(path, 'GET')
+
+        def full():
+            for path in SAMPLE_PATHS:
+                rules.excludes(path, 'GET', USER_AGENT)
+
+        def naive():
+            for path in SAMPLE_PATHS:
+                naive_excludes(path, prefixes, paths)
+
+        runs = 2000
+        per_request = lambda fn: min(timeit.repeat(fn, number=runs, repeat=5)) / (runs * len(SAMPLE_PATHS)) * 1e9
+        print(
+            f'{len(prefixes) + len(paths):>6} {per_request(compiled):>16.0f} '
+            f'{per_request(naive):>18.0f} {per_request(full):>11.0f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Image bytes per template: what a browser downloads for every
+{% picture %} (the variant it picks from the srcset, AVIF or WebP) against
+the original file, and images still served as a plain <img> from static.
+
+    python -m benchmarks.image_weight [viewport-width]
+
+The browser picks the smallest width at least as wide as the displayed
+size times the device pixel ratio; that is modeled for 1x, 2x and 3x
+screens. Sizes in vw are taken relative to the viewport (390 px, a phone,
+by default).
+"""
+import json
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+from pages.assets import build
+
+PICTURE_TAG = re.compile(r"""{%\s*picture\s+['"]([^'"]+)['"](.*?)%}""")
+SIZES = re.compile(r"""sizes=['"]([^'"]+)['"]""")
+STATIC_IMG = re.compile(r"""<img\s[^>]*src=["']{%\s*static\s+['"]([^'"]+)['"]\s*%}""")
+DENSITIES = (1, 2, 3)
+
+
+def displayed_width(sizes, viewport):
+    # The last entry of a sizes list is the one without media condition
+    size = sizes.split(',')[-1].strip()
+    if size.endswith('vw'):
+        return float(size[:-2]) * viewport / 100
+    return float(size.removesuffix('px'))
+
+
+def pick(variants, width):
+    for candidate, name in variants:
+        if candidate >= width:
+            return name
+    return variants[-1][1]
+
+
+def main():
+    viewport = int(sys.argv[1]) if len(sys.argv) > 1 else 390
+    templates = sorted(Path(settings.TEMPLATES[0]['DIRS'][0]).glob('*.html'))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp)
+        build(output_dir=output)
+        images = json.loads((output / 'manifest.json').read_text())['images']
+
+        print(f'viewport {viewport} px, bytes per page view\n')
+        print(f'{"template":<16} {"image":<18} {"original":>9}' + ''.join(
+            f' {f"{fmt} {density}x":>10}' for fmt in ('avif', 'webp') for density in DENSITIES))
+        original_total = 0
+        picked_total = dict.fromkeys(DENSITIES, 0)
+        for template in templates:
+            html = template.read_text(encoding='utf-8')
+            for path, arguments in PICTURE_TAG.findall(html):
+                image = images[path]
+                sizes = SIZES.search(arguments)
+                width = displayed_width(sizes.group(1) if sizes else '100vw', viewport)
+                row = f'{template.name:<16} {path:<18} {image["bytes"]:9,d}'
+                for fmt in ('avif', 'webp'):
+                    for density in DENSITIES:
+                        size = (output / pick(image['variants'][fmt], width * density)).stat().st_size
+                        row += f' {size:10,d}'
+                        if fmt == 'avif':
+                            picked_total[density] += size
+                original_total += image['bytes']
+                print(row)
+            for path in STATIC_IMG.findall(html):
+                size = (settings.IMAGES_SOURCE_DIR / path).stat().st_size
+                original_total += size
+                for density in DENSITIES:
+                    picked_total[density] += size
+                print(f'{template.name:<16} {path:<18} {size:9,d}   (plain <img>, no variants)')
+
+    print()
+    for density in DENSITIES:
+        saved = original_total - picked_total[density]
+        print(f'{density}x screens: {picked_total[density]:,d} of {original_total:,d} bytes '
+              f'({saved / max(original_total, 1):.0%} saved)')
+
+
+if __name__ == '__main__':
+    main()
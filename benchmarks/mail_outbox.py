@@ -0,0 +1,89 @@
+"""
+Throughput of inline send_mail (one SMTP connection per email) against the
+queued outbox (one connection per batch), using a local stand-in SMTP server
+that adds a fixed delay to every new connection, like a TLS handshake would.
+
+    python -m benchmarks.mail_outbox [emails] [handshake-ms]
+"""
+import socketserver
+import sys
+import threading
+import time
+
+from django.core.mail import get_connection, send_mail
+from django.test import override_settings
+
+from pages.outbox import enqueue_mail, send_queued_mail
+
+from . import test_database
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    handshake_delay = 0.0
+    received = 0
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        time.sleep(self.handshake_delay)
+        self.reply('220 localhost stand-in ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 end with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                StandInSMTPHandler.received += 1
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+def main():
+    emails = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    StandInSMTPHandler.handshake_delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), StandInSMTPHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    smtp = override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1],
+        EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+    )
+
+    with test_database(), smtp:
+        start = time.perf_counter()
+        for i in range(emails):
+            send_mail(f'Anfrage {i}', 'Text', 'noreply@example.com', ['kontakt@example.com'])
+        inline = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(emails):
+            enqueue_mail(f'Anfrage {i}', 'Text', 'noreply@example.com', ['kontakt@example.com'])
+        enqueue = time.perf_counter() - start
+
+        start = time.perf_counter()
+        while send_queued_mail(connection=get_connection())[0]:
+            pass
+        queued = time.perf_counter() - start
+
+    server.shutdown()
+    handshake_ms = StandInSMTPHandler.handshake_delay * 1000
+    print(f'{emails} emails, {handshake_ms:.0f} ms per connection, {StandInSMTPHandler.received} received')
+    print(f'inline send_mail:     {emails / inline:8.1f} emails/s ({inline / emails * 1000:6.1f} ms in the request)')
+    print(f'enqueue in the view:  {emails / enqueue:8.1f} emails/s ({enqueue / emails * 1000:6.1f} ms in the request)')
+    print(f'background sender:    {emails / queued:8.1f} emails/s')
+
+
+if __name__ == '__main__':
+    main()
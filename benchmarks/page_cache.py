@@ -0,0 +1,43 @@
+"""
+Requests per second for the content pages with and without the page cache.
+
+    python -m benchmarks.page_cache [requests-per-page]
+"""
+import sys
+import time
+
+from django.core.cache import cache
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from . import test_database
+
+PAGES = ['home', 'about', 'services', 'process', 'imprint', 'privacy', 'terms']
+
+
+def requests_per_second(client, count):
+    urls = [reverse(name) for name in PAGES]
+    start = time.perf_counter()
+    for _ in range(count):
+        for url in urls:
+            client.get(url)
+    return count * len(urls) / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with test_database():
+        client = Client()
+        with override_settings(PAGE_CACHE_ENABLED=False):
+            uncached = requests_per_second(client, count)
+        cache.clear()
+        with override_settings(PAGE_CACHE_ENABLED=True):
+            requests_per_second(client, 1)  # warm up
+            cached = requests_per_second(client, count)
+
+    print(f'without page cache: {uncached:8.0f} req/s')
+    print(f'with page cache:    {cached:8.0f} req/s ({cached / uncached:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Page weight of the home page and an estimate of its first render, before
+(Bootstrap, Font Awesome and Inter from three CDNs, the site CSS inline)
+and after build_assets (critical CSS inline, the rest self-hosted and
+loaded without blocking).
+
+    python -m benchmarks.page_weight [rtt-ms] [mbit/s]
+
+The first render is modeled, not measured: the HTML and every stylesheet
+that blocks rendering, each new origin costing DNS, TCP and TLS (3 round
+trips) before its request. Sizes are gzip -9, what a browser downloads.
+The defaults are a slow mobile connection (150 ms, 1.6 Mbit/s).
+"""
+import gzip
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test import Client, override_settings
+
+from pages.assets import build
+
+from . import test_database
+
+# Setup round trips of a new HTTPS origin: DNS, TCP, TLS
+NEW_ORIGIN = 3
+# The Google Fonts stylesheet (not in the repository) is about this size
+GOOGLE_FONTS_CSS = 1200
+
+
+def gzipped(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return len(gzip.compress(data, 9))
+
+
+def first_render(rtt, bandwidth, html, blocking):
+    """
+    Seconds until the first render: the HTML, then the blocking stylesheets
+    in parallel, [(bytes, new origin)], the slowest one counting.
+    """
+    seconds = (1 + NEW_ORIGIN) * rtt + html / bandwidth
+    if blocking:
+        seconds += max(((1 + NEW_ORIGIN * new) * rtt + size / bandwidth) for size, new in blocking)
+    return seconds
+
+
+def report(name, rows, rtt, bandwidth, blocking):
+    print(f'{name}:')
+    for label, size in rows:
+        print(f'  {label:<34} {size / 1024:7.1f} KiB')
+    total = sum(size for _, size in rows)
+    print(f'  {"total":<34} {total / 1024:7.1f} KiB')
+    print(f'  {"first render (estimated)":<34} {first_render(rtt, bandwidth, rows[0][1], blocking) * 1000:7.0f} ms')
+    return total
+
+
+def main():
+    rtt = (float(sys.argv[1]) if len(sys.argv) > 1 else 150) / 1000
+    bandwidth = (float(sys.argv[2]) if len(sys.argv) > 2 else 1.6) * 1e6 / 8
+    source = settings.ASSETS_SOURCE_DIR
+
+    with tempfile.TemporaryDirectory() as output, test_database():
+        build(output_dir=output)
+        with override_settings(ASSETS_OUTPUT_DIR=output, STATICFILES_DIRS=[('dist', output)]):
+            html = Client().get('/').content.decode()
+        files = {path: gzipped((source / path).read_bytes()) for path in (
+            'vendor/bootstrap/bootstrap.min.css', 'vendor/bootstrap/bootstrap.min.js', 'css/site.css',
+        )}
+        icons_css = gzipped(b''.join((source / 'vendor/fontawesome' / name).read_bytes() for name in (
+            'fontawesome.min.css', 'solid.min.css', 'brands.min.css',
+        )))
+        icon_fonts = sum(
+            (source / 'vendor/fontawesome' / name).stat().st_size
+            for name in ('fa-solid-900.woff2', 'fa-brands-400.woff2')
+        )
+        built = {name: gzipped((Path(output) / name).read_bytes()) for name in (
+            'site.css', 'bootstrap.min.js',
+        )}
+        subset_fonts = sum(
+            path.stat().st_size for path in (Path(output) / 'fonts').iterdir()
+        )
+
+    # The page used to carry the site CSS in a <style> instead of the critical CSS
+    critical = re.search(r'<style>.*?</style>', html, re.S).group(0)
+    after_html = gzipped(html)
+    before_html = gzipped(html.replace(critical, '<style>' + (source / 'css/site.css').read_text() + '</style>'))
+
+    print(f'{rtt * 1000:.0f} ms round trip, {bandwidth * 8 / 1e6:g} Mbit/s\n')
+    before = report('before (CDN)', [
+        ('HTML, site CSS inline', before_html),
+        ('bootstrap.min.css', files['vendor/bootstrap/bootstrap.min.css']),
+        ('font awesome css (solid, brands)', icons_css),
+        ('google fonts css', GOOGLE_FONTS_CSS),
+        ('bootstrap js', files['vendor/bootstrap/bootstrap.min.js']),
+        ('icon fonts', icon_fonts),
+    ], rtt, bandwidth, [
+        (files['vendor/bootstrap/bootstrap.min.css'], True),
+        (icons_css, True),
+        (GOOGLE_FONTS_CSS, True),
+    ])
+    after = report('after (build_assets)', [
+        ('HTML, critical CSS inline', after_html),
+        ('site.css (not blocking)', built['site.css']),
+        ('bootstrap.min.js (deferred)', built['bootstrap.min.js']),
+        ('fonts, subset (icons, Inter)', subset_fonts),
+    ], rtt, bandwidth, [])
+    print(f'\n{1 - after / before:.0%} fewer bytes, no requests to other origins before the first render')
+
+
+if __name__ == '__main__':
+    main()
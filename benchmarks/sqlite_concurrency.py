@@ -0,0 +1,125 @@
+"""
+Concurrent visit writes on SQLite: stock settings (SQLITE_TUNING=False)
+against the tuned ones (WAL, synchronous=NORMAL, busy timeout, BEGIN
+IMMEDIATE, read-only analytics connection).
+
+Every writer process stands for a gunicorn worker and writes visits the
+way the request handlers do: inline flushes of VISIT_BUFFER_SIZE records
+(VISIT_WRITER_THREAD is turned off to keep the numbers comparable). Reader
+processes run the dashboard analytics at the same time.
+
+    python -m benchmarks.sqlite_concurrency [writers] [seconds] [readers] [batch]
+
+Each process configures itself from the environment like the real
+settings do, which is why they are started as separate interpreters.
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+PROFILES = [
+    ('stock', {'SQLITE_TUNING': 'False'}),
+    ('tuned', {'SQLITE_TUNING': 'True'}),
+]
+
+
+def spawn(role, env, *args):
+    return subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.sqlite_concurrency', role, *map(str, args)],
+        env=env, stdout=subprocess.PIPE, text=True,
+    )
+
+
+def run_profile(name, overrides, writers, seconds, readers, batch):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'db.sqlite3')
+        env = dict(
+            os.environ, DATABASE_ENGINE='sqlite', SQLITE_PATH=path, VISIT_WRITER_THREAD='False', VISIT_BUFFER_SIZE=str(batch), **overrides)
+        spawn('migrate', env).wait()
+
+        processes = [spawn('write', env, seconds) for _ in range(writers)]
+        processes += [spawn('read', env, seconds) for _ in range(readers)]
+        results = [json.loads(p.communicate()[0]) for p in processes]
+
+        conn = sqlite3.connect(path)
+        stored = conn.execute('SELECT COUNT(*) FROM pages_visit').fetchone()[0]
+        conn.close()
+
+    written = [r for r in results if r['role'] == 'write']
+    read = [r for r in results if r['role'] == 'read']
+    attempted = sum(r['attempted'] for r in written)
+    print(f'{name}:')
+    print(f'  visits attempted     {attempted:10d}')
+    print(f'  visits stored        {stored:10d} ({stored / seconds:,.0f}/s)')
+    print(f'  dropped              {100 - stored * 100 / max(attempted, 1):10.2f} %')
+    print(f'  failed flushes       {sum(r["failed_flushes"] for r in written):10d}')
+    if read:
+        print(f'  analytics reads      {sum(r["reads"] for r in read):10d}'
+              f' ({sum(r["errors"] for r in read)} failed)')
+
+
+def write(seconds):
+    from django.utils import timezone
+    from pages.tracking import VisitBuffer
+
+    buffer = VisitBuffer()
+    attempted = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        buffer.add({
+            'timestamp': timezone.now(), 'path': f'/seite-{attempted % 20}/',
+            'user_agent': f'Mozilla/5.0 Bench/{attempted % 50}', 'referer': '',
+        })
+        attempted += 1
+    # One last try for what is still queued, like worker_exit does
+    buffer.flush()
+    stats = buffer.stats()
+    return {'role': 'write', 'attempted': attempted, 'failed_flushes': stats['failed_flushes']}
+
+
+def read(seconds):
+    from datetime import timedelta
+
+    from django.db import DatabaseError
+    from django.utils import timezone
+    from pages import analytics
+
+    reads = errors = 0
+    today = timezone.localdate()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            analytics.top_paths(today - timedelta(days=30), today + timedelta(days=1))
+            analytics.visit_page(limit=50)
+            reads += 1
+        except DatabaseError:
+            errors += 1
+        time.sleep(0.01)
+    return {'role': 'read', 'reads': reads, 'errors': errors}
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    batch = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+    print(f'{writers} writer and {readers} reader processes for {seconds:g} s, {batch} visits per flush\n')
+    for name, overrides in PROFILES:
+        run_profile(name, overrides, writers, seconds, readers, batch)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('migrate', 'write', 'read'):
+        role = sys.argv.pop(1)
+        if role == 'migrate':
+            from django.core.management import call_command
+            call_command('migrate', verbosity=0)
+        else:
+            result = (write if role == 'write' else read)(float(sys.argv[1]))
+            print(json.dumps(result))
+    else:
+        main()
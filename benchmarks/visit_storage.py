@@ -0,0 +1,114 @@
+"""
+Size of the visit table with user agents and referers stored inline
+(before) and dictionary-encoded in lookup tables (after).
+
+    python -m benchmarks.visit_storage [rows]
+"""
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+BEFORE = """
+CREATE TABLE pages_visit (
+    id integer PRIMARY KEY AUTOINCREMENT, timestamp datetime NOT NULL,
+    path varchar(255) NOT NULL, method varchar(10) NOT NULL, user_agent text NULL,
+    ip_address_anonymized char(39) NULL, referer text NULL, weight integer unsigned NOT NULL);
+CREATE INDEX pages_visit_timestamp ON pages_visit (timestamp);
+"""
+
+AFTER = """
+CREATE TABLE pages_useragent (id integer PRIMARY KEY AUTOINCREMENT, value text NOT NULL, digest varchar(40) NOT NULL UNIQUE);
+CREATE TABLE pages_referer (id integer PRIMARY KEY AUTOINCREMENT, value text NOT NULL, digest varchar(40) NOT NULL UNIQUE);
+CREATE TABLE pages_visit (
+    id integer PRIMARY KEY AUTOINCREMENT, timestamp datetime NOT NULL,
+    path varchar(255) NOT NULL, method varchar(10) NOT NULL,
+    user_agent_id bigint NULL REFERENCES pages_useragent (id) DEFERRABLE INITIALLY DEFERRED,
+    ip_address_anonymized char(39) NULL,
+    referer_id bigint NULL REFERENCES pages_referer (id) DEFERRABLE INITIALLY DEFERRED,
+    weight integer unsigned NOT NULL);
+CREATE INDEX pages_visit_timestamp ON pages_visit (timestamp);
+CREATE INDEX pages_visit_user_agent_id ON pages_visit (user_agent_id);
+CREATE INDEX pages_visit_referer_id ON pages_visit (referer_id);
+"""
+
+PATHS = ['/', '/ueber-uns/', '/leistungen/', '/ablauf/', '/kontakt/', '/impressum/']
+
+
+def synthetic_visits(count, rng):
+    user_agents = [
+        f'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+        f'Chrome/{100 + i % 40}.0.{i}.{i * 7 % 100} Safari/537.36 Edg/{100 + i % 40}.0.{i}.0'
+        for i in range(300)
+    ]
+    referers = [''] * 50 + [f'https://www.google.de/search?q=energieberatung+{i}' for i in range(500)]
+    start = datetime(2026, 1, 1)
+    for i in range(count):
+        yield (
+            (start + timedelta(seconds=i * 7)).isoformat(' '),
+            rng.choice(PATHS), 'GET',
+            rng.choice(user_agents), '192.0.2.0', rng.choice(referers), 1,
+        )
+
+
+def database_size(path):
+    conn = sqlite3.connect(path)
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(path)
+
+
+def build_before(path, visits):
+    conn = sqlite3.connect(path)
+    conn.executescript(BEFORE)
+    conn.executemany(
+        'INSERT INTO pages_visit (timestamp, path, method, user_agent, ip_address_anonymized, referer, weight) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', visits)
+    conn.commit()
+    conn.close()
+
+
+def build_after(path, visits):
+    conn = sqlite3.connect(path)
+    conn.executescript(AFTER)
+    ids = {'pages_useragent': {}, 'pages_referer': {}}
+
+    def lookup(table, value):
+        if not value:
+            return None
+        if value not in ids[table]:
+            digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+            cursor = conn.execute(f'INSERT INTO {table} (value, digest) VALUES (?, ?)', (value, digest))
+            ids[table][value] = cursor.lastrowid
+        return ids[table][value]
+
+    conn.executemany(
+        'INSERT INTO pages_visit (timestamp, path, method, user_agent_id, ip_address_anonymized, referer_id, weight) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((ts, path_, method, lookup('pages_useragent', ua), ip, lookup('pages_referer', ref), weight)
+         for ts, path_, method, ua, ip, ref, weight in visits))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory() as tmp:
+        before = os.path.join(tmp, 'before.sqlite3')
+        after = os.path.join(tmp, 'after.sqlite3')
+        build_before(before, synthetic_visits(rows, random.Random(1)))
+        build_after(after, synthetic_visits(rows, random.Random(1)))
+        size_before = database_size(before)
+        size_after = database_size(after)
+
+    print(f'{rows} visits')
+    print(f'inline strings:     {size_before / 1024 / 1024:8.1f} MiB ({size_before / rows:.0f} bytes/visit)')
+    print(f'dictionary-encoded: {size_after / 1024 / 1024:8.1f} MiB ({size_after / rows:.0f} bytes/visit)')
+    print(f'saving:             {100 - size_after * 100 / size_before:8.1f} %')
+
+
+if __name__ == '__main__':
+    main()
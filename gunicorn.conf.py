@@ -0,0 +1,18 @@
+# Picked up automatically by gunicorn from the working directory
+import os
+import shutil
+
+
+def on_starting(server):
+    # Counters of a previous server run must not be added to this one
+    directory = os.getenv('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.metrics'))
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def worker_exit(server, worker):
+    # Let the visit writer drain its queue before the worker process goes away
+    from pages.tracking import visit_buffer
+    visit_buffer.shutdown(timeout=worker.cfg.graceful_timeout)
+    # Keep the final counts of this worker for /metrics
+    from pages.metrics import registry
+    registry.flush(force=True, final=True)
@@ -1,17 +1,141 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Visit
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db.models import Case, TextField, Value, When
+from django.db.models.functions import Concat, Length, Substr
+from django.db.models.lookups import GreaterThan
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.text import smart_split, unescape_string_literal
+from .export import CONTENT_TYPES, stream_export, visit_rows
+from .models import OutboundEmail, Visit
+from .search import search_visits
+
+USER_AGENT_DISPLAY_LENGTH = 50
+# Tables with fewer rows are counted exactly
+EXACT_COUNT_LIMIT = 10000
+
+
+def estimated_count(queryset):
+    """
+    Number of rows of the unfiltered ``queryset`` from its id range, two
+    index lookups on any table size. Ids only grow and pruning removes the
+    oldest rows, so the range is close. (PostgreSQL's reltuples would be
+    another option, but it stays 0 until the first autovacuum.)
+    """
+    ids = queryset.order_by('id').values_list('id', flat=True)
+    first, last = ids.first(), ids.last()
+    if first is None:
+        return 0
+    estimate = last - first + 1
+    return estimate if estimate > EXACT_COUNT_LIMIT else queryset.count()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts the whole table: unfiltered it shows the
+    estimated total, filtered or searched the exact count, cached for
+    VISIT_ADMIN_COUNT_TIMEOUT seconds.
+    """
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.has_filters():
+            return estimated_count(self.object_list)
+        try:
+            sql, params = query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'visit-admin-count:' + hashlib.sha1(f'{sql}{params}'.encode()).hexdigest()
+        return cache.get_or_set(key, lambda: Paginator.count.func(self), settings.VISIT_ADMIN_COUNT_TIMEOUT)
+
+
+class MethodListFilter(admin.SimpleListFilter):
+    # The default filter reads the distinct methods from the whole table
+    title = 'method'
+    parameter_name = 'method'
+
+    def lookups(self, request, model_admin):
+        return [(method, method) for method in ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(method=self.value())
+        return queryset
+
 
 @admin.register(Visit)
 class VisitAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'path', 'method', 'ip_address_anonymized', 'user_agent_truncated')
-    list_filter = ('method', 'timestamp')
-    search_fields = ('path', 'user_agent', 'referer')
+    list_filter = (MethodListFilter, 'timestamp')
+    search_fields = ('path', 'user_agent__value', 'referer__value')
+    search_help_text = 'Pfad, User Agent oder Referer enthält den Suchbegriff.'
     readonly_fields = ('timestamp', 'path', 'method', 'user_agent', 'ip_address_anonymized', 'referer')
+    actions = ['export_csv', 'export_jsonl']
+    # The visit table grows without bound: no exact COUNT(*) of it, no facet counts
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    def get_queryset(self, request):
+        # Only the shortened user agent is fetched, not the whole string of every row
+        return super().get_queryset(request).annotate(user_agent_display=Case(
+            When(
+                GreaterThan(Length('user_agent__value'), USER_AGENT_DISPLAY_LENGTH),
+                then=Concat(Substr('user_agent__value', 1, USER_AGENT_DISPLAY_LENGTH), Value('...')),
+            ),
+            default='user_agent__value',
+            output_field=TextField(),
+        ))
 
+    def get_search_results(self, request, queryset, search_term):
+        # Every word (or quoted phrase) has to match, like the default search
+        for term in smart_split(search_term):
+            if term.startswith(('"', "'")) and term[0] == term[-1]:
+                term = unescape_string_literal(term)
+            queryset = search_visits(queryset, term)
+        return queryset, False
+
+    @admin.display(description='User Agent')
     def user_agent_truncated(self, obj):
-        return obj.user_agent[:50] + '...' if obj.user_agent and len(obj.user_agent) > 50 else obj.user_agent
-    user_agent_truncated.short_description = 'User Agent'
+        return obj.user_agent_display
 
     def has_add_permission(self, request):
         return False # Analytics are read-only
 
+    @admin.action(description='Export selected visits as CSV')
+    def export_csv(self, request, queryset):
+        return self.export(request, queryset, 'csv')
+
+    @admin.action(description='Export selected visits as JSONL')
+    def export_jsonl(self, request, queryset):
+        return self.export(request, queryset, 'jsonl')
+
+    def export(self, request, queryset, fmt):
+        # Streamed row by row, "select all" on millions of visits is fine.
+        # Compressed on the fly for browsers, they store it uncompressed.
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        response = StreamingHttpResponse(
+            stream_export(visit_rows(queryset), fmt, compress=compress), content_type=CONTENT_TYPES[fmt])
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        response['Content-Disposition'] = f'attachment; filename="visits-{timezone.localdate():%Y-%m-%d}.{fmt}"'
+        return response
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+
+    def has_add_permission(self, request):
+        return False # Only the contact form queues emails
@@ -0,0 +1,131 @@
+"""
+Queries behind the analytics on the status dashboard.
+
+Every query filters on a plain range of the indexed column (never on
+``__date`` or another function of it) so the database can seek into an
+index. The plans below are what SQLite reports for them; regenerate them
+with ``python -m benchmarks.analytics``.
+
+time_series, hourly (VisitHourly, unique on hour, path)
+    SEARCH pages_visithourly USING INDEX sqlite_autoindex_pages_visithourly_1 (hour>? AND hour<?)
+time_series, for one path
+    SEARCH pages_visithourly USING INDEX visit_hourly_path_idx (path=? AND hour>? AND hour<?)
+top_paths (VisitDaily)
+    SEARCH pages_visitdaily USING INDEX visit_daily_path_idx (ANY(path) AND day>? AND day<?)
+top_referers (raw visits)
+    SEARCH pages_visit USING INDEX visit_referer_ts_idx (ANY(referer_id) AND timestamp>? AND timestamp<?)
+visit_page
+    SEARCH pages_visit USING INDEX pages_visit_timestamp_467fae5e (timestamp<?)
+visit_page, for one path
+    SEARCH pages_visit USING INDEX visit_path_ts_idx (path=? AND timestamp<?)
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Visit, VisitDaily, VisitHourly
+from .rollups import hour_bucket
+
+# Read-only connection if configured, see DATABASES
+DATABASE = 'analytics' if 'analytics' in settings.DATABASES else 'default'
+
+HOUR = 'hour'
+DAY = 'day'
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def day_start(day):
+    """Start of a local calendar day as an aware datetime."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def time_series(start, end, bucket=HOUR, path=None):
+    """
+    Visits per hour (UTC) or per local day in [start, end), read from the
+    rollups. ``start`` and ``end`` are datetimes for hours and dates for
+    days. Buckets without visits are included with 0.
+    """
+    if bucket == HOUR:
+        start, end = hour_bucket(start), hour_bucket(end)
+        rows = VisitHourly.objects.using(DATABASE).filter(hour__gte=start, hour__lt=end)
+        step = timedelta(hours=1)
+    else:
+        rows = VisitDaily.objects.using(DATABASE).filter(day__gte=start, day__lt=end)
+        step = timedelta(days=1)
+    if path is not None:
+        rows = rows.filter(path=path)
+    counts = dict(rows.order_by().values_list(bucket).annotate(total=Sum('count')))
+
+    series = []
+    current = start
+    while current < end:
+        series.append((current, counts.get(current, 0)))
+        current += step
+    return series
+
+
+def top_paths(start, end, limit=10):
+    """The most visited paths on the local days in [start, end)."""
+    return list(
+        VisitDaily.objects.using(DATABASE).filter(day__gte=start, day__lt=end)
+        .values('path')
+        .annotate(visits=Sum('count'))
+        .order_by('-visits', 'path')[:limit]
+    )
+
+
+def top_referers(start, end, limit=10):
+    """The most frequent referers of the visits on the local days in [start, end)."""
+    return list(
+        Visit.objects.using(DATABASE).filter(
+            timestamp__gte=day_start(start), timestamp__lt=day_start(end), referer__isnull=False,
+        )
+        .values('referer')
+        .annotate(visits=Sum('weight'))
+        .order_by('-visits', 'referer')
+        .values('referer__value', 'visits')[:limit]
+    )
+
+
+def percent_change(current, previous):
+    """Change from ``previous`` to ``current`` in percent, None without a baseline."""
+    if not previous:
+        return None
+    return round((current - previous) * 100 / previous)
+
+
+def encode_cursor(visit):
+    micros = (visit['timestamp'] - EPOCH) // timedelta(microseconds=1)
+    return f'{micros}-{visit["id"]}'
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) from a cursor, ValueError if it is malformed."""
+    micros, visit_id = cursor.split('-')
+    try:
+        return EPOCH + timedelta(microseconds=int(micros)), int(visit_id)
+    except OverflowError as e:  # beyond the datetime range
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+
+def visit_page(cursor=None, limit=50, path=None):
+    """
+    One page of visits, newest first, and the cursor of the next page (or
+    None). Pages are addressed by the (timestamp, id) of the last row seen
+    instead of an OFFSET, so late pages cost the same as the first one.
+    """
+    visits = Visit.objects.using(DATABASE).order_by('-timestamp', '-id')
+    if path is not None:
+        visits = visits.filter(path=path)
+    if cursor:
+        timestamp, visit_id = decode_cursor(cursor)
+        # (timestamp, id) < cursor, with a plain upper bound the index can seek to
+        visits = visits.filter(Q(timestamp__lt=timestamp) | Q(id__lt=visit_id), timestamp__lte=timestamp)
+    rows = list(visits.values(
+        'id', 'timestamp', 'path', 'method', 'ip_address_anonymized', 'weight',
+    )[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class PagesConfig(AppConfig):
     name = 'pages'
+
+    def ready(self):
+        from .revision import git_revision
+
+        # Resolve the revision at process start, not on the first dashboard load
+        git_revision()
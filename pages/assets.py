@@ -0,0 +1,337 @@
+"""
+Build step for the site's CSS, fonts and scripts: ``manage.py build_assets``,
+which collectstatic runs first.
+
+The sources are in ASSETS_SOURCE_DIR: the site stylesheet (css/site.css),
+Bootstrap and Font Awesome (vendor/), and optionally Inter (fonts/). The
+build writes to ASSETS_OUTPUT_DIR, which is collected as static/dist/:
+
+- site.css: Bootstrap, the icon styles and the site stylesheet in one file,
+  without the rules whose selectors cannot match anything in the templates
+- critical.css: the rules needed above the fold (top bar, navigation and
+  the first section of every page), inlined by {% critical_css %}
+- fonts/: the icon fonts reduced to the icons in use and Inter reduced to
+  Latin-1, as WOFF2. Without fontTools the fonts are copied unchanged.
+- bootstrap.min.js
+- img/: responsive variants of the images, see pages/images.py
+- manifest.json: what was built, read by the template tags
+
+Like every other static file the output gets hashed names from the
+manifest storage, which WhiteNoise serves with a year-long immutable
+Cache-Control.
+"""
+import json
+import logging
+import re
+import shutil
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .images import build_images
+
+try:
+    from fontTools import subset as font_subset
+except ImportError:  # optional, fonts are copied unchanged without it
+    font_subset = None
+
+# Static files prefix of ASSETS_OUTPUT_DIR
+STATIC_PREFIX = 'dist/'
+
+CSS_SOURCES = [
+    'vendor/bootstrap/bootstrap.min.css',
+    'vendor/fontawesome/fontawesome.min.css',
+    'vendor/fontawesome/solid.min.css',
+    'vendor/fontawesome/brands.min.css',
+    'css/site.css',
+]
+ICON_FONTS = ['vendor/fontawesome/fa-solid-900.woff2', 'vendor/fontawesome/fa-brands-400.woff2']
+SCRIPTS = ['vendor/bootstrap/bootstrap.min.js']
+
+# Set by Bootstrap's collapse and alert plugins and the scroll reveal script
+DYNAMIC_CLASSES = {'active', 'collapse', 'collapsed', 'collapsing', 'fade', 'show'}
+
+# Inter is cut down to Latin-1 plus dashes, quotes, bullet, ellipsis and the euro sign
+TEXT_UNICODES = [
+    *range(0x20, 0x7f), *range(0xa0, 0x100),
+    0x2013, 0x2014, 0x2018, 0x2019, 0x201a, 0x201c, 0x201d, 0x201e, 0x2022, 0x2026, 0x20ac,
+]
+
+COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CLASS_ATTRIBUTE = re.compile(r'\bclass="([^"]*)"')
+DATA_ATTRIBUTE = re.compile(r'\s(data-[\w-]+)=')
+HTML_TAG = re.compile(r'<([a-zA-Z][\w-]*)')
+TEMPLATE_TAG = re.compile(r'{%.*?%}|{#.*?#}', re.S)
+TEMPLATE_VARIABLE = re.compile(r'{{.*?}}', re.S)
+TEMPLATE_TAG_NAME = re.compile(r'{%\s*(\w+)')
+# Elements rendered by our template tags
+TAG_ELEMENTS = {'picture': {'picture', 'source', 'img'}}
+# Classes set on form widgets in Python code: attrs={'class': '...'}
+WIDGET_CLASS = re.compile(r"""['"]class['"]\s*:\s*['"]([^'"]+)['"]""")
+
+SELECTOR_CLASS = re.compile(r'\.(-?[_a-zA-Z][\w-]*)')
+SELECTOR_DATA_ATTRIBUTE = re.compile(r'\[(data-[\w-]+)')
+# These match without the classes inside them
+NEGATION = re.compile(r':(?:not|is|where)\([^()]*\)')
+# What is left of a selector without these are its type selectors
+NOT_TYPE = re.compile(r'\[[^\]]*\]|::?[\w-]+(?:\([^()]*\))?|[.#][\w-]+')
+TYPE = re.compile(r'[a-zA-Z][\w-]*')
+ICON_CONTENT = re.compile(r'content:\s*"\\([0-9a-fA-F]+)"')
+FONT_URL = re.compile(r'url\(\.\./webfonts/([\w-]+)\.woff2\) format\("woff2"\)(?:,url\([^)]*\) format\("truetype"\))?')
+SOURCE_MAP = re.compile(r'^//# sourceMappingURL=.*$', re.M)
+KEYFRAMES = re.compile(r'@(?:-webkit-)?keyframes\s+([\w-]+)')
+
+
+class Usage:
+    """
+    Class names, class name prefixes and data attributes the markup can
+    contain. Elements are only checked when ``tags`` is given: forms
+    rendered from Python add elements the templates do not show.
+    """
+
+    def __init__(self, classes=(), prefixes=(), attributes=(), tags=None):
+        self.classes = set(classes)
+        self.prefixes = set(prefixes)
+        self.attributes = set(attributes)
+        self.tags = tags
+
+    def add_html(self, html):
+        for value in CLASS_ATTRIBUTE.findall(html):
+            value = TEMPLATE_TAG.sub(' ', value)
+            for token in value.split():
+                if '{{' in token:
+                    # alert-{{ message.tags }}: any class with that prefix
+                    prefix = token.split('{{')[0]
+                    if prefix:
+                        self.prefixes.add(prefix)
+                elif '}}' not in token:
+                    self.classes.add(token)
+        self.attributes.update(DATA_ATTRIBUTE.findall(TEMPLATE_VARIABLE.sub('', html)))
+        if self.tags is not None:
+            self.tags.update(tag.lower() for tag in HTML_TAG.findall(html))
+            for name in TEMPLATE_TAG_NAME.findall(html):
+                self.tags.update(TAG_ELEMENTS.get(name, ()))
+
+    def add_python(self, source):
+        for value in WIDGET_CLASS.findall(source):
+            self.classes.update(value.split())
+
+    def matches(self, selector):
+        plain = NEGATION.sub('', selector)
+        for name in SELECTOR_CLASS.findall(plain):
+            if name not in self.classes and not any(name.startswith(prefix) for prefix in self.prefixes):
+                return False
+        if self.tags is not None:
+            if any(tag.lower() not in self.tags for tag in TYPE.findall(NOT_TYPE.sub(' ', plain))):
+                return False
+        return all(name in self.attributes for name in SELECTOR_DATA_ATTRIBUTE.findall(plain))
+
+
+def parse(css):
+    """Top-level (prelude, block) pairs of a stylesheet; block is None for statements."""
+    rules = []
+    depth = 0
+    quote = None
+    start = opened = 0
+    for i, char in enumerate(css):
+        if quote:
+            if char == quote and css[i - 1] != '\\':
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                opened = i
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((css[start:opened].strip(), css[opened + 1:i]))
+                start = i + 1
+        elif char == ';' and depth == 0:
+            rules.append((css[start:i].strip(), None))
+            start = i + 1
+    return rules
+
+
+def split_selectors(prelude):
+    selectors = []
+    depth = 0
+    current = ''
+    for char in prelude:
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        if char == ',' and depth == 0:
+            selectors.append(current.strip())
+            current = ''
+        else:
+            current += char
+    selectors.append(current.strip())
+    return [selector for selector in selectors if selector]
+
+
+def _compact(text):
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def purge(css, usage):
+    """The rules of ``css`` that can apply to markup described by ``usage``, minified."""
+    output = []
+    for prelude, block in parse(css):
+        prelude = _compact(prelude)
+        if block is None:
+            if not prelude.startswith('@charset'):
+                output.append(f'{prelude};')
+        elif prelude.startswith(('@media', '@supports', '@container', '@layer')):
+            inner = purge(block, usage)
+            if inner:
+                output.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            # @font-face, @keyframes, @page: kept, unused keyframes are dropped later
+            output.append(f'{prelude}{{{_compact(block)}}}')
+        else:
+            selectors = [selector for selector in split_selectors(prelude) if usage.matches(selector)]
+            if selectors:
+                output.append(f'{",".join(selectors)}{{{_compact(block)}}}')
+    return ''.join(output)
+
+
+def drop_unused_keyframes(css):
+    rules = [
+        (KEYFRAMES.match(prelude), f'{prelude}{{{block}}}' if block is not None else f'{prelude};')
+        for prelude, block in parse(css)
+    ]
+    # Only rules outside @keyframes count, prefixed and plain ones name each other
+    used = ''.join(rule for match, rule in rules if not match)
+    return ''.join(
+        rule for match, rule in rules
+        if not match or re.search(rf'(?<![\w-]){re.escape(match.group(1))}(?![\w-])', used)
+    )
+
+
+def template_usage(templates, python_sources=(), above_the_fold=False):
+    """
+    Usage of the given template files. With ``above_the_fold`` only the
+    markup a visitor sees first counts: everything before <main> in the
+    base template and the first <section> of every page.
+    """
+    # Above the fold the whole markup is known, the elements count too
+    usage = Usage(DYNAMIC_CLASSES, tags={'html', 'body'} if above_the_fold else None)
+    for path in templates:
+        html = Path(path).read_text(encoding='utf-8')
+        if above_the_fold:
+            if '<main' in html:
+                html = html.split('<main')[0]
+            elif '</section>' in html:
+                html = html.split('{% block content %}', 1)[-1].split('</section>', 1)[0]
+            else:
+                continue
+        usage.add_html(html)
+    for path in python_sources:
+        usage.add_python(Path(path).read_text(encoding='utf-8'))
+    return usage
+
+
+def icon_codepoints(css):
+    return sorted({int(code, 16) for code in ICON_CONTENT.findall(css)})
+
+
+def subset_font(source, target, unicodes):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if font_subset is None:
+        shutil.copyfile(source, target)
+        return
+    # Font Awesome's head table has padding fontTools warns about on every load
+    logging.getLogger('fontTools.ttLib.tables._h_e_a_d').setLevel(logging.ERROR)
+    options = font_subset.Options()
+    options.flavor = 'woff2'
+    font = font_subset.load_font(str(source), options)
+    subsetter = font_subset.Subsetter(options)
+    subsetter.populate(unicodes=unicodes)
+    subsetter.subset(font)
+    font_subset.save_font(font, str(target), options)
+
+
+def find_text_font(source_dir):
+    """The Inter font in assets/fonts/, the variable one preferably, or None."""
+    fonts = sorted((source_dir / 'fonts').glob('Inter*.woff2')) + sorted((source_dir / 'fonts').glob('Inter*.ttf'))
+    variable = [font for font in fonts if 'Variable' in font.name and 'Italic' not in font.name]
+    return (variable or fonts or [None])[0]
+
+
+def build(source_dir=None, output_dir=None, templates=None):
+    """Build everything into ``output_dir``. Returns {file name: size in bytes}."""
+    source_dir = Path(source_dir or settings.ASSETS_SOURCE_DIR)
+    output_dir = Path(output_dir or settings.ASSETS_OUTPUT_DIR)
+    if templates is None:
+        templates = sorted(Path(settings.TEMPLATES[0]['DIRS'][0]).glob('*.html'))
+    python_sources = sorted(Path(__file__).parent.glob('*.py'))
+
+    banners = []
+    sources = []
+    for name in CSS_SOURCES:
+        css = (source_dir / name).read_text(encoding='utf-8')
+        # License headers stay, all other comments go
+        banners += [comment for comment in COMMENT.findall(css) if comment.startswith('/*!')]
+        sources.append(COMMENT.sub('', css))
+    # Only the WOFF2 files are shipped, every browser we support reads them
+    css = FONT_URL.sub(r'url(fonts/\1.woff2) format("woff2")', '\n'.join(sources))
+
+    text_font = find_text_font(source_dir)
+    if text_font is not None:
+        css += (
+            '@font-face{font-family:"Inter";font-style:normal;font-weight:300 700;font-display:swap;'
+            'src:url(fonts/inter.woff2) format("woff2")}'
+        )
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    (output_dir / 'fonts').mkdir(parents=True)
+
+    site_css = drop_unused_keyframes(purge(css, template_usage(templates, python_sources)))
+    critical_css = drop_unused_keyframes(purge(css, template_usage(templates, above_the_fold=True)))
+    (output_dir / 'site.css').write_text('@charset "UTF-8";' + ''.join(banners) + site_css, encoding='utf-8')
+    (output_dir / 'critical.css').write_text(critical_css, encoding='utf-8')
+
+    icons = icon_codepoints(site_css)
+    for name in ICON_FONTS:
+        subset_font(source_dir / name, output_dir / 'fonts' / Path(name).name, icons)
+    if text_font is not None:
+        subset_font(text_font, output_dir / 'fonts' / 'inter.woff2', TEXT_UNICODES)
+    for name in SCRIPTS:
+        # The source maps are not shipped, the manifest storage fails on references to them
+        script = SOURCE_MAP.sub('', (source_dir / name).read_text(encoding='utf-8'))
+        (output_dir / Path(name).name).write_text(script, encoding='utf-8')
+
+    images, _ = build_images(settings.IMAGES_SOURCE_DIR, output_dir, settings.IMAGE_CACHE_DIR)
+
+    sizes = {
+        str(path.relative_to(output_dir)): path.stat().st_size
+        for path in sorted(output_dir.rglob('*')) if path.is_file()
+    }
+    manifest = {'text_font': text_font is not None, 'icons': len(icons), 'images': images, 'files': sizes}
+    (output_dir / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+    load_build.cache_clear()
+    return sizes
+
+
+@lru_cache(maxsize=4)
+def load_build(output_dir):
+    """(manifest, critical css) of a build, or (None, '') before the first one."""
+    output_dir = Path(output_dir)
+    try:
+        manifest = json.loads((output_dir / 'manifest.json').read_text())
+        critical = (output_dir / 'critical.css').read_text(encoding='utf-8')
+    except (OSError, ValueError):
+        return None, ''
+    return manifest, critical
+
+
+@receiver(setting_changed)
+def _reset_build(setting, **kwargs):
+    if setting == 'ASSETS_OUTPUT_DIR':
+        load_build.cache_clear()
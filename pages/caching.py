@@ -0,0 +1,118 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+
+from .revision import deploy_version, pages_last_modified
+
+
+def has_session_cookies(request):
+    return settings.SESSION_COOKIE_NAME in request.COOKIES or CookieStorage.cookie_name in request.COOKIES
+
+
+def is_cacheable(request):
+    """
+    Whether the page can be served from a cache: a plain GET or HEAD by an
+    anonymous visitor without pending messages. Without a session or
+    messages cookie neither can be present, so the session is not even
+    loaded (which would also add ``Vary: Cookie`` to the response).
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if not has_session_cookies(request):
+        return True
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return False
+    return not len(get_messages(request))
+
+
+def page_cache_key(request):
+    # The query string is ignored, the content pages do not read it
+    # (and campaign parameters would otherwise fill the cache).
+    return f'page:{deploy_version()}:{get_language()}:{request.path}'
+
+
+def page_etag(request):
+    """Strong validator for a content page, identical in every worker running the same deploy."""
+    key = page_cache_key(request).encode('utf-8')
+    return quote_etag(hashlib.sha1(key).hexdigest()[:20])
+
+
+def _storable(response, request):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def _add_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=settings.PAGE_MAX_AGE)
+    return response
+
+
+def cached_page(view):
+    """
+    For content pages that are the same for every anonymous visitor.
+
+    With PAGE_VALIDATORS_ENABLED, responses carry an ETag derived from the
+    deploy version, a Last-Modified of the newest template or deploy (see
+    pages_last_modified) and a public Cache-Control header, and
+    matching If-None-Match / If-Modified-Since requests are answered with
+    304 before anything is rendered.
+
+    With PAGE_CACHE_ENABLED, the rendered HTML is stored in the
+    PAGE_CACHE_ALIAS cache, keyed by deploy version, language and URL, so a
+    deploy starts with a fresh cache.
+
+    Requests by logged-in users or with pending messages, and responses
+    that used the CSRF token or set cookies, get neither.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        validators = settings.PAGE_VALIDATORS_ENABLED
+        use_cache = settings.PAGE_CACHE_ENABLED
+        if not (validators or use_cache) or not is_cacheable(request):
+            return view(request, *args, **kwargs)
+
+        if validators:
+            etag = page_etag(request)
+            last_modified = pages_last_modified()
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return _add_validators(response, etag, last_modified)
+
+        response = None
+        if use_cache:
+            cache = caches[settings.PAGE_CACHE_ALIAS]
+            key = page_cache_key(request)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if not _storable(response, request):
+                return response
+            if use_cache:
+                cache.set(key, (response.content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+
+        if validators:
+            _add_validators(response, etag, last_modified)
+        return response
+
+    # Marks the route as static content (see prerender_pages)
+    wrapper.static_content = True
+    return wrapper
@@ -0,0 +1,128 @@
+"""
+The client address of a request and its anonymized form, stored with
+every visit (see VisitTrackingMiddleware).
+
+X-Forwarded-For is only believed as far as VISIT_TRUSTED_PROXIES reach.
+The header is read from the right, the hop our own proxy appended, and
+the first address that is not one of our proxies is the client. Anything
+further left was sent by the client itself and can be forged.
+
+Addresses are anonymized to their network, /24 for IPv4 and /48 for
+IPv6, by masking the packed address as an integer. Both lookups are
+cached per process: the same clients come back for every page.
+"""
+import socket
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+IPV4_MAPPED = bytes(10) + b'\xff\xff'  # ::ffff:192.0.2.1
+_AF_INET = socket.AF_INET
+_AF_INET6 = socket.AF_INET6
+
+
+def _mask(bits, prefix):
+    return ((1 << prefix) - 1) << (bits - prefix)
+
+
+_IPV4_MASK = _mask(32, IPV4_PREFIX)
+_IPV6_MASK = _mask(128, IPV6_PREFIX)
+
+
+def parse_ip(value):
+    """
+    (version, integer) of an address as found in a header, or None if it is
+    not one. Accepts surrounding whitespace, a port, brackets and a zone id;
+    IPv4-mapped IPv6 addresses count as IPv4.
+    """
+    value = value.strip()
+    if value.startswith('['):  # [2001:db8::1]:443
+        value, bracket, _ = value[1:].partition(']')
+        if not bracket:
+            return None
+    elif value.count(':') == 1:  # 192.0.2.1:8080
+        value = value.partition(':')[0]
+    # The zone id only means something on the host itself
+    value = value.partition('%')[0]
+    try:
+        if ':' in value:
+            packed = socket.inet_pton(_AF_INET6, value)
+            if packed[:12] == IPV4_MAPPED:
+                return 4, int.from_bytes(packed[12:], 'big')
+            return 6, int.from_bytes(packed, 'big')
+        return 4, int.from_bytes(socket.inet_pton(_AF_INET, value), 'big')
+    except (OSError, ValueError):  # ValueError for embedded NUL characters
+        return None
+
+
+@lru_cache(maxsize=4096)
+def anonymize_ip(value):
+    """The network of an address, /24 or /48, in canonical form; None if ``value`` is not an address."""
+    address = parse_ip(value) if value else None
+    if address is None:
+        return None
+    version, number = address
+    if version == 4:
+        return socket.inet_ntop(_AF_INET, (number & _IPV4_MASK).to_bytes(4, 'big'))
+    return socket.inet_ntop(_AF_INET6, (number & _IPV6_MASK).to_bytes(16, 'big'))
+
+
+@lru_cache(maxsize=1)
+def _trusted_networks():
+    """{version: ((network, mask), ...)} of VISIT_TRUSTED_PROXIES."""
+    networks = {4: [], 6: []}
+    for entry in settings.VISIT_TRUSTED_PROXIES:
+        address, _, prefix = entry.partition('/')
+        parsed = parse_ip(address)
+        if parsed is None:
+            raise ImproperlyConfigured(f'VISIT_TRUSTED_PROXIES: {entry!r} is not an address or network.')
+        version, number = parsed
+        bits = 32 if version == 4 else 128
+        if not prefix:
+            prefix = bits
+        elif not prefix.isdigit() or int(prefix) > bits:
+            raise ImproperlyConfigured(f'VISIT_TRUSTED_PROXIES: {entry!r} has an invalid prefix length.')
+        mask = _mask(bits, int(prefix))
+        networks[version].append((number & mask, mask))
+    return {version: tuple(entries) for version, entries in networks.items()}
+
+
+@lru_cache(maxsize=4096)
+def is_trusted_proxy(value):
+    address = parse_ip(value)
+    if address is None:
+        return False
+    version, number = address
+    for network, mask in _trusted_networks()[version]:
+        if number & mask == network:
+            return True
+    return False
+
+
+def client_ip(meta):
+    """
+    The address of the client that sent a request, from its ``request.META``.
+    Unchanged from the header, anonymize_ip() parses it.
+    """
+    remote_addr = meta.get('REMOTE_ADDR') or ''
+    forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+    if not forwarded_for or not is_trusted_proxy(remote_addr):
+        return remote_addr or None
+    hops = [hop.strip() for hop in forwarded_for.split(',')]
+    for hop in reversed(hops):
+        if hop and not is_trusted_proxy(hop):
+            return hop
+    # Only our own proxies: a request from inside
+    return next((hop for hop in hops if hop), remote_addr)
+
+
+@receiver(setting_changed)
+def _clear_trusted_proxies(setting, **kwargs):
+    if setting == 'VISIT_TRUSTED_PROXIES':
+        _trusted_networks.cache_clear()
+        is_trusted_proxy.cache_clear()
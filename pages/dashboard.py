@@ -0,0 +1,66 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Q, Sum
+from django.db.utils import OperationalError
+from django.utils import timezone
+
+from .analytics import DATABASE, percent_change
+from .models import Visit, VisitDaily
+from .revision import git_revision
+
+CACHE_KEY = 'status:snapshot'
+
+_compute_lock = threading.Lock()
+
+
+def compute_status_snapshot():
+    """All dashboard figures: one aggregate over the daily rollup plus the latest visits."""
+    today = timezone.localdate()
+    snapshot = {
+        'db_status': 'ok',
+        'debug_mode': settings.DEBUG,
+        'git_commit': git_revision(),
+        'generated_at': timezone.now(),
+        'visits_today': 0,
+        'visits_yesterday': 0,
+        'visits_total': 0,
+        'paths_today': 0,
+        'visits_delta': None,
+        'latest_visits': [],
+    }
+    try:
+        snapshot.update(VisitDaily.objects.using(DATABASE).aggregate(
+            visits_total=Sum('count', default=0),
+            visits_today=Sum('count', filter=Q(day=today), default=0),
+            visits_yesterday=Sum('count', filter=Q(day=today - timedelta(days=1)), default=0),
+            paths_today=Count('path', filter=Q(day=today), distinct=True),
+        ))
+        snapshot['visits_delta'] = percent_change(snapshot['visits_today'], snapshot['visits_yesterday'])
+        snapshot['latest_visits'] = list(
+            Visit.objects.using(DATABASE).values('timestamp', 'path', 'method', 'ip_address_anonymized')[:10]
+        )
+    except OperationalError:
+        # A failing query is the database check
+        snapshot['db_status'] = 'error'
+    return snapshot
+
+
+def get_status_snapshot():
+    """
+    The dashboard snapshot, recomputed at most once per STATUS_CACHE_TTL
+    seconds no matter how many admins poll it.
+    """
+    cache = caches[settings.STATUS_CACHE_ALIAS]
+    snapshot = cache.get(CACHE_KEY)
+    if snapshot is not None:
+        return snapshot
+    with _compute_lock:
+        # Another request may have computed it while we were waiting
+        snapshot = cache.get(CACHE_KEY)
+        if snapshot is None:
+            snapshot = compute_status_snapshot()
+            cache.set(CACHE_KEY, snapshot, settings.STATUS_CACHE_TTL)
+    return snapshot
@@ -0,0 +1,75 @@
+import re
+
+from django.conf import settings
+
+# Trie node markers
+_PREFIX = object()
+_EXACT = object()
+
+
+def _insert(trie, path, marker):
+    node = trie
+    for char in path:
+        node = node.setdefault(char, {})
+    node[marker] = True
+
+
+def _node_pattern(node):
+    if node.get(_PREFIX):
+        # Everything below a prefix rule is excluded anyway
+        return ''
+    branches = [
+        re.escape(char) + _node_pattern(child)
+        for char, child in sorted((k, v) for k, v in node.items() if isinstance(k, str))
+    ]
+    if node.get(_EXACT):
+        branches.append(r'\Z')
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')'
+
+
+def compile_paths(prefixes=(), paths=()):
+    """
+    Compile prefix and exact-path rules into one regex shaped like a trie.
+    Every alternation branches on a distinct character, so matching walks
+    the path once no matter how many rules there are. Returns None for an
+    empty rule set.
+    """
+    if not prefixes and not paths:
+        return None
+    trie = {}
+    for prefix in prefixes:
+        _insert(trie, prefix, _PREFIX)
+    for path in paths:
+        _insert(trie, path, _EXACT)
+    return re.compile(_node_pattern(trie))
+
+
+class ExclusionRules:
+    """
+    Requests that should not be recorded as visits. Rules are compiled once;
+    see VISIT_TRACKING_EXCLUDE in the settings for the available keys.
+    """
+
+    def __init__(self, prefixes=(), paths=(), user_agents=(), methods=(), statuses=()):
+        self._paths = compile_paths(prefixes, paths)
+        self._user_agents = re.compile('|'.join(f'(?:{p})' for p in user_agents), re.IGNORECASE) if user_agents else None
+        self._methods = frozenset(method.upper() for method in methods)
+        self._statuses = frozenset(statuses)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**settings.VISIT_TRACKING_EXCLUDE)
+
+    def excludes(self, path, method='GET', user_agent=''):
+        if method in self._methods:
+            return True
+        if self._paths is not None and self._paths.match(path):
+            return True
+        if user_agent and self._user_agents is not None and self._user_agents.search(user_agent):
+            return True
+        return False
+
+    def excludes_status(self, status_code):
+        return status_code in self._statuses
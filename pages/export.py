@@ -0,0 +1,122 @@
+import csv
+import gzip
+import json
+
+from django.utils.text import compress_sequence
+
+# Column name -> lookup passed to values_list()
+VISIT_EXPORT = {
+    'id': 'id',
+    'timestamp': 'timestamp',
+    'path': 'path',
+    'method': 'method',
+    'user_agent': 'user_agent__value',
+    'ip_address_anonymized': 'ip_address_anonymized',
+    'referer': 'referer__value',
+    'weight': 'weight',
+}
+VISIT_COLUMNS = tuple(VISIT_EXPORT)
+VISIT_FIELDS = tuple(VISIT_EXPORT.values())
+
+FORMATS = ('jsonl', 'csv')
+CONTENT_TYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Lines are joined into blocks of about this many characters before they
+# are written or compressed, one write per line would dominate
+BLOCK_SIZE = 64 * 1024
+
+# Spreadsheets run cells starting with these as formulas. Paths, user agents
+# and referers come from the client, so in exports such cells are quoted
+# with '. Archives keep the values as stored.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Echo:
+    """File-like object whose write() hands the line back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    return value
+
+
+def _escaped_csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return _csv_cell(value)
+
+
+def serialize_rows(rows, fmt, fields=VISIT_COLUMNS, escape_formulas=False):
+    """
+    Yield text lines for an iterable of value tuples. CSV output starts
+    with a header line. With ``escape_formulas`` CSV text that a
+    spreadsheet would run as a formula is escaped.
+    """
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        cell = _escaped_csv_cell if escape_formulas else _csv_cell
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([cell(value) for value in row])
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), default=str, ensure_ascii=False) + '\n'
+    else:
+        raise ValueError(f'Unknown export format: {fmt}')
+
+
+def write_archive(path, rows, fmt, fields=VISIT_COLUMNS):
+    """Stream rows into a gzip-compressed file. Returns the number of rows written."""
+    written = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as fh:
+        for line in serialize_rows(rows, fmt, fields):
+            fh.write(line)
+            written += 1
+    # Do not count the CSV header
+    return written - 1 if fmt == 'csv' else written
+
+
+def archived_ids(path, fmt):
+    """The ids of the rows in an archive file written by write_archive()."""
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as fh:
+        if fmt == 'csv':
+            reader = csv.reader(fh)
+            next(reader, None)
+            return {int(row[0]) for row in reader}
+        return {json.loads(line)['id'] for line in fh}
+
+
+def visit_rows(queryset, chunk_size=2000):
+    """
+    Value tuples (VISIT_FIELDS) of the visits in ``queryset`` in id order,
+    fetched ``chunk_size`` rows at a time so memory use does not grow with
+    the number of rows.
+    """
+    return queryset.order_by('id').values_list(*VISIT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def in_blocks(lines, size=BLOCK_SIZE):
+    block = []
+    length = 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield ''.join(block)
+
+
+def stream_export(rows, fmt, compress=False):
+    """
+    Bytes of the serialized rows for a download or export file, formulas
+    escaped, gzip-compressed on the fly with ``compress``.
+    """
+    blocks = (block.encode() for block in in_blocks(serialize_rows(rows, fmt, escape_formulas=True)))
+    return compress_sequence(blocks) if compress else blocks
@@ -0,0 +1,152 @@
+"""
+Readiness probes for /health/ready.
+
+The probes run concurrently, each with HEALTH_PROBE_TIMEOUT seconds. The
+combined result is kept for HEALTH_CACHE_TTL seconds and computed by one
+request at a time, so a load balancer polling every worker many times a
+second causes at most one round of probes per worker and interval.
+
+Only PROBES decide readiness. INFO_PROBES are reported in the response
+but never take a worker out of the load balancer: web requests do not
+send mail (the send_queued_mail worker does, see mail_queue_pending on
+/metrics). They run at most once per HEALTH_INFO_TTL seconds.
+"""
+import logging
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+SKIPPED = 'skipped'
+
+# Shared by all checks. A probe that hangs past its timeout keeps its
+# thread, the pool limits how many can pile up.
+_executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix='health')
+_lock = threading.Lock()
+_cached = None
+_cached_at = 0.0
+_info = None
+_info_at = 0.0
+_migrated = False
+
+
+def check_database():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+def check_migrations():
+    global _migrated
+    # Applied migrations stay applied, the graph is only loaded until they are
+    if _migrated:
+        return
+    executor = MigrationExecutor(connection)
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    if plan:
+        raise RuntimeError(f'{len(plan)} unapplied migrations')
+    _migrated = True
+
+
+def check_cache():
+    cache = caches['default']
+    key = f'health:{threading.get_ident()}'
+    cache.set(key, 1, 10)
+    if cache.get(key) != 1:
+        raise RuntimeError('value not stored')
+
+
+def check_static_manifest():
+    if not hasattr(staticfiles_storage, 'manifest_name'):
+        return SKIPPED
+    if not staticfiles_storage.manifest_storage.exists(staticfiles_storage.manifest_name):
+        raise RuntimeError('manifest missing, run collectstatic')
+
+
+def check_mail():
+    if settings.EMAIL_BACKEND != 'django.core.mail.backends.smtp.EmailBackend':
+        return SKIPPED
+    # Only the TCP connect and greeting, no login: we want to know the server is there
+    server = smtplib.SMTP(timeout=settings.HEALTH_PROBE_TIMEOUT)
+    try:
+        server.connect(settings.EMAIL_HOST, settings.EMAIL_PORT)
+    finally:
+        server.close()
+
+
+PROBES = {
+    'database': check_database,
+    'migrations': check_migrations,
+    'cache': check_cache,
+    'static_manifest': check_static_manifest,
+}
+
+INFO_PROBES = {
+    'mail': check_mail,
+}
+
+
+def _run(probe):
+    started = time.perf_counter()
+    try:
+        status = probe() or OK
+        error = None
+    except Exception as e:
+        logger.warning('Readiness probe %s failed: %s', probe.__name__, e)
+        status = ERROR
+        error = f'{type(e).__name__}: {e}'
+    finally:
+        # Probe threads are reused for other probes, do not leave connections open in them
+        connections.close_all()
+    return status, error, time.perf_counter() - started
+
+
+def run_probes(probes=None):
+    """Run all probes concurrently. Returns {name: {'status', 'ms'[, 'error']}}."""
+    probes = probes or PROBES
+    timeout = settings.HEALTH_PROBE_TIMEOUT
+    futures = {name: _executor.submit(_run, probe) for name, probe in probes.items()}
+    wait(futures.values(), timeout=timeout)
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            results[name] = {'status': TIMEOUT, 'ms': round(timeout * 1000)}
+            continue
+        status, error, seconds = future.result()
+        results[name] = {'status': status, 'ms': round(seconds * 1000, 1)}
+        if error:
+            results[name]['error'] = error
+    return results
+
+
+def readiness():
+    """(ready, results), computed at most once per HEALTH_CACHE_TTL seconds."""
+    global _cached, _cached_at, _info, _info_at
+    with _lock:
+        now = time.monotonic()
+        if _cached is None or now - _cached_at >= settings.HEALTH_CACHE_TTL:
+            info_due = _info is None or now - _info_at >= settings.HEALTH_INFO_TTL
+            results = run_probes({**PROBES, **INFO_PROBES} if info_due else PROBES)
+            ready = all(results[name]['status'] in (OK, SKIPPED) for name in PROBES)
+            if info_due:
+                _info, _info_at = {name: results[name] for name in INFO_PROBES}, now
+            _cached, _cached_at = (ready, {**results, **_info}), now
+        return _cached
+
+
+def clear_cache():
+    global _cached, _info
+    with _lock:
+        _cached = _info = None
@@ -0,0 +1,96 @@
+"""
+Responsive variants of the images in IMAGES_SOURCE_DIR/img/, built by
+build_assets into img/ of its output: every image as AVIF and WebP at the
+WIDTHS up to its own width, for {% picture %}.
+
+Encoding, AVIF in particular, is slow, so the variants are kept in
+IMAGE_CACHE_DIR under the hash of the source file and the encoder
+settings: an unchanged image is never encoded again, only copied. The
+missing ones are encoded in a process pool.
+
+Pillow is optional: without it no variants are built and {% picture %}
+renders a plain <img>.
+"""
+import hashlib
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:  # optional, the original images are served without it
+    Image = None
+
+IMAGE_DIR = 'img'
+EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+WIDTHS = (160, 240, 320, 480, 640, 960, 1280, 1920)
+# In the order of the <source> elements, the browser takes the first it supports
+FORMATS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 80, 'method': 6},
+}
+
+
+def cache_key(data, width, fmt):
+    settings = f'{width}:{fmt}:{sorted(FORMATS[fmt].items())}'.encode()
+    return hashlib.sha256(data + settings).hexdigest()
+
+
+def encode(source, target, width, fmt):
+    """Write ``source`` resized to ``width`` as ``fmt``. Runs in the pool, so without Django."""
+    with Image.open(source) as image:
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        height = round(image.height * width / image.width)
+        if width != image.width:
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        tmp = Path(f'{target}.tmp')
+        image.save(tmp, fmt.upper(), **FORMATS[fmt])
+    # Never leave a half-written file in the cache
+    os.replace(tmp, target)
+
+
+def build_images(source_dir, output_dir, cache_dir):
+    """
+    Variants of every image under ``source_dir``/img/ into ``output_dir``.
+    Returns {static path: {'width', 'height', 'bytes', 'variants': {format: [[width, name]]}}},
+    names relative to ``output_dir``, and the number of variants encoded.
+    """
+    if Image is None:
+        return {}, 0
+    source_dir, output_dir, cache_dir = Path(source_dir), Path(output_dir), Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    images = {}
+    copies = []
+    jobs = []
+    for path in sorted((source_dir / IMAGE_DIR).rglob('*')):
+        if path.suffix.lower() not in EXTENSIONS:
+            continue
+        data = path.read_bytes()
+        with Image.open(path) as image:
+            size = image.size
+        name = path.relative_to(source_dir).as_posix()
+        widths = [width for width in WIDTHS if width < size[0]] + [size[0]]
+        variants = {}
+        for fmt in FORMATS:
+            variants[fmt] = []
+            for width in widths:
+                variant = f'{Path(name).with_suffix("")}-{width}w.{fmt}'
+                cached = cache_dir / f'{cache_key(data, width, fmt)}.{fmt}'
+                if not cached.exists():
+                    jobs.append((path, cached, width, fmt))
+                copies.append((cached, output_dir / variant))
+                variants[fmt].append([width, variant])
+        images[name] = {'width': size[0], 'height': size[1], 'bytes': len(data), 'variants': variants}
+
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(min(len(jobs), os.cpu_count() or 1)) as pool:
+            # list() to raise the first error
+            list(pool.map(encode, *zip(*jobs)))
+    elif jobs:
+        encode(*jobs[0])
+
+    for cached, target in copies:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(cached, target)
+    return images, len(jobs)
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, ProtectedError
+
+from .models import Referer, UserAgent, Visit
+
+
+class LookupCache:
+    """
+    In-process LRU cache from string to lookup-table id. Strings that are
+    not cached are resolved with one SELECT (after inserting the unknown
+    ones), so a batch of visits costs at most two queries per lookup table
+    and usually none. The size is set by VISIT_LOOKUP_CACHE_SIZE.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, values):
+        """Return a dict mapping every non-empty string in values to its id."""
+        ids = {}
+        missing = set()
+        with self._lock:
+            for value in values:
+                if not value or value in ids:
+                    continue
+                pk = self._ids.get(value)
+                if pk is None:
+                    missing.add(value)
+                else:
+                    self._ids.move_to_end(value)
+                    ids[value] = pk
+            self.hits += len(ids)
+            self.misses += len(missing)
+        if not missing:
+            return ids
+
+        by_digest = {self.model.make_digest(value): value for value in missing}
+        self.model.objects.bulk_create(
+            [self.model(value=value, digest=digest) for digest, value in by_digest.items()],
+            ignore_conflicts=True,
+        )
+        found = self.model.objects.filter(digest__in=by_digest).values_list('digest', 'id')
+        resolved = {by_digest[digest]: pk for digest, pk in found}
+        ids.update(resolved)
+
+        size = settings.VISIT_LOOKUP_CACHE_SIZE
+        if size > 0:
+            with self._lock:
+                self._ids.update(resolved)
+                while len(self._ids) > size:
+                    self._ids.popitem(last=False)
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+user_agents = LookupCache(UserAgent)
+referers = LookupCache(Referer)
+
+
+def encode_records(records):
+    """Replace the user agent and referer strings of visit records by lookup ids."""
+    ua_ids = user_agents.resolve(record.get('user_agent') for record in records)
+    referer_ids = referers.resolve(record.get('referer') for record in records)
+    encoded = []
+    for record in records:
+        record = dict(record)
+        record['user_agent_id'] = ua_ids.get(record.pop('user_agent', None))
+        record['referer_id'] = referer_ids.get(record.pop('referer', None))
+        encoded.append(record)
+    return encoded
+
+
+def clear_caches():
+    user_agents.clear()
+    referers.clear()
+
+
+def delete_unused(batch_size=500, pause=0.0):
+    """
+    Delete user agents and referers that no visit refers to anymore, e.g.
+    after old visits were pruned. Works in batches of ascending id and
+    returns the number of rows deleted. A worker that still has a deleted id
+    cached fails its next write, clears its caches and retries.
+    """
+    deleted = 0
+    for model, field in ((UserAgent, 'user_agent'), (Referer, 'referer')):
+        unused = model.objects.filter(~Exists(Visit.objects.filter(**{field: OuterRef('pk')})))
+        last_id = 0
+        while True:
+            ids = list(unused.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            try:
+                with transaction.atomic():
+                    # Checked again: a visit may have been written since
+                    deleted += unused.filter(id__in=ids).delete()[0]
+            except (ProtectedError, IntegrityError):
+                pass  # in use again, left for the next run
+            if pause:
+                time.sleep(pause)
+    clear_caches()
+    return deleted
+
@@ -0,0 +1,125 @@
+import os
+import re
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from pages.export import FORMATS, VISIT_FIELDS, archived_ids, write_archive
+from pages.lookups import delete_unused
+from pages.models import Visit
+
+ARCHIVE_NAME = re.compile(r'visits-(\d+)-(\d+)\.(jsonl|csv)\.gz')
+
+
+class Command(BaseCommand):
+    help = (
+        'Export visits older than N days to gzip-compressed files and delete them. '
+        'Works through the table in chunks of ascending id and only deletes a chunk '
+        'once its archive file is complete, so an interrupted run can simply be '
+        'started again: rows it archived but did not delete are not archived twice. User agents and referers no visit uses anymore are deleted '
+        'afterwards. The visit rollups are left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.VISIT_RETENTION_DAYS,
+            help='Keep visits of the last N days (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--output-dir', default=settings.VISIT_ARCHIVE_DIR,
+            help='Directory for the archive files (default: %(default)s).',
+        )
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Rows per archive file (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows per DELETE statement (default: %(default)s).',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Seconds to sleep between DELETE batches to give live traffic the write lock.',
+        )
+        parser.add_argument(
+            '--no-archive', action='store_true',
+            help='Only delete, do not write archive files (prune).',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days must not be negative.')
+        if options['chunk_size'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--chunk-size and --batch-size must be positive.')
+
+        try:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+        except OverflowError:
+            raise CommandError('--days is too large.')
+        archive = not options['no_archive']
+        output_dir = Path(options['output_dir'])
+        archives = []
+        if archive:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            archives = self.existing_archives(output_dir)
+
+        old_visits = Visit.objects.filter(timestamp__lt=cutoff).order_by('id')
+        started = time.monotonic()
+        total = 0
+        last_id = 0
+
+        while True:
+            # Keyset pagination over the primary key keeps every query cheap
+            rows = list(old_visits.filter(id__gt=last_id).values_list(*VISIT_FIELDS)[:options['chunk_size']])
+            if not rows:
+                break
+            first_id, last_id = rows[0][0], rows[-1][0]
+
+            if archive:
+                # An interrupted run may have archived some of these rows already
+                done = set()
+                for low, high, path, fmt in archives:
+                    if low <= last_id and high >= first_id:
+                        done |= archived_ids(path, fmt)
+                pending = [row for row in rows if row[0] not in done]
+                if pending:
+                    name = f'visits-{pending[0][0]:012d}-{pending[-1][0]:012d}.{options["format"]}.gz'
+                    target = output_dir / name
+                    partial = output_dir / f'.{name}.part'
+                    write_archive(partial, pending, options['format'])
+                    os.replace(partial, target)
+
+            ids = [row[0] for row in rows]
+            for start in range(0, len(ids), options['batch_size']):
+                Visit.objects.filter(id__in=ids[start:start + options['batch_size']]).delete()
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+            total += len(rows)
+            elapsed = time.monotonic() - started
+            rate = total / elapsed if elapsed else 0
+            self.stdout.write(f'{total} visits processed (up to id {last_id}), {rate:.0f} rows/s')
+
+        elapsed = time.monotonic() - started
+        action = 'Archived and deleted' if archive else 'Deleted'
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {total} visits older than {cutoff:%Y-%m-%d %H:%M} in {elapsed:.1f}s ({rate:.0f} rows/s).'
+        ))
+        # The lookup rows of deleted visits would otherwise stay forever
+        unused = delete_unused(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {unused} user agents and referers no visit uses anymore.'))
+
+    def existing_archives(self, output_dir):
+        """(first id, last id, path, format) of the archive files in ``output_dir``."""
+        archives = []
+        for path in output_dir.iterdir():
+            match = ARCHIVE_NAME.fullmatch(path.name)
+            if match:
+                archives.append((int(match[1]), int(match[2]), path, match[3]))
+        return archives
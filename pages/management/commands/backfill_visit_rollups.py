@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pages.rollups import first_complete_day, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the hourly and daily visit rollups from the raw Visit table. '
+        'Days older than the oldest stored visit, and the day of that visit, '
+        'keep their rollups once visits have been archived or pruned.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Only rebuild the last N days (including today). Default: all data.',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days'] is not None:
+            since = timezone.localdate() - timedelta(days=options['days'] - 1)
+
+        complete = first_complete_day()
+        if complete is not None and (since is None or since < complete):
+            self.stdout.write(f'Visits before {complete} have been archived or pruned, their rollups are kept.')
+        hours, days = rebuild_rollups(since=since)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {hours} hourly and {days} daily buckets.'))
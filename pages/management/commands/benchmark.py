@@ -0,0 +1,340 @@
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, reverse
+
+from pages.metrics import registry
+from pages.models import Visit
+from pages.revision import git_revision
+from pages.tracking import visit_buffer
+from pages.urls import urlpatterns
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+]
+
+# Routes behind login_required/user_passes_test get a superuser session
+ADMIN_ROUTES = {'status', 'status_metrics', 'status_analytics', 'status_visits'}
+
+# Queries of the request currently being served, see _count_query
+_current = contextvars.ContextVar('benchmark_request', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _current.get()
+    if counter is not None:
+        counter['queries'] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(q / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive every route in pages/urls.py in-process through the WSGI and '
+        'ASGI applications and report latency percentiles, throughput, '
+        'queries per request, memory and database growth. Runs against a '
+        'throwaway test database and metrics directory.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per interface (default: %(default)s).')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight (default: %(default)s).')
+        parser.add_argument('--interface', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--routes', nargs='+', metavar='NAME', help='Only these URL names (default: all).')
+        parser.add_argument('--warmup', type=int, default=50, help='Untimed requests first (default: %(default)s).')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--no-memory', action='store_true',
+            help='Do not trace allocations. tracemalloc slows requests down noticeably.',
+        )
+        parser.add_argument('--json', metavar='PATH', help='Also write the results as JSON ("-" for stdout).')
+
+    def handle(self, *args, **options):
+        routes = self.routes(options['routes'])
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+        interfaces = ['wsgi', 'asgi'] if options['interface'] == 'both' else [options['interface']]
+
+        tmp = tempfile.TemporaryDirectory()
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+            # A file like in production; the in-memory test database locks
+            # whole tables under concurrent requests instead of waiting
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp.name, 'benchmark.sqlite3')
+        # Synthetic requests stay out of the METRICS_DIR a running server reports
+        metrics = override_settings(METRICS_DIR=os.path.join(tmp.name, 'metrics'))
+        metrics.enable()
+        registry.reset()
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        # Other aliases, like the read-only 'analytics' one, read the same database
+        for alias in connections:
+            if alias != connection.alias:
+                connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        connection_created.connect(_install_counter)
+        _install_counter(None, connection)
+        try:
+            cookie = self.admin_cookie()
+            results = {
+                'meta': {
+                    'revision': git_revision(),
+                    'django': django.get_version(),
+                    'python': platform.python_version(),
+                    'database': connection.vendor,
+                    'requests': options['requests'],
+                    'concurrency': options['concurrency'],
+                    'seed': options['seed'],
+                    'routes': list(routes),
+                },
+                'interfaces': {},
+            }
+            for interface in interfaces:
+                results['interfaces'][interface] = self.run(interface, routes, cookie, options)
+        finally:
+            connection_created.disconnect(_install_counter)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            # Forget the counts, this also stops the flusher thread
+            registry.reset()
+            metrics.disable()
+            tmp.cleanup()
+
+        for interface, result in results['interfaces'].items():
+            self.report(interface, result)
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+        elif options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(f'Results written to {options["json"]}')
+
+    def routes(self, names):
+        routes = {
+            pattern.name: reverse(pattern.name)
+            for pattern in urlpatterns
+            if isinstance(pattern, URLPattern) and pattern.name and not pattern.pattern.converters
+        }
+        if names:
+            unknown = set(names) - set(routes)
+            if unknown:
+                raise CommandError(f'Unknown routes: {", ".join(sorted(unknown))}')
+            routes = {name: routes[name] for name in names}
+        return routes
+
+    def admin_cookie(self):
+        admin = User.objects.create_superuser(username='benchmark', password=None)
+        client = Client()
+        client.force_login(admin)
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    def workload(self, routes, cookie, count, seed):
+        rng = random.Random(seed)
+        names = list(routes)
+        for _ in range(count):
+            name = rng.choice(names)
+            ip = (f'203.0.{rng.randrange(256)}.{rng.randrange(1, 255)}' if rng.random() < 0.8
+                  else f'2001:db8:{rng.randrange(65536):x}::{rng.randrange(1, 65536):x}')
+            headers = {
+                'HTTP_USER_AGENT': rng.choice(USER_AGENTS),
+                'HTTP_ACCEPT_ENCODING': 'gzip, deflate, br',
+                'REMOTE_ADDR': ip,
+            }
+            if name in ADMIN_ROUTES:
+                headers['HTTP_COOKIE'] = cookie
+            yield name, routes[name], headers
+
+    def run(self, interface, routes, cookie, options):
+        runner = self.run_wsgi if interface == 'wsgi' else self.run_asgi
+        runner(list(self.workload(routes, cookie, options['warmup'], options['seed'] - 1)), options['concurrency'])
+        visit_buffer.flush()
+        visits_before = Visit.objects.count()
+        size_before = self.database_size()
+
+        workload = list(self.workload(routes, cookie, options['requests'], options['seed']))
+        if not options['no_memory']:
+            tracemalloc.start()
+        started = time.perf_counter()
+        samples = runner(workload, options['concurrency'])
+        elapsed = time.perf_counter() - started
+        peak = None
+        if not options['no_memory']:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        # Count what the request handlers buffered but did not write yet
+        visit_buffer.flush()
+        visits = Visit.objects.count() - visits_before
+        growth = self.database_size() - size_before
+
+        by_route = defaultdict(list)
+        for name, status, duration, queries in samples:
+            by_route[name].append((status, duration, queries))
+        return {
+            'throughput': round(len(samples) / elapsed, 1),
+            'elapsed': round(elapsed, 3),
+            'latency_ms': self.latency([duration for _, _, duration, _ in samples]),
+            'queries_per_request': round(statistics.mean(q for _, _, _, q in samples), 2),
+            'peak_memory_mib': round(peak / 1024 / 1024, 2) if peak is not None else None,
+            'visits_per_1k_requests': round(visits * 1000 / len(samples), 1),
+            'database_bytes_per_1k_requests': round(growth * 1000 / len(samples)) if growth is not None else None,
+            'routes': {
+                name: {
+                    'requests': len(rows),
+                    'statuses': sorted({status for status, _, _ in rows}),
+                    'latency_ms': self.latency([duration for _, duration, _ in rows]),
+                    'queries_per_request': round(statistics.mean(q for _, _, q in rows), 2),
+                }
+                for name, rows in sorted(by_route.items())
+            },
+        }
+
+    def latency(self, durations):
+        durations = sorted(d * 1000 for d in durations)
+        return {
+            'p50': round(percentile(durations, 50), 3),
+            'p95': round(percentile(durations, 95), 3),
+            'p99': round(percentile(durations, 99), 3),
+            'max': round(durations[-1], 3),
+        }
+
+    def database_size(self):
+        if connection.vendor != 'sqlite':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA page_count')
+            pages = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            return pages * cursor.fetchone()[0]
+
+    def run_wsgi(self, workload, concurrency):
+        application = get_wsgi_application()
+
+        def request(item):
+            name, path, headers = item
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'HTTP_HOST': 'testserver',
+                'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+                'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+                'wsgi.multiprocess': False, 'wsgi.run_once': False, **headers,
+            }
+            status = []
+            counter = {'queries': 0}
+            token = _current.set(counter)
+            started = time.perf_counter()
+            try:
+                response = application(environ, lambda s, h, exc_info=None: status.append(int(s[:3])))
+                for _ in response:
+                    pass
+                response.close()
+            finally:
+                _current.reset(token)
+            return name, status[0], time.perf_counter() - started, counter['queries']
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(request, workload))
+
+    def run_asgi(self, workload, concurrency):
+        application = get_asgi_application()
+
+        async def request(item, limit):
+            name, path, headers = item
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                'root_path': '', 'server': ('testserver', 80),
+                'client': (headers['REMOTE_ADDR'], 50000),
+                'headers': [(b'host', b'testserver')] + [
+                    (key[5:].lower().replace('_', '-').encode(), value.encode())
+                    for key, value in headers.items() if key.startswith('HTTP_')
+                ],
+            }
+            status = []
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            finished = asyncio.Event()
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                # Django listens for a disconnect while the view runs
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body'):
+                    finished.set()
+
+            async with limit:
+                counter = {'queries': 0}
+                token = _current.set(counter)
+                started = time.perf_counter()
+                try:
+                    await application(scope, receive, send)
+                finally:
+                    _current.reset(token)
+                return name, status[0], time.perf_counter() - started, counter['queries']
+
+        async def main():
+            limit = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(request(item, limit) for item in workload))
+
+        return asyncio.run(main())
+
+    def report(self, interface, result):
+        latency = result['latency_ms']
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{interface.upper()}'))
+        self.stdout.write(
+            f'  {result["throughput"]} req/s, p50 {latency["p50"]} ms, p95 {latency["p95"]} ms, '
+            f'p99 {latency["p99"]} ms, {result["queries_per_request"]} queries/request'
+        )
+        memory = result['peak_memory_mib']
+        growth = result['database_bytes_per_1k_requests']
+        self.stdout.write(
+            f'  peak memory {memory if memory is not None else "-"} MiB, '
+            f'{result["visits_per_1k_requests"]} visits and '
+            f'{growth if growth is not None else "-"} bytes per 1k requests'
+        )
+        for name, route in result['routes'].items():
+            self.stdout.write(
+                f'  {name:<18} {route["requests"]:>6}  p50 {route["latency_ms"]["p50"]:>8} ms  '
+                f'p99 {route["latency_ms"]["p99"]:>8} ms  {route["queries_per_request"]:>5} q  '
+                f'status {",".join(map(str, route["statuses"]))}'
+            )
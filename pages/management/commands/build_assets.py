@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pages.assets import build, find_text_font, font_subset
+from pages.images import Image
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the site CSS (unused rules removed), the inlined critical CSS, the '
+        'subset fonts and the image variants into ASSETS_OUTPUT_DIR. collectstatic runs this first.'
+    )
+
+    def handle(self, *args, **options):
+        sizes = build()
+        for name, size in sizes.items():
+            self.stdout.write(f'  {name:<28} {size / 1024:8.1f} KiB')
+        if font_subset is None:
+            self.stdout.write(self.style.WARNING('fontTools is not installed, fonts were copied without subsetting.'))
+        if Image is None:
+            self.stdout.write(self.style.WARNING('Pillow is not installed, images are served without responsive variants.'))
+        if find_text_font(settings.ASSETS_SOURCE_DIR) is None:
+            self.stdout.write(self.style.WARNING(
+                'No Inter font in assets/fonts/, pages fall back to the system font.'
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Built {len(sizes)} files to {settings.ASSETS_OUTPUT_DIR}.'))
@@ -0,0 +1,18 @@
+from django.contrib.staticfiles.management.commands.collectstatic import Command as CollectStaticCommand
+from django.core.management import call_command
+
+
+class Command(CollectStaticCommand):
+    help = CollectStaticCommand.help + ' Runs build_assets first.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--skip-build', action='store_true',
+            help='Collect the last build of the site assets instead of running build_assets.',
+        )
+
+    def handle(self, **options):
+        if not options['skip_build']:
+            call_command('build_assets', verbosity=options['verbosity'], stdout=self.stdout._out)
+        return super().handle(**options)
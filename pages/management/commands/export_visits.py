@@ -0,0 +1,83 @@
+import sys
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from pages.export import FORMATS, stream_export, visit_rows
+from pages.models import Visit
+
+
+def day_start(value, days=0):
+    """Start of the local day ``value`` (YYYY-MM-DD) plus ``days`` as an aware datetime."""
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}, expected YYYY-MM-DD.')
+    try:
+        start = timezone.make_aware(day + timedelta(days=days))
+        # Queried in UTC, which must exist as well
+        start.astimezone(dt_timezone.utc)
+    except OverflowError:  # --until 9999-12-31, --since 0001-01-01
+        raise CommandError(f'Date {value!r} is out of range.')
+    return start
+
+
+class Command(BaseCommand):
+    help = (
+        'Export visits as CSV or JSONL, optionally gzip-compressed, to a file or stdout. '
+        'Rows are streamed from the database in chunks, so memory use stays the same '
+        'whatever the number of visits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Target file, "-" for stdout. Compressed if it ends in .gz.')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--since', help='Only visits on or after this day (YYYY-MM-DD, local time).')
+        parser.add_argument('--until', help='Only visits on or before this day (YYYY-MM-DD, local time).')
+        parser.add_argument('--path-prefix', help='Only visits to paths starting with this, e.g. /kontakt/.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched from the database at a time (default: %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        visits = Visit.objects.all()
+        if options['since']:
+            visits = visits.filter(timestamp__gte=day_start(options['since']))
+        if options['until']:
+            visits = visits.filter(timestamp__lt=day_start(options['until'], days=1))
+        if options['path_prefix']:
+            visits = visits.filter(path__startswith=options['path_prefix'])
+
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for exported, row in enumerate(rows, 1):
+                yield row
+
+        to_stdout = options['output'] == '-'
+        compress = options['gzip'] or options['output'].endswith('.gz')
+        rows = counted(visit_rows(visits, options['chunk_size']))
+        started = time.monotonic()
+        target = sys.stdout.buffer if to_stdout else open(options['output'], 'wb')
+        try:
+            for block in stream_export(rows, options['format'], compress=compress):
+                target.write(block)
+        finally:
+            if to_stdout:
+                target.flush()
+            else:
+                target.close()
+
+        elapsed = time.monotonic() - started
+        rate = exported / elapsed if elapsed else 0
+        # The summary must not end up in the export
+        log = self.stderr if to_stdout else self.stdout
+        log.write(f'Exported {exported} visits in {elapsed:.1f}s ({rate:.0f} rows/s).', style_func=self.style.SUCCESS)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pages.prerender import brotli, prerender
+
+
+class Command(BaseCommand):
+    help = (
+        'Render all content pages (routes marked static_content) to HTML files with '
+        'gzip and, if the brotli package is installed, brotli variants. They are served '
+        'by PrerenderedPageMiddleware when PRERENDER_ENABLED is set.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir', default=settings.PRERENDER_ROOT,
+            help='Target directory (default: %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        manifest = prerender(options['output_dir'])
+        for path in manifest['pages']:
+            self.stdout.write(f'  {path}')
+        if brotli is None:
+            self.stdout.write(self.style.WARNING('brotli is not installed, only gzip variants were written.'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Pre-rendered {len(manifest["pages"])} pages to {options["output_dir"]}.'
+        ))
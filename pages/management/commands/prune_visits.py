@@ -0,0 +1,9 @@
+from .archive_visits import Command as ArchiveCommand
+
+
+class Command(ArchiveCommand):
+    help = 'Delete visits older than N days in small batches without archiving them.'
+
+    def handle(self, *args, **options):
+        options['no_archive'] = True
+        return super().handle(*args, **options)
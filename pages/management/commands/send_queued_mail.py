@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pages.metrics import registry
+from pages.outbox import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = (
+        'Send queued emails (e.g. from the contact form) in batches over one '
+        'connection. Run a single instance, e.g. as the worker process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new emails.')
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Seconds between polls with --loop (default: %(default)s).',
+        )
+        parser.add_argument('--batch-size', type=int, help='Emails per batch (default: MAIL_QUEUE_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_mail(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'{sent} sent, {failed} failed')
+            # SMTP errors of this process appear in /metrics of the web workers
+            registry.flush(force=not options['loop'], final=not options['loop'])
+            if not options['loop']:
+                break
+            # Go straight on while a full backlog is being worked off
+            if not sent and not failed:
+                time.sleep(options['interval'])
+            # Drop database connections that are broken or past CONN_MAX_AGE
+            close_old_connections()
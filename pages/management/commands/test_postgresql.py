@@ -0,0 +1,105 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+USER = 'suedwest'
+PASSWORD = 'suedwest'
+IMAGE = 'postgres:17'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while subprocess.run(check, capture_output=True).returncode != 0:
+        if time.monotonic() > deadline:
+            raise CommandError(f'{what} did not start within {timeout} s.')
+        time.sleep(0.5)
+
+
+@contextmanager
+def local_cluster(bin_dir):
+    """A cluster from initdb in a temporary directory, reachable only through its socket there."""
+    tool = lambda name: str(Path(bin_dir) / name) if bin_dir else name
+    if shutil.which(tool('initdb')) is None:
+        raise CommandError('initdb not found. Put the PostgreSQL binaries on PATH, pass --bin-dir or use --docker.')
+    with tempfile.TemporaryDirectory(prefix='suedwest-pg-') as tmp:
+        data = Path(tmp) / 'data'
+        subprocess.run(
+            [tool('initdb'), '-D', data, '-U', USER, '--auth=trust', '--no-sync', '-E', 'UTF8'],
+            check=True, capture_output=True,
+        )
+        # No TCP listener and no durability, this cluster lives for one test run
+        options = f"-k {tmp} -c listen_addresses='' -c fsync=off -c full_page_writes=off"
+        subprocess.run(
+            [tool('pg_ctl'), '-D', data, '-l', Path(tmp) / 'server.log', '-o', options, '-w', 'start'],
+            check=True, capture_output=True,
+        )
+        try:
+            yield {'POSTGRES_HOST': tmp, 'POSTGRES_PORT': '5432', 'POSTGRES_USER': USER, 'POSTGRES_DB': 'postgres'}
+        finally:
+            subprocess.run([tool('pg_ctl'), '-D', data, '-m', 'immediate', 'stop'], capture_output=True)
+
+
+@contextmanager
+def docker_cluster(image):
+    """A throwaway container of the official image, published on a free local port."""
+    if shutil.which('docker') is None:
+        raise CommandError('docker not found.')
+    port = _free_port()
+    container = subprocess.run(
+        ['docker', 'run', '-d', '--rm', '-p', f'127.0.0.1:{port}:5432',
+         '-e', f'POSTGRES_USER={USER}', '-e', f'POSTGRES_PASSWORD={PASSWORD}', image,
+         '-c', 'fsync=off', '-c', 'full_page_writes=off'],
+        check=True, capture_output=True, text=True,
+    ).stdout.strip()
+    try:
+        # The entrypoint restarts the server once after initialisation, wait for TCP
+        _wait(['docker', 'exec', container, 'pg_isready', '-h', '127.0.0.1', '-U', USER], 60, 'The container')
+        yield {'POSTGRES_HOST': '127.0.0.1', 'POSTGRES_PORT': str(port), 'POSTGRES_USER': USER,
+               'POSTGRES_PASSWORD': PASSWORD, 'POSTGRES_DB': USER}
+    finally:
+        subprocess.run(['docker', 'stop', container], capture_output=True)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the test suite against a throwaway PostgreSQL server: a temporary '
+        'cluster from initdb/pg_ctl, or with --docker a container of the official '
+        'image. The server is removed afterwards. Extra arguments go to "manage.py test".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docker', action='store_true', help=f'Use a {IMAGE} container instead of initdb.')
+        parser.add_argument('--image', default=IMAGE, help='Image for --docker (default: %(default)s).')
+        parser.add_argument(
+            '--bin-dir', default=os.getenv('PG_BIN', ''),
+            help='Directory with initdb and pg_ctl (default: $PG_BIN, else PATH).',
+        )
+        parser.add_argument('test_args', nargs='*', help='Test labels and options, e.g. pages -- --parallel 1.')
+
+    def handle(self, *args, **options):
+        if os.name == 'posix' and not options['docker'] and os.geteuid() == 0:
+            raise CommandError('PostgreSQL refuses to run as root. Run as another user or use --docker.')
+        cluster = docker_cluster(options['image']) if options['docker'] else local_cluster(options['bin_dir'])
+        with cluster as environ:
+            self.stdout.write(f'PostgreSQL ready ({"docker" if options["docker"] else "initdb"}), running the tests.')
+            env = dict(os.environ, DATABASE_ENGINE='postgresql', **environ)
+            command = [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'test', '--noinput',
+                       *(options['test_args'] or ['pages'])]
+            returncode = subprocess.run(command, env=env).returncode
+        if returncode:
+            raise CommandError(f'Tests failed against PostgreSQL (exit code {returncode}).')
@@ -0,0 +1,260 @@
+"""
+Prometheus metrics that add up over all worker processes.
+
+Every process keeps its counters and histograms in memory and writes them
+to its own file in METRICS_DIR, at most once every METRICS_FLUSH_INTERVAL
+seconds: after a request, and from a background thread so that an idle
+worker's last counts are written too. The /metrics view sums the files of
+all processes, taking live values for the process serving the scrape, so
+any worker returns the totals for the whole server. Files of exited
+workers are kept because their counters still count. Only their gauges
+are dropped. Files are named by PID and a random token, so a new worker
+that gets the PID of an exited one does not overwrite its counts.
+gunicorn.conf.py empties the directory when the server starts.
+
+Without METRICS_DIR every process only reports its own values.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import got_request_exception
+from django.db import DatabaseError
+from django.dispatch import receiver
+
+from .tracking import visit_buffer
+
+# Upper bounds of the request duration buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'http_requests_total': ('counter', 'Requests served, by route name, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time to produce a response, by route name.'),
+    'visit_queue_depth': ('gauge', 'Visits waiting in memory to be written.'),
+    'visits_written_total': ('counter', 'Visits written to the database.'),
+    'visits_dropped_total': ('counter', 'Visits discarded because the queue was full.'),
+    'database_errors_total': ('counter', 'Database errors in requests and visit writes.'),
+    'smtp_errors_total': ('counter', 'Failed attempts to send a queued email.'),
+    'mail_queue_pending': ('gauge', 'Emails waiting to be sent.'),
+}
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted((k, str(v)) for k, v in labels.items())])
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.name = f'worker-{self.pid}-{uuid.uuid4().hex[:12]}'
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._flushed_at = 0.0
+        self._written = None
+        # Threads do not survive a fork, a reset also stops the old flusher
+        self._flusher = None
+
+    def _check_fork(self):
+        # A forked worker starts from zero instead of repeating the parent's counts
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._check_fork()
+            key = _key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._check_fork()
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        with self._lock:
+            self._check_fork()
+            key = _key(name, labels)
+            buckets = self.histograms.setdefault(key, [0] * (len(DURATION_BUCKETS) + 2))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            buckets[-2] += seconds
+            buckets[-1] += 1
+
+    def state(self):
+        stats = visit_buffer.stats()
+        with self._lock:
+            self._check_fork()
+            # The visit buffer keeps its own running totals
+            self.counters[_key('visits_written_total', {})] = stats['flushed']
+            self.counters[_key('visits_dropped_total', {})] = stats['dropped']
+            self.counters[_key('database_errors_total', {'source': 'visits'})] = stats['failed_flushes']
+            self.gauges[_key('visit_queue_depth', {})] = stats['pending']
+            return {
+                'pid': self.pid,
+                'name': self.name,
+                'started': self.started,
+                'counters': dict(self.counters),
+                'histograms': {key: list(value) for key, value in self.histograms.items()},
+                'gauges': dict(self.gauges),
+            }
+
+    def flush(self, force=False, final=False):
+        """Write this process's values to METRICS_DIR, throttled unless ``force``."""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        if self._flusher is None and not final:
+            self._start_flusher()
+        with self._flush_lock:
+            now = time.monotonic()
+            if not force and now - self._flushed_at < settings.METRICS_FLUSH_INTERVAL:
+                return
+            self._flushed_at = now
+            state = self.state()
+            if final:
+                state['gauges'] = {}
+            data = json.dumps(state)
+            if data == self._written:
+                return
+            directory = Path(directory)
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f'{state["name"]}.json'
+            tmp = path.with_suffix('.tmp')
+            tmp.write_text(data)
+            # Readers see either the old or the new file, never half of one
+            os.replace(tmp, path)
+            self._written = data
+
+    def _start_flusher(self):
+        flusher = threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True)
+        self._flusher = flusher
+        flusher.start()
+
+    def _flush_periodically(self):
+        # Until the next reset or fork, also one during the sleep
+        while True:
+            time.sleep(max(settings.METRICS_FLUSH_INTERVAL, 0.1))
+            if self._flusher is not threading.current_thread():
+                return
+            try:
+                self.flush()
+            except OSError:
+                pass  # e.g. a full disk, tried again next interval
+
+
+registry = MetricsRegistry()
+
+
+@receiver(got_request_exception)
+def _count_database_error(sender, **kwargs):
+    if isinstance(sys.exc_info()[1], DatabaseError):
+        registry.inc('database_errors_total', source='requests')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """Sum the values of all processes: (counters, histograms, gauges)."""
+    own = registry.state()
+    others = []
+    if settings.METRICS_DIR and Path(settings.METRICS_DIR).is_dir():
+        for path in Path(settings.METRICS_DIR).glob('worker-*.json'):
+            if path.stem == own['name']:
+                continue
+            try:
+                others.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue  # removed or replaced while we were reading
+    # Of several files with the same PID only the newest can be a running process
+    newest = {}
+    for state in others:
+        newest[state['pid']] = max(newest.get(state['pid'], 0), state.get('started', 0))
+    for state in others:
+        pid = state['pid']
+        if pid == own['pid'] or state.get('started', 0) < newest[pid] or not _alive(pid):
+            state['gauges'] = {}
+    states = [own] + others
+
+    counters, histograms, gauges = {}, {}, {}
+    for state in states:
+        for key, value in state['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, value in state['gauges'].items():
+            gauges[key] = gauges.get(key, 0) + value
+        for key, value in state['histograms'].items():
+            total = histograms.setdefault(key, [0] * len(value))
+            for i, v in enumerate(value):
+                total[i] += v
+    return counters, histograms, gauges
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs, **extra):
+    pairs = list(pairs) + sorted(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def render(extra_gauges=None):
+    """
+    All metrics in the Prometheus text exposition format. ``extra_gauges``
+    are server-wide values ({name: value}) that must not be summed per process.
+    """
+    counters, histograms, gauges = collect()
+    for name, value in (extra_gauges or {}).items():
+        gauges[_key(name, {})] = value
+
+    samples = {}
+    for key in sorted(counters) + sorted(gauges):
+        name, labels = json.loads(key)
+        value = counters[key] if key in counters else gauges[key]
+        samples.setdefault(name, []).append(f'{name}{_labels(labels)} {_number(value)}')
+    for key in sorted(histograms):
+        name, labels = json.loads(key)
+        value = histograms[key]
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, value):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels, le=f"{bound:g}")} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {value[-1]}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(value[-2])}')
+        lines.append(f'{name}_count{_labels(labels)} {value[-1]}')
+
+    output = []
+    for name in sorted(samples):
+        kind, text = HELP.get(name, ('gauge', name))
+        output.append(f'# HELP {name} {text}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(samples[name])
+    return '\n'.join(output) + '\n'
@@ -1,63 +1,308 @@
-from .models import Visit
+import time
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseNotModified
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.common import CommonMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from .caching import has_session_cookies
+from .client_ip import anonymize_ip, client_ip
+from .exclusion import ExclusionRules
+from .metrics import registry
+from .prerender import load_prerendered
+from .profiling import stage
+from .sampling import visit_sampler
+from .tracking import visit_buffer
 
 class VisitTrackingMiddleware:
+    # Runs natively in both the WSGI (sync) and the ASGI (async) handler, so
+    # ASGI deployments do not pay a sync_to_async hop on every request.
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        # Compiled once per process (see VISIT_TRACKING_EXCLUDE)
+        self.exclusions = ExclusionRules.from_settings()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # Process request BEFORE view
-        
-        # Filter unwanted paths to avoid database bloat
-        # Exclude static files, admin, health checks, and favicon
+        if self.async_mode:
+            return self.__acall__(request)
+
+        # Capture the request BEFORE the view, record it once the status is known
+        record = self.capture(request)
+        response = self.get_response(request)
+        if record is not None and not self.exclusions.excludes_status(response.status_code):
+            with stage('tracking'):
+                visit_buffer.add(record)
+        return response
+
+    async def __acall__(self, request):
+        record = self.capture(request)
+        response = await self.get_response(request)
+        if record is not None and not self.exclusions.excludes_status(response.status_code):
+            if visit_buffer.may_block():
+                # Inline flushes and the 'block' policy must stay off the event loop
+                await sync_to_async(visit_buffer.add)(record)
+            else:
+                visit_buffer.add(record)
+        return response
+
+    def capture(self, request):
+        # Filter unwanted requests (static files, admin, health checks, bots,
+        # ...) to avoid database bloat
         path = request.path
-        if (not path.startswith('/static/') and 
-           not path.startswith('/admin/') and 
-           not path.startswith('/health/') and 
-           path != '/favicon.ico'):
-            
-            # Anonymize IP for GDPR compliance
-            ip = self.get_client_ip(request)
-            anon_ip = self.anonymize_ip(ip)
-
-            # Fire and forget (in a real high-load system, use celery or async)
-            try:
-                Visit.objects.create(
-                    path=path[:255], # Truncate if necessary
-                    method=request.method,
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')[:1000] if request.META.get('HTTP_USER_AGENT') else '',
-                    ip_address_anonymized=anon_ip,
-                    referer=request.META.get('HTTP_REFERER', '')[:1000] if request.META.get('HTTP_REFERER') else ''
-                )
-            except Exception:
-                # Do not crash the site if logging fails
-                pass
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        if self.exclusions.excludes(path, request.method, user_agent):
+            return None
+
+        # Drop bots and sample under load before doing any further work
+        weight = visit_sampler.weight(user_agent)
+        if not weight:
+            return None
+
+        # Anonymize IP for GDPR compliance
+        anon_ip = anonymize_ip(client_ip(request.META))
+
+        # Queued in memory and written in batches (see tracking.py)
+        return {
+            'timestamp': timezone.now(),
+            'path': path[:255], # Truncate if necessary
+            'method': request.method[:10],
+            'user_agent': user_agent[:1000],
+            'ip_address_anonymized': anon_ip,
+            'referer': request.META.get('HTTP_REFERER', '')[:1000],
+            'weight': weight,
+        }
+
+
+class PrerenderedPageMiddleware(VisitTrackingMiddleware):
+    """
+    Answers the pre-rendered content pages (see prerender_pages) from
+    memory, before sessions, CSRF, auth and messages run, choosing the
+    brotli or gzip variant the client accepts. Visits are still recorded.
+    Requests with a session or messages cookie fall through to the normal
+    stack, as do the contact form and the status page, which are never
+    pre-rendered.
+
+    Belongs right after WhiteNoiseMiddleware. Unused unless
+    PRERENDER_ENABLED is set and pages were rendered for the running deploy.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PRERENDER_ENABLED:
+            raise MiddlewareNotUsed
+        self.pages = load_prerendered(settings.PRERENDER_ROOT)
+        if not self.pages:
+            raise MiddlewareNotUsed('No pre-rendered pages for this deploy, run prerender_pages.')
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        response = self.serve(request)
+        if response is None:
+            return self.get_response(request)
+        record = self.capture(request)
+        if record is not None:
+            with stage('tracking'):
+                visit_buffer.add(record)
+        return response
+
+    async def __acall__(self, request):
+        response = self.serve(request)
+        if response is None:
+            return await self.get_response(request)
+        record = self.capture(request)
+        if record is not None:
+            if visit_buffer.may_block():
+                await sync_to_async(visit_buffer.add)(record)
+            else:
+                visit_buffer.add(record)
+        return response
+
+    def serve(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        page = self.pages.get(request.path_info)
+        if page is None:
+            return None
+        if has_session_cookies(request):
+            return None
+
+        content_type, etag, bodies = page
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            encoding = self.negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), bodies)
+            response = HttpResponse(bodies[encoding], content_type=content_type)
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ['Accept-Encoding'])
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=settings.PAGE_MAX_AGE)
+        # XFrameOptionsMiddleware comes later in the stack and does not see this response
+        response['X-Frame-Options'] = getattr(settings, 'X_FRAME_OPTIONS', 'DENY')
+        return response
 
+    def negotiate_encoding(self, accept_encoding, bodies):
+        accepted = set()
+        for item in accept_encoding.split(','):
+            coding, _, params = item.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(coding.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in bodies and encoding in accepted:
+                return encoding
+        return 'identity'
+
+
+class ContentFastPathMiddleware(VisitTrackingMiddleware):
+    """
+    Calls the views of content pages (marked static_content, see
+    cached_page) directly, skipping the session, auth and message
+    middleware and the rest of the stack below. Only for GET and HEAD
+    requests without a session or messages cookie: such a visitor is
+    anonymous and has no messages, so the result is the same.
+
+    CommonMiddleware, CsrfViewMiddleware and XFrameOptionsMiddleware still
+    run their hooks, so a form on such a page gets a valid token and CSRF
+    cookie. Visits are recorded here. Belongs right before
+    SessionMiddleware. Unused unless CONTENT_FAST_PATH is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.CONTENT_FAST_PATH:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.common = CommonMiddleware(get_response)
+        self.csrf = CsrfViewMiddleware(get_response)
+        self.xframe = XFrameOptionsMiddleware(get_response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        match = self.match(request)
+        if match is None:
+            return self.get_response(request)
+        record = self.capture(request)
+        response = self.serve(request, match)
+        if record is not None and not self.exclusions.excludes_status(response.status_code):
+            with stage('tracking'):
+                visit_buffer.add(record)
+        return response
+
+    async def __acall__(self, request):
+        match = self.match(request)
+        if match is None:
+            return await self.get_response(request)
+        record = self.capture(request)
+        # The views are sync, Django would run them in a thread as well
+        response = await sync_to_async(self.serve)(request, match)
+        if record is not None and not self.exclusions.excludes_status(response.status_code):
+            if visit_buffer.may_block():
+                await sync_to_async(visit_buffer.add)(record)
+            else:
+                visit_buffer.add(record)
+        return response
+
+    def match(self, request):
+        if request.method not in ('GET', 'HEAD') or has_session_cookies(request):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if not getattr(match.func, 'static_content', False):
+            return None
+        return match
+
+    def serve(self, request, match):
+        request.resolver_match = match
+        # What AuthenticationMiddleware gives a request without a session
+        request.user = AnonymousUser()
+
+        response = self.common.process_request(request)
+        if response is None:
+            self.csrf.process_request(request)
+            response = self.csrf.process_view(request, match.func, match.args, match.kwargs)
+        if response is None:
+            with stage('view'):
+                response = match.func(request, *match.args, **match.kwargs)
+        # Reverse MIDDLEWARE order, as the handler would apply them
+        for middleware in (self.xframe, self.csrf, self.common):
+            response = middleware.process_response(request, response)
+        return response
+
+
+UNMATCHED = '<unmatched>'
+# Other methods are counted as 'other', a scanner could send any string
+KNOWN_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+
+@lru_cache(maxsize=256)
+def _route_name(path):
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return UNMATCHED
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and their duration per route name for /metrics (see
+    metrics.py). Belongs near the top of MIDDLEWARE so that responses of
+    the middleware below, like pre-rendered pages, are counted too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
         response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
         return response
 
-    def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
+    def record(self, request, response, seconds):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            route = match.view_name
+        elif response.status_code == 404:
+            # Do not let scanners create a label per probed path
+            route = UNMATCHED
         else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
-
-    def anonymize_ip(self, ip):
-        if not ip:
-            return None
-        if ':' in ip: # IPv6
-            # Keep first 3 groups roughly (simplified)
-            # IPv6 standard anonymization is often /48 or /64. 
-            # Keeping first 3 parts (groups) depends on representation.
-            # Let's just keep first 2 blocks to be safe
-            parts = ip.split(':')
-            if len(parts) > 2:
-                return ':'.join(parts[:2]) + '::XXXX'
-            return ip
-        else: # IPv4
-            # Zero out last octet
-            parts = ip.split('.')
-            if len(parts) == 4:
-                return '.'.join(parts[:3]) + '.0'
-            return ip
+            # Answered before URL resolution, e.g. a pre-rendered page
+            route = _route_name(request.path_info)
+        method = request.method if request.method in KNOWN_METHODS else 'other'
+        registry.inc('http_requests_total', route=route, method=method, status=response.status_code)
+        registry.observe('http_request_duration_seconds', seconds, route=route)
+        registry.flush()
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0002_alter_visit_timestamp'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visit',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0003_alter_visit_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('path', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Seitenaufrufe pro Tag',
+                'verbose_name_plural': 'Seitenaufrufe pro Tag',
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'path'), name='unique_visit_daily_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VisitHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('path', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Seitenaufrufe pro Stunde',
+                'verbose_name_plural': 'Seitenaufrufe pro Stunde',
+                'ordering': ['-hour'],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'path'), name='unique_visit_hourly_bucket')],
+            },
+        ),
+    ]
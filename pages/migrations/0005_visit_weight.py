@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0004_visit_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
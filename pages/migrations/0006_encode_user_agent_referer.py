@@ -0,0 +1,127 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:05
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def digest(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+CHUNK_SIZE = 2000
+
+
+def encode_visits(apps, schema_editor):
+    # Set-based: the lookup rows are created from the distinct strings, then
+    # one UPDATE per field resolves every visit through a temporary index on
+    # the lookup values. Filtering the visits per string would scan the
+    # unindexed column once for every distinct user agent and referer.
+    Visit = apps.get_model('pages', 'Visit')
+    quote = schema_editor.quote_name
+    visits = quote(Visit._meta.db_table)
+    for model_name, field in (('UserAgent', 'user_agent'), ('Referer', 'referer')):
+        Lookup = apps.get_model('pages', model_name)
+        values = (
+            Visit.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''})
+            .order_by().values_list(field, flat=True).distinct()
+        )
+        batch = []
+        for value in values.iterator(chunk_size=CHUNK_SIZE):
+            batch.append(Lookup(value=value, digest=digest(value)))
+            if len(batch) == CHUNK_SIZE:
+                Lookup.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        Lookup.objects.bulk_create(batch, ignore_conflicts=True)
+
+        lookups = quote(Lookup._meta.db_table)
+        index = quote(f'{Lookup._meta.db_table}_value_tmp')
+        column = quote(Visit._meta.get_field(field).column)
+        schema_editor.execute(f'CREATE INDEX {index} ON {lookups} (value)')
+        schema_editor.execute(
+            f'UPDATE {visits} SET {quote(Visit._meta.get_field(f"{field}_ref").column)} = '
+            f'(SELECT id FROM {lookups} WHERE {lookups}.value = {visits}.{column}) '
+            f"WHERE {column} IS NOT NULL AND {column} <> ''"
+        )
+        schema_editor.execute(f'DROP INDEX {index}')
+    check_constraints(schema_editor)
+
+
+def decode_visits(apps, schema_editor):
+    Visit = apps.get_model('pages', 'Visit')
+    for model_name, field in (('UserAgent', 'user_agent'), ('Referer', 'referer')):
+        Lookup = apps.get_model('pages', model_name)
+        for lookup in Lookup.objects.iterator(chunk_size=1000):
+            Visit.objects.filter(**{f'{field}_ref': lookup}).update(**{field: lookup.value})
+    check_constraints(schema_editor)
+
+
+def check_constraints(schema_editor):
+    # PostgreSQL refuses the ALTER TABLEs that follow while deferred foreign
+    # key checks of the updated rows are pending in the same transaction
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0005_visit_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Referer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('digest', models.CharField(editable=False, max_length=40, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Referer',
+                'verbose_name_plural': 'Referer',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('digest', models.CharField(editable=False, max_length=40, unique=True)),
+            ],
+            options={
+                'verbose_name': 'User Agent',
+                'verbose_name_plural': 'User Agents',
+            },
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pages.useragent'),
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='referer_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pages.referer'),
+        ),
+        migrations.RunPython(encode_visits, decode_visits),
+        migrations.RemoveField(
+            model_name='visit',
+            name='user_agent',
+        ),
+        migrations.RemoveField(
+            model_name='visit',
+            name='referer',
+        ),
+        migrations.RenameField(
+            model_name='visit',
+            old_name='user_agent_ref',
+            new_name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='visit',
+            old_name='referer_ref',
+            new_name='referer',
+        ),
+    ]
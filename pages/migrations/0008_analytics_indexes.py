@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0007_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visit',
+            name='referer',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pages.referer'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['path', 'timestamp'], name='visit_path_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['referer', 'timestamp'], name='visit_referer_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visitdaily',
+            index=models.Index(fields=['path', 'day'], name='visit_daily_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visithourly',
+            index=models.Index(fields=['path', 'hour'], name='visit_hourly_path_idx'),
+        ),
+    ]
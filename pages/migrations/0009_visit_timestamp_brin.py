@@ -0,0 +1,30 @@
+# Generated by Django 6.0.2 on 2026-10-18 16:20
+
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import migrations
+
+# Visits are appended in timestamp order, so on PostgreSQL a BRIN index
+# answers time range scans (retention, archive, rollup rebuilds) from a few
+# pages. It is not part of the model state: other databases have no BRIN.
+BRIN = BrinIndex(fields=['timestamp'], name='visit_ts_brin', autosummarize=True)
+
+
+def add_brin(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('pages', 'Visit'), BRIN)
+
+
+def remove_brin(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('pages', 'Visit'), BRIN)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0008_analytics_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_brin, remove_brin),
+    ]
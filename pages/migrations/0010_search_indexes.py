@@ -0,0 +1,84 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:40
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import DatabaseError, migrations
+from django.db.models.functions import Upper
+
+# Substring indexes behind the visit admin search (see pages/search.py):
+# the user agents, the referers and the paths of the daily rollups. On
+# SQLite an FTS5 table with the trigram tokenizer, kept in sync by
+# triggers; on PostgreSQL a pg_trgm GIN index on UPPER(column), which is
+# what icontains compares. Neither is part of the model state.
+SEARCHED = [('UserAgent', 'value'), ('Referer', 'value'), ('VisitDaily', 'path')]
+
+
+def sqlite_has_trigram(cursor):
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.trigram_check USING fts5(value, tokenize='trigram')")
+    except DatabaseError:  # SQLite before 3.34 or without FTS5, search falls back to LIKE
+        return False
+    cursor.execute('DROP TABLE temp.trigram_check')
+    return True
+
+
+def trigram_index(model, column):
+    return GinIndex(OpClass(Upper(column), name='gin_trgm_ops'), name=f'{model._meta.model_name}_{column}_trgm')
+
+
+def add_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            if cursor.fetchone() is None:  # PostgreSQL without contrib, search falls back to LIKE
+                return
+        # Not TrigramExtension(): reversing that runs PostgreSQL queries on every database.
+        # The extension stays when the migration is reversed.
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, column in SEARCHED:
+            model = apps.get_model('pages', name)
+            schema_editor.add_index(model, trigram_index(model, column))
+    elif vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            if not sqlite_has_trigram(cursor):
+                return
+        for name, column in SEARCHED:
+            table = apps.get_model('pages', name)._meta.db_table
+            fts = f'{table}_fts'
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', content_rowid='id', tokenize='trigram')")
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            schema_editor.execute(
+                f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            schema_editor.execute(
+                f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+            schema_editor.execute(
+                f'CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+
+
+def remove_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for name, column in SEARCHED:
+        model = apps.get_model('pages', name)
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {trigram_index(model, column).name}')
+        elif vendor == 'sqlite':
+            fts = f'{model._meta.db_table}_fts'
+            for trigger in ('insert', 'delete', 'update'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}_{trigger}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0009_visit_timestamp_brin'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
@@ -1,18 +1,141 @@
+import hashlib
+
 from django.db import models
+from django.utils import timezone
+
+
+class LookupValue(models.Model):
+    """
+    A distinct string stored once and referenced by id. The digest keeps
+    the unique index small no matter how long the value is.
+    """
+    value = models.TextField()
+    digest = models.CharField(max_length=40, unique=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def make_digest(value):
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.digest = self.make_digest(self.value)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.value
+
+
+class UserAgent(LookupValue):
+    class Meta:
+        verbose_name = 'User Agent'
+        verbose_name_plural = 'User Agents'
+
+
+class Referer(LookupValue):
+    class Meta:
+        verbose_name = 'Referer'
+        verbose_name_plural = 'Referer'
+
 
 class Visit(models.Model):
-    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
     path = models.CharField(max_length=255)
     method = models.CharField(max_length=10, default='GET')
-    user_agent = models.TextField(blank=True, null=True)
+    user_agent = models.ForeignKey(UserAgent, on_delete=models.PROTECT, blank=True, null=True, related_name='+')
     ip_address_anonymized = models.GenericIPAddressField(blank=True, null=True)
-    referer = models.TextField(blank=True, null=True)
+    # Indexed together with the timestamp, see Meta.indexes
+    referer = models.ForeignKey(
+        Referer, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False)
+    # Number of requests this row stands for when visits are sampled
+    weight = models.PositiveIntegerField(default=1)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Visits of one path or one referer in a time range (see analytics.py)
+            models.Index(fields=['path', 'timestamp'], name='visit_path_ts_idx'),
+            models.Index(fields=['referer', 'timestamp'], name='visit_referer_ts_idx'),
+        ]
         verbose_name = 'Seitenaufruf'
         verbose_name_plural = 'Seitenaufrufe'
 
     def __str__(self):
         return f"{self.timestamp} - {self.path}"
 
+
+class VisitHourly(models.Model):
+    """Number of visits per path and hour (UTC), maintained on ingestion."""
+    hour = models.DateTimeField()
+    path = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'path'], name='unique_visit_hourly_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['path', 'hour'], name='visit_hourly_path_idx'),
+        ]
+        verbose_name = 'Seitenaufrufe pro Stunde'
+        verbose_name_plural = 'Seitenaufrufe pro Stunde'
+
+    def __str__(self):
+        return f"{self.hour} - {self.path}: {self.count}"
+
+
+class VisitDaily(models.Model):
+    """Number of visits per path and local calendar day, maintained on ingestion."""
+    day = models.DateField()
+    path = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'path'], name='unique_visit_daily_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['path', 'day'], name='visit_daily_path_idx'),
+        ]
+        verbose_name = 'Seitenaufrufe pro Tag'
+        verbose_name_plural = 'Seitenaufrufe pro Tag'
+
+    def __str__(self):
+        return f"{self.day} - {self.path}: {self.count}"
+
+
+class OutboundEmail(models.Model):
+    """An email waiting to be sent by the send_queued_mail command."""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Wartend'),
+        (SENT, 'Gesendet'),
+        (FAILED, 'Fehlgeschlagen'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
+        verbose_name = 'Ausgehende E-Mail'
+        verbose_name_plural = 'Ausgehende E-Mails'
+
+    def __str__(self):
+        return f"{self.subject} ({self.get_status_display()})"
@@ -0,0 +1,91 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .metrics import registry
+from .models import OutboundEmail
+from .profiling import stage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_mail(subject, body, from_email, recipients):
+    """Store an email for the background sender instead of sending it now."""
+    with stage('mail'):
+        return OutboundEmail.objects.create(
+            subject=subject, body=body, from_email=from_email, recipients=list(recipients),
+        )
+
+
+def retry_delay(attempts):
+    """Exponential backoff: MAIL_QUEUE_RETRY_DELAY, then twice that, and so on."""
+    return timedelta(seconds=settings.MAIL_QUEUE_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def send_queued_mail(batch_size=None, connection=None):
+    """
+    Send up to batch_size due emails over a single connection. Failed
+    emails are retried with exponential backoff and given up after
+    MAIL_QUEUE_MAX_ATTEMPTS. Returns (sent, failed).
+
+    Meant to be run by a single sender process (see send_queued_mail).
+    """
+    batch_size = batch_size or settings.MAIL_QUEUE_BATCH_SIZE
+    due = list(
+        OutboundEmail.objects.filter(status=OutboundEmail.PENDING, next_attempt_at__lte=timezone.now())
+        .order_by('next_attempt_at', 'id')[:batch_size]
+    )
+    if not due:
+        return 0, 0
+
+    connection = connection or get_connection()
+    sent = failed = 0
+    handled = set()
+    try:
+        # One SMTP handshake (and TLS setup) for the whole batch
+        connection.open()
+        for email in due:
+            message = EmailMessage(
+                email.subject, email.body, email.from_email, email.recipients, connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as e:
+                failed += 1
+                handled.add(email.pk)
+                _mark_failed(email, e)
+                # The connection may be unusable now, reconnect for the rest
+                connection.close()
+                connection.open()
+            else:
+                sent += 1
+                handled.add(email.pk)
+                email.status = OutboundEmail.SENT
+                email.sent_at = timezone.now()
+                email.attempts += 1
+                email.save(update_fields=['status', 'sent_at', 'attempts'])
+    except Exception as e:
+        # Could not (re)connect: the rest of the batch is retried later
+        logger.warning('Mail server not reachable: %s', e)
+        for email in due:
+            if email.pk not in handled:
+                failed += 1
+                _mark_failed(email, e)
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _mark_failed(email, error):
+    registry.inc('smtp_errors_total')
+    email.attempts += 1
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= settings.MAIL_QUEUE_MAX_ATTEMPTS:
+        email.status = OutboundEmail.FAILED
+        logger.error('Giving up on email %s after %s attempts: %s', email.pk, email.attempts, error)
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
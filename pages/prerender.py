@@ -0,0 +1,89 @@
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from django.urls import URLPattern, URLResolver, get_resolver, resolve
+
+from .revision import deploy_version
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip variants are written without it
+    brotli = None
+
+MANIFEST = 'manifest.json'
+
+
+def static_routes(patterns=None, prefix=''):
+    """Paths of all routes without parameters whose view is marked static_content."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        route = str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from static_routes(pattern.url_patterns, prefix + route)
+        elif isinstance(pattern, URLPattern) and getattr(pattern.callback, 'static_content', False):
+            if not getattr(pattern.pattern, 'converters', None) and not route.startswith('^'):
+                yield '/' + prefix + route
+
+
+def render_page(path):
+    """Render a page the way an anonymous visitor without cookies sees it."""
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    request.resolver_match = match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if response.status_code != 200:
+        raise ValueError(f'{path} answered with status {response.status_code}')
+    return response.content, response['Content-Type']
+
+
+def prerender(root):
+    """Write every static route plus compressed variants below root. Returns the manifest."""
+    root = Path(root)
+    pages = {}
+    for path in static_routes():
+        content, content_type = render_page(path)
+        target = root / path.strip('/') / 'index.html'
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+        variants = {'identity': str(target.relative_to(root))}
+
+        target.with_name('index.html.gz').write_bytes(gzip.compress(content, compresslevel=9, mtime=0))
+        variants['gzip'] = variants['identity'] + '.gz'
+        if brotli is not None:
+            target.with_name('index.html.br').write_bytes(brotli.compress(content))
+            variants['br'] = variants['identity'] + '.br'
+
+        pages[path] = {
+            'content_type': content_type,
+            'etag': '"%s"' % hashlib.sha1(content).hexdigest()[:20],
+            'files': variants,
+        }
+
+    manifest = {'version': deploy_version(), 'pages': pages}
+    (root / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def load_prerendered(root):
+    """
+    Read the pre-rendered pages into memory: {path: (headers, {encoding: bytes})}.
+    Returns an empty dict if nothing was rendered for the running deploy.
+    """
+    root = Path(root)
+    try:
+        manifest = json.loads((root / MANIFEST).read_text())
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != deploy_version():
+        return {}
+
+    pages = {}
+    for path, page in manifest['pages'].items():
+        bodies = {encoding: (root / name).read_bytes() for encoding, name in page['files'].items()}
+        pages[path] = (page['content_type'], page['etag'], bodies)
+    return pages
@@ -0,0 +1,213 @@
+"""
+Opt-in request instrumentation (PROFILING_ENABLED).
+
+ProfilingMiddleware goes first in MIDDLEWARE and ViewTimingMiddleware
+last. Together they split every request into stages: 'view' (the view
+including the process_view hooks), 'middleware' (everything around it),
+'template', 'db' (time and number of queries), 'mail' and 'tracking' (the
+visit record). Code marks its own stages with ``with stage('name'):``,
+which is a no-op outside an instrumented request.
+
+The breakdown is sent as a Server-Timing header and added to in-memory
+histograms per stage. Selected requests are also profiled and the dump is
+written to PROFILING_DIR: every request carrying an ``X-Profile`` header
+equal to PROFILING_TOKEN, and a PROFILING_SAMPLE_RATE share of all others.
+
+When disabled both middleware raise MiddlewareNotUsed, so they are not
+part of the handler chain at all.
+"""
+import cProfile
+import contextvars
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+try:
+    import pyinstrument
+except ImportError:  # optional, cProfile is used without it
+    pyinstrument = None
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+
+_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histograms:
+    """Cumulative duration histograms per stage, shared by all threads of a process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def observe(self, name, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            counts, total = self._stages.get(name, ([0] * len(BUCKETS), 0.0))
+            for i, bound in enumerate(BUCKETS):
+                if ms <= bound:
+                    counts[i] += 1
+                    break
+            self._stages[name] = (counts, total + seconds)
+
+    def snapshot(self):
+        """{stage: {'buckets': [(bound_ms, cumulative count), ...], 'count': n, 'sum': seconds}}"""
+        with self._lock:
+            result = {}
+            for name, (counts, total) in self._stages.items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(BUCKETS, counts):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                result[name] = {'buckets': buckets, 'count': cumulative, 'sum': total}
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+histograms = Histograms()
+
+
+@contextmanager
+def stage(name):
+    """Add the time spent in the block to stage ``name`` of the current request."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds, count=1):
+        total, n = self.stages.get(name, (0.0, 0))
+        self.stages[name] = (total + seconds, n + count)
+
+    def duration(self, name):
+        return self.stages.get(name, (0.0, 0))[0]
+
+    def server_timing(self):
+        parts = []
+        for name, (seconds, count) in self.stages.items():
+            part = f'{name};dur={seconds * 1000:.2f}'
+            if name == 'db':
+                part += f';desc="{count} queries"'
+            parts.append(part)
+        return ', '.join(parts)
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add('db', time.perf_counter() - started)
+
+
+_template_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    with stage('template'):
+        return _template_render(self, context, request)
+
+
+class ProfilingMiddleware:
+    # Only sync: execute_wrapper() applies to the connections of the calling
+    # thread. Under ASGI Django adapts the chain while profiling is on.
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        profiler = self.start_profiler(request)
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - started
+        timings.add('middleware', total - timings.duration('view'))
+        timings.add('total', total)
+
+        for name, (seconds, _) in timings.stages.items():
+            histograms.observe(name, seconds)
+        response['Server-Timing'] = timings.server_timing()
+        if profiler is not None:
+            response['X-Profile-Dump'] = self.dump(profiler, request, total).name
+        return response
+
+    def start_profiler(self, request):
+        token = settings.PROFILING_TOKEN
+        requested = request.headers.get('X-Profile')
+        if not (token and requested and constant_time_compare(requested, token)):
+            if not settings.PROFILING_SAMPLE_RATE or random.random() >= settings.PROFILING_SAMPLE_RATE:
+                return None
+        if settings.PROFILING_PROFILER == 'pyinstrument' and pyinstrument is not None:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def dump(self, profiler, request, total):
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^a-z0-9]+', '-', request.path.lower()).strip('-') or 'home'
+        name = f'{timezone.now():%Y%m%d-%H%M%S-%f}-{slug}-{total * 1000:.0f}ms'
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            path = directory / f'{name}.prof'
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = directory / f'{name}.html'
+            path.write_text(profiler.output_html(), encoding='utf-8')
+        return path
+
+
+class ViewTimingMiddleware:
+    """Innermost part of the instrumentation: times what lies below the middleware."""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with stage('view'):
+            return self.get_response(request)
@@ -0,0 +1,88 @@
+import hashlib
+import subprocess
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def get_git_revision_hash():
+    try:
+        # Get the latest git commit hash
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode('utf-8').strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return 'N/A'
+
+
+def _template_files():
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        for path in sorted(Path(directory).rglob('*.html')):
+            yield directory, path
+
+
+@lru_cache(maxsize=None)
+def template_fingerprint():
+    """Hash over the content of all project templates."""
+    digest = hashlib.sha1()
+    for directory, path in _template_files():
+        digest.update(str(path.relative_to(directory)).encode('utf-8'))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def templates_last_modified():
+    """Modification time (epoch seconds) of the newest project template."""
+    return int(max((path.stat().st_mtime for _, path in _template_files()), default=0))
+
+
+def _deploy_files():
+    # Rewritten by every deploy: collectstatic's manifest and the build_assets output
+    if hasattr(staticfiles_storage, 'manifest_name'):
+        yield Path(staticfiles_storage.manifest_storage.path(staticfiles_storage.manifest_name))
+    yield Path(settings.ASSETS_OUTPUT_DIR) / 'manifest.json'
+
+
+@lru_cache(maxsize=None)
+def pages_last_modified():
+    """
+    Last-Modified of the content pages (epoch seconds): the newest template
+    or deploy. A deploy that only changes assets changes the hashed static
+    URLs in every page without touching a template.
+    """
+    deployed = [path.stat().st_mtime for path in _deploy_files() if path.exists()]
+    return max([templates_last_modified(), *map(int, deployed)])
+
+
+@lru_cache(maxsize=None)
+def git_revision():
+    """DEPLOY_REVISION or the current git commit, resolved once per process."""
+    return settings.DEPLOY_REVISION or get_git_revision_hash()
+
+
+@receiver(setting_changed)
+def _clear_revision_cache(setting, **kwargs):
+    if setting == 'DEPLOY_REVISION':
+        git_revision.cache_clear()
+        deploy_version.cache_clear()
+    elif setting in ('ASSETS_OUTPUT_DIR', 'STATIC_ROOT', 'STORAGES'):
+        pages_last_modified.cache_clear()
+        deploy_version.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def deploy_version():
+    """
+    Identifies what is deployed: the git revision plus the template
+    fingerprint and the asset manifests, so edited templates and rebuilt
+    assets count as a new deploy even without a commit. Computed once per
+    process.
+    """
+    digest = hashlib.sha1(f'{git_revision()}:{template_fingerprint()}'.encode('utf-8'))
+    for path in _deploy_files():
+        if path.exists():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
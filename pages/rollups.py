@@ -0,0 +1,111 @@
+from collections import Counter
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import Visit, VisitDaily, VisitHourly
+
+
+def hour_bucket(timestamp):
+    return timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(timestamp):
+    return timezone.localdate(timestamp)
+
+
+def add_to_rollups(visits):
+    """
+    Add a batch of visits to the hourly and daily rollups. Meant to run in
+    the same transaction that inserts the visits. Sampled visits count with
+    their weight.
+    """
+    hourly = Counter()
+    daily = Counter()
+    for visit in visits:
+        hourly[(hour_bucket(visit.timestamp), visit.path)] += visit.weight
+        daily[(day_bucket(visit.timestamp), visit.path)] += visit.weight
+    with transaction.atomic():
+        _increment(VisitHourly, 'hour', hourly)
+        _increment(VisitDaily, 'day', daily)
+
+
+def _increment(model, bucket_field, counts):
+    if not counts:
+        return
+    # Make sure every bucket exists, then add in place. Safe against other
+    # workers creating the same bucket concurrently.
+    model.objects.bulk_create(
+        [model(**{bucket_field: bucket, 'path': path}) for bucket, path in counts],
+        ignore_conflicts=True,
+    )
+    for (bucket, path), count in counts.items():
+        model.objects.filter(**{bucket_field: bucket, 'path': path}).update(count=F('count') + count)
+
+
+def first_complete_day():
+    """
+    The first local day for which the raw visits are complete, or None if
+    they are complete for all days. archive_visits and prune_visits cut at a
+    timestamp, so rollups older than the oldest stored visit mean that its
+    day has lost visits as well.
+    """
+    oldest = Visit.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+    if oldest is None:
+        if VisitHourly.objects.exists() or VisitDaily.objects.exists():
+            return timezone.localdate() + timedelta(days=1)
+        return None
+    if (VisitHourly.objects.filter(hour__lt=hour_bucket(oldest)).exists()
+            or VisitDaily.objects.filter(day__lt=day_bucket(oldest)).exists()):
+        return day_bucket(oldest) + timedelta(days=1)
+    return None
+
+
+def rebuild_rollups(since=None):
+    """
+    Recompute the rollups from the raw Visit table, for all data or for
+    every local day starting at the date ``since``. Days whose visits have
+    been pruned, fully or in part, are never rebuilt: their rollups are the
+    only record left (see first_complete_day). Returns the number of hourly
+    and daily buckets written.
+    """
+    complete = first_complete_day()
+    if complete is not None and (since is None or since < complete):
+        since = complete
+    visits = Visit.objects.all()
+    hourly_rows = VisitHourly.objects.all()
+    daily_rows = VisitDaily.objects.all()
+    if since is not None:
+        start = timezone.make_aware(datetime.combine(since, time.min))
+        visits = visits.filter(timestamp__gte=start)
+        hourly_rows = hourly_rows.filter(hour__gte=hour_bucket(start))
+        daily_rows = daily_rows.filter(day__gte=since)
+
+    hourly = (
+        visits.order_by()
+        .annotate(bucket=TruncHour('timestamp', tzinfo=dt_timezone.utc))
+        .values('bucket', 'path')
+        .annotate(total=Sum('weight'))
+    )
+    daily = (
+        visits.order_by()
+        .annotate(bucket=TruncDate('timestamp'))
+        .values('bucket', 'path')
+        .annotate(total=Sum('weight'))
+    )
+
+    with transaction.atomic():
+        hourly_rows.delete()
+        daily_rows.delete()
+        hours = VisitHourly.objects.bulk_create(
+            [VisitHourly(hour=row['bucket'], path=row['path'], count=row['total']) for row in hourly.iterator()],
+            batch_size=1000,
+        )
+        days = VisitDaily.objects.bulk_create(
+            [VisitDaily(day=row['bucket'], path=row['path'], count=row['total']) for row in daily.iterator()],
+            batch_size=1000,
+        )
+    return len(hours), len(days)
@@ -0,0 +1,124 @@
+import math
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+OFF = 'off'
+FIXED = 'fixed'
+ADAPTIVE = 'adaptive'
+
+
+@lru_cache(maxsize=1)
+def _bot_pattern():
+    patterns = settings.VISIT_BOT_USER_AGENTS
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def is_bot(user_agent):
+    """Classify a User-Agent. Results are cached, the same few hundred strings make up most traffic."""
+    pattern = _bot_pattern()
+    return bool(user_agent and pattern is not None and pattern.search(user_agent))
+
+
+@receiver(setting_changed)
+def _clear_classifier_cache(setting, **kwargs):
+    if setting == 'VISIT_BOT_USER_AGENTS':
+        _bot_pattern.cache_clear()
+        is_bot.cache_clear()
+
+
+def _interval(rate):
+    """Turn a sampling rate into 'keep one in N'. 0 means keep nothing."""
+    if rate <= 0:
+        return 0
+    return max(1, round(1 / rate))
+
+
+class VisitSampler:
+    """
+    Decides per request whether a visit is stored and with which weight.
+
+    A visit kept with probability 1/N is stored with weight N, so summing
+    weights gives an unbiased estimate of the number of requests. N is the
+    product of the bot interval (VISIT_BOT_SAMPLE_RATE, 0 drops bots) and the
+    traffic interval, which depends on VISIT_SAMPLING:
+
+    - 'off': every request is kept
+    - 'fixed': one in round(1 / VISIT_SAMPLE_RATE)
+    - 'adaptive': N is chosen from the request rate of the last seconds so
+      that about VISIT_SAMPLING_TARGET_RATE visits per second and worker
+      reach the database
+    """
+
+    WINDOW = 1.0  # seconds
+
+    def __init__(self, random=random.random):
+        self.random = random
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._rate = 0.0
+        self.sampled_out = 0
+        self.bots_dropped = 0
+
+    def weight(self, user_agent=''):
+        """Return the weight to store the visit with, or 0 to skip it."""
+        interval = 1
+        if is_bot(user_agent):
+            interval = _interval(settings.VISIT_BOT_SAMPLE_RATE)
+            if interval == 0:
+                self.bots_dropped += 1
+                return 0
+
+        mode = settings.VISIT_SAMPLING
+        if mode == FIXED:
+            interval *= _interval(settings.VISIT_SAMPLE_RATE)
+        elif mode == ADAPTIVE:
+            interval *= self._adaptive_interval()
+        if interval == 0:
+            self.sampled_out += 1
+            return 0
+
+        if interval > 1 and self.random() * interval >= 1:
+            self.sampled_out += 1
+            return 0
+        return interval
+
+    def request_rate(self):
+        return self._rate
+
+    def stats(self):
+        return {
+            'request_rate': round(self._rate, 2),
+            'sampled_out': self.sampled_out,
+            'bots_dropped': self.bots_dropped,
+        }
+
+    def _adaptive_interval(self):
+        now = time.monotonic()
+        with self._lock:
+            self._window_count += 1
+            elapsed = now - self._window_start
+            if elapsed >= self.WINDOW:
+                # Smooth over windows so a single burst does not swing the rate
+                current = self._window_count / elapsed
+                self._rate = current if not self._rate else 0.5 * self._rate + 0.5 * current
+                self._window_start = now
+                self._window_count = 0
+            rate = max(self._rate, self._window_count / max(elapsed, self.WINDOW))
+        target = settings.VISIT_SAMPLING_TARGET_RATE
+        if target <= 0 or rate <= target:
+            return 1
+        return math.ceil(rate / target)
+
+
+visit_sampler = VisitSampler()
@@ -0,0 +1,45 @@
+"""
+Substring search over visits for the admin, without scanning the visit
+table.
+
+A term matches a visit if it occurs in its path, user agent or referer.
+Instead of LIKE '%term%' on every visit, the term is looked up in the
+trigram indexes of migration 0010: the user agent and referer lookup
+tables, and the paths of the daily rollups (every path that was visited
+has a row there). The visits are then found through their indexes on
+path, user_agent and referer.
+"""
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Referer, UserAgent, VisitDaily
+
+# Shorter terms have no trigram, they are matched with LIKE
+MIN_INDEXED_LENGTH = 3
+
+
+def _fts_table(model):
+    table = f'{model._meta.db_table}_fts'
+    if connection.vendor == 'sqlite' and table in connection.introspection.table_names():
+        return table
+    return None
+
+
+def containing(model, field, term):
+    """Rows of ``model`` whose ``field`` contains ``term``, ignoring case."""
+    table = _fts_table(model)
+    if table is None or len(term) < MIN_INDEXED_LENGTH:
+        # On PostgreSQL the trigram index is on UPPER(field), what icontains uses
+        return model.objects.filter(**{f'{field}__icontains': term})
+    # A quoted FTS5 phrase: with the trigram tokenizer a case-insensitive substring match
+    phrase = '"{}"'.format(term.replace('"', '""'))
+    return model.objects.filter(id__in=RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [phrase]))
+
+
+def search_visits(visits, term):
+    return visits.filter(
+        Q(path__in=containing(VisitDaily, 'path', term).values('path'))
+        | Q(user_agent__in=containing(UserAgent, 'value', term).values('id'))
+        | Q(referer__in=containing(Referer, 'value', term).values('id'))
+    )
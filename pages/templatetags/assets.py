@@ -0,0 +1,59 @@
+import re
+
+from django import template
+from django.conf import settings
+from django.forms.utils import flatatt
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from pages.assets import STATIC_PREFIX, load_build
+
+register = template.Library()
+
+RELATIVE_URL = re.compile(r'url\((?!["\']?(?:data:|https?:|/))["\']?([^"\')]+)["\']?\)')
+
+@register.simple_tag
+def critical_css():
+    """The above-the-fold CSS of the last build as an inline <style>, empty before the first build."""
+    _, css = load_build(str(settings.ASSETS_OUTPUT_DIR))
+    if not css:
+        return ''
+    # URLs in the file are relative to it, inline they need the (hashed) static URL
+    css = RELATIVE_URL.sub(lambda match: f'url({static(STATIC_PREFIX + match.group(1))})', css)
+    return format_html('<style>{}</style>', mark_safe(css))
+
+
+@register.simple_tag
+def webfonts():
+    """Preload the self-hosted Inter. Before the first build the system font is used."""
+    manifest, _ = load_build(str(settings.ASSETS_OUTPUT_DIR))
+    if manifest and manifest['text_font']:
+        return format_html(
+            '<link rel="preload" href="{}" as="font" type="font/woff2" crossorigin>',
+            static(STATIC_PREFIX + 'fonts/inter.woff2'),
+        )
+    return ''
+
+
+@register.simple_tag
+def picture(path, alt, sizes='100vw', **attrs):
+    """
+    {% picture 'img/logo.png' alt='Logo' sizes='83px' %}: the image as AVIF
+    and WebP in the widths built for it, the original as fallback. ``sizes``
+    is the width the image is shown at; further arguments become attributes
+    of the <img>.
+    """
+    manifest, _ = load_build(str(settings.ASSETS_OUTPUT_DIR))
+    image = manifest and manifest.get('images', {}).get(path)
+    if not image:
+        return format_html('<img src="{}" alt="{}"{}>', static(path), alt, flatatt(attrs))
+    sources = format_html_join('', '<source type="image/{}" srcset="{}" sizes="{}">', (
+        (fmt, ', '.join(f'{static(STATIC_PREFIX + name)} {width}w' for width, name in variants), sizes)
+        for fmt, variants in image['variants'].items()
+    ))
+    # The dimensions let the browser reserve the space before the image loads
+    return format_html(
+        '<picture>{}<img src="{}" width="{}" height="{}" alt="{}"{}></picture>',
+        sources, static(path), image['width'], image['height'], alt, flatatt(attrs),
+    )
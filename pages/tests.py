@@ -1,10 +1,56 @@
-from django.test import TestCase, Client
-from django.urls import reverse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.urls import include, path, reverse
 from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+from django.utils.http import http_date
+from datetime import timedelta
+from io import StringIO
+import csv
+import gzip
+import importlib
+import ipaddress
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
 from django.contrib.auth.models import User
 from unittest.mock import patch
 import subprocess
+import time
+from unittest import skipUnless
+from django.template import Context, Template
+from django.template.backends.django import Template as DjangoTemplate
+from . import analytics, assets, dashboard, health, images, profiling
+from .exclusion import ExclusionRules
+from .export import archived_ids, serialize_rows
 from .forms import ContactForm
+from .caching import cached_page, page_etag
+from .client_ip import anonymize_ip, client_ip, is_trusted_proxy
+from .prerender import static_routes
+from .profiling import histograms
+from django.conf import settings
+from .revision import deploy_version, pages_last_modified, template_fingerprint, templates_last_modified
+from .outbox import enqueue_mail, send_queued_mail
+from .lookups import LookupCache, clear_caches
+from .metrics import registry
+from .models import OutboundEmail, Referer, UserAgent, Visit, VisitDaily, VisitHourly
+from .rollups import day_bucket, hour_bucket, rebuild_rollups
+from .sampling import VisitSampler, is_bot
+from .tracking import VisitBuffer, insert_visits, visit_buffer
 from .views import get_git_revision_hash
 
 class UtilityTests(TestCase):
@@ -99,7 +145,12 @@ class ContactPageTests(TestCase):
         
         self.assertRedirects(response, self.url)
         
-        # Check that an email was sent
+        # The email is only queued by the view ...
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.PENDING).count(), 1)
+
+        # ... and sent by the background sender
+        self.assertEqual(send_queued_mail(), (1, 0))
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'Neue Anfrage von Test Firma GmbH')
         self.assertIn('Dies ist eine Testnachricht.', mail.outbox[0].body)
@@ -155,3 +206,1727 @@ class StatusPageTests(TestCase):
         self.assertTemplateUsed(response, 'status.html')
         self.assertContains(response, 'System Status')
         self.assertContains(response, 'Datenbank')
+
+    def test_metrics_requires_superuser(self):
+        url = reverse('status_metrics')
+        self.client.login(username='user', password='password')
+        self.assertRedirects(self.client.get(url), f'/admin/login/?next={url}')
+
+    def test_metrics_json(self):
+        VisitDaily.objects.create(day=timezone.localdate(), path='/', count=4)
+        VisitDaily.objects.create(day=timezone.localdate() - timedelta(days=1), path='/', count=3)
+        self.client.login(username='admin', password='password')
+        data = self.client.get(reverse('status_metrics')).json()
+        self.assertEqual(data['db_status'], 'ok')
+        self.assertEqual(data['visits_today'], 4)
+        self.assertEqual(data['visits_yesterday'], 3)
+        self.assertEqual(data['visits_total'], 7)
+        self.assertEqual(data['paths_today'], 1)
+
+    @override_settings(STATUS_CACHE_TTL=60)
+    def test_snapshot_computed_once_per_ttl(self):
+        cache.delete(dashboard.CACHE_KEY)
+        self.addCleanup(cache.delete, dashboard.CACHE_KEY)
+        # One aggregate for the KPIs, one for the latest visits
+        with self.assertNumQueries(2):
+            dashboard.get_status_snapshot()
+        with self.assertNumQueries(0), patch('subprocess.check_output') as git:
+            dashboard.get_status_snapshot()
+            dashboard.get_status_snapshot()
+        git.assert_not_called()
+
+        # The HTML page and the JSON endpoint share the cached snapshot
+        VisitDaily.objects.create(day=timezone.localdate(), path='/', count=9)
+        self.client.login(username='admin', password='password')
+        self.assertEqual(self.client.get(self.url).context['visits_total'], 0)
+        self.assertEqual(self.client.get(reverse('status_metrics')).json()['visits_total'], 0)
+
+
+@override_settings(VISIT_BUFFER_SIZE=3, VISIT_BUFFER_MAX_AGE=60, VISIT_BUFFER_MAX_PENDING=5)
+class VisitBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = VisitBuffer()
+
+    def test_flushes_when_size_reached(self):
+        self.buffer.add({'path': '/a/'})
+        self.buffer.add({'path': '/b/'})
+        self.assertEqual(Visit.objects.count(), 0)
+
+        self.buffer.add({'path': '/c/'})
+        self.assertEqual(Visit.objects.count(), 3)
+        self.assertEqual(self.buffer.stats()['flushed'], 3)
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+
+    @override_settings(VISIT_BUFFER_MAX_AGE=0)
+    def test_flushes_when_age_reached(self):
+        self.buffer.add({'path': '/a/'})
+        self.assertEqual(Visit.objects.count(), 1)
+
+    def test_explicit_flush(self):
+        self.buffer.add({'path': '/a/'})
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(Visit.objects.count(), 1)
+
+    def test_failed_flush_keeps_records_up_to_cap(self):
+        with patch('pages.tracking.insert_visits', side_effect=Exception('locked')):
+            for i in range(7):
+                self.buffer.add({'path': f'/{i}/'})
+
+        stats = self.buffer.stats()
+        self.assertEqual(stats['pending'], 5)
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['failed_flushes'], 1)
+
+        self.assertEqual(self.buffer.flush(), 5)
+        self.assertEqual(Visit.objects.count(), 5)
+
+    @override_settings(VISIT_BUFFER_MAX_ATTEMPTS=3)
+    def test_batch_dropped_after_repeated_failures(self):
+        with patch('pages.tracking.insert_visits', side_effect=Exception('value too long')):
+            for i in range(3):
+                self.buffer.add({'path': f'/{i}/'})
+            self.assertEqual(self.buffer.flush(), 0)
+            with self.assertLogs('pages.tracking', 'ERROR'):
+                self.assertEqual(self.buffer.flush(), 0)
+
+        stats = self.buffer.stats()
+        self.assertEqual((stats['pending'], stats['dropped'], stats['failed_flushes']), (0, 3, 3))
+        # Later visits are written again
+        self.buffer.add({'path': '/next/'})
+        self.assertEqual(self.buffer.flush(), 1)
+
+    def test_long_method_truncated(self):
+        self.client.generic('X-VERY-LONG-METHOD', reverse('about'))
+        visit_buffer.flush()
+        self.assertEqual(Visit.objects.get().method, 'X-VERY-LON')
+
+    def fill(self, count):
+        for i in range(count):
+            self.buffer.add({'path': f'/{i}/'})
+        self.buffer.flush()
+        return sorted(Visit.objects.values_list('path', flat=True))
+
+    @override_settings(VISIT_BUFFER_SIZE=100, VISIT_BUFFER_MAX_PENDING=2, VISIT_BUFFER_POLICY='drop-newest')
+    def test_drop_newest_policy(self):
+        self.assertEqual(self.fill(4), ['/0/', '/1/'])
+        self.assertEqual(self.buffer.stats()['dropped'], 2)
+
+    @override_settings(VISIT_BUFFER_SIZE=100, VISIT_BUFFER_MAX_PENDING=2, VISIT_BUFFER_POLICY='drop-oldest')
+    def test_drop_oldest_policy(self):
+        self.assertEqual(self.fill(4), ['/2/', '/3/'])
+        self.assertEqual(self.buffer.stats()['dropped'], 2)
+
+
+@override_settings(VISIT_WRITER_THREAD=True, VISIT_BUFFER_SIZE=10, VISIT_BUFFER_MAX_AGE=60)
+class VisitWriterThreadTests(TransactionTestCase):
+    def setUp(self):
+        self.buffer = VisitBuffer()
+
+    def tearDown(self):
+        self.buffer.shutdown()
+
+    def test_writer_flushes_full_batch(self):
+        for i in range(10):
+            self.buffer.add({'path': f'/{i}/'})
+        for _ in range(100):
+            if self.buffer.stats()['flushed'] == 10:
+                break
+            time.sleep(0.01)
+        self.assertEqual(Visit.objects.count(), 10)
+
+    def test_shutdown_drains_queue(self):
+        for i in range(3):
+            self.buffer.add({'path': f'/{i}/'})
+        self.assertFalse(self.buffer.may_block())
+
+        self.buffer.shutdown()
+        self.assertEqual(Visit.objects.count(), 3)
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+
+    @override_settings(VISIT_BUFFER_MAX_PENDING=10, VISIT_BUFFER_POLICY='block')
+    def test_block_policy_waits_for_writer(self):
+        self.assertTrue(self.buffer.may_block())
+        for i in range(25):
+            self.assertTrue(self.buffer.add({'path': f'/{i}/'}))
+
+        self.buffer.shutdown()
+        self.assertEqual(Visit.objects.count(), 25)
+        self.assertEqual(self.buffer.stats()['dropped'], 0)
+
+
+class VisitRollupTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.timestamps = [now - timedelta(minutes=47 * i) for i in range(60)]
+        self.paths = ['/', '/kontakt/', '/leistungen/']
+
+    def record_visits(self):
+        buffer = VisitBuffer()
+        for i, timestamp in enumerate(self.timestamps):
+            buffer.add({'timestamp': timestamp, 'path': self.paths[i % 3]})
+        buffer.flush()
+
+    def assertRollupsMatchRawCounts(self):
+        hourly = {}
+        daily = {}
+        for timestamp, path in Visit.objects.values_list('timestamp', 'path'):
+            hourly[(hour_bucket(timestamp), path)] = hourly.get((hour_bucket(timestamp), path), 0) + 1
+            daily[(day_bucket(timestamp), path)] = daily.get((day_bucket(timestamp), path), 0) + 1
+
+        self.assertEqual(
+            {(row.hour, row.path): row.count for row in VisitHourly.objects.all()}, hourly)
+        self.assertEqual(
+            {(row.day, row.path): row.count for row in VisitDaily.objects.all()}, daily)
+
+    def test_ingestion_updates_rollups(self):
+        self.record_visits()
+        self.assertEqual(Visit.objects.count(), 60)
+        self.assertRollupsMatchRawCounts()
+
+    def test_incremental_batches_add_up(self):
+        self.record_visits()
+        self.record_visits()
+        self.assertEqual(Visit.objects.count(), 120)
+        self.assertRollupsMatchRawCounts()
+
+    def test_backfill_from_raw_table(self):
+        Visit.objects.bulk_create(
+            [Visit(timestamp=t, path=self.paths[i % 3]) for i, t in enumerate(self.timestamps)])
+        self.assertFalse(VisitDaily.objects.exists())
+
+        out = StringIO()
+        call_command('backfill_visit_rollups', stdout=out)
+        self.assertIn('daily buckets', out.getvalue())
+        self.assertRollupsMatchRawCounts()
+
+    def test_partial_backfill_keeps_older_buckets(self):
+        self.record_visits()
+        VisitDaily.objects.filter(day=timezone.localdate()).update(count=999)
+
+        call_command('backfill_visit_rollups', days=1, stdout=StringIO())
+        self.assertRollupsMatchRawCounts()
+
+    def test_backfill_after_prune_keeps_history(self):
+        now = timezone.now()
+        buffer = VisitBuffer()
+        for days in (120, 100, 2, 1):
+            buffer.add({'timestamp': now - timedelta(days=days), 'path': '/'})
+        buffer.flush()
+        before = {(row.day, row.path): row.count for row in VisitDaily.objects.all()}
+        # The oldest day kept lost a visit: pruning cuts in the middle of a day
+        cutoff_day = timezone.localdate(now - timedelta(days=2))
+        VisitDaily.objects.filter(day=cutoff_day).update(count=2)
+        call_command('prune_visits', days=90, stdout=StringIO())
+
+        out = StringIO()
+        call_command('backfill_visit_rollups', stdout=out)
+        self.assertIn(f'Visits before {cutoff_day + timedelta(days=1)} have been archived or pruned', out.getvalue())
+        after = {(row.day, row.path): row.count for row in VisitDaily.objects.all()}
+        self.assertEqual(after, {**before, (cutoff_day, '/'): 2})
+
+        # Nothing stored anymore: every rollup is history
+        Visit.objects.all().delete()
+        call_command('backfill_visit_rollups', days=3, stdout=StringIO())
+        self.assertEqual(VisitDaily.objects.count(), 4)
+
+    def test_dashboard_reads_rollups(self):
+        self.record_visits()
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.get(reverse('status'))
+        today = timezone.localdate()
+        self.assertEqual(response.context['visits_total'], 60)
+        self.assertEqual(
+            response.context['visits_today'],
+            sum(1 for t in self.timestamps if timezone.localdate(t) == today))
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        start = analytics.day_start(self.today - timedelta(days=1))
+        buffer = VisitBuffer()
+        # 30 visits spread over yesterday and today, every third from Google
+        for i in range(30):
+            buffer.add({
+                'timestamp': start + timedelta(minutes=90 * i),
+                'path': '/kontakt/' if i % 2 else '/',
+                'referer': 'https://www.google.de/' if i % 3 == 0 else '',
+            })
+        buffer.flush()
+
+    def test_time_series_fills_gaps(self):
+        series = analytics.time_series(self.today - timedelta(days=3), self.today + timedelta(days=1), analytics.DAY)
+        self.assertEqual([day for day, _ in series], [self.today - timedelta(days=d) for d in (3, 2, 1, 0)])
+        self.assertEqual(sum(count for _, count in series), 30)
+        self.assertEqual(series[0][1], 0)
+
+    def test_hourly_series_for_one_path(self):
+        start = analytics.day_start(self.today - timedelta(days=1))
+        series = analytics.time_series(start, start + timedelta(days=2), path='/')
+        self.assertEqual(len(series), 48)
+        self.assertEqual(sum(count for _, count in series), 15)
+
+    def test_top_paths_and_referers(self):
+        start, end = self.today - timedelta(days=1), self.today + timedelta(days=1)
+        self.assertEqual(
+            analytics.top_paths(start, end), [{'path': '/', 'visits': 15}, {'path': '/kontakt/', 'visits': 15}])
+        self.assertEqual(
+            analytics.top_referers(start, end), [{'referer__value': 'https://www.google.de/', 'visits': 10}])
+
+    def test_percent_change(self):
+        self.assertEqual(analytics.percent_change(15, 12), 25)
+        self.assertEqual(analytics.percent_change(6, 12), -50)
+        self.assertIsNone(analytics.percent_change(5, 0))
+
+    def test_keyset_pages_cover_all_visits(self):
+        # Equal timestamps must neither repeat nor skip a visit across pages
+        Visit.objects.bulk_create([Visit(timestamp=analytics.day_start(self.today), path='/tie/') for _ in range(5)])
+        seen = []
+        page, cursor = analytics.visit_page(limit=7)
+        seen += page
+        while cursor:
+            page, cursor = analytics.visit_page(cursor, limit=7)
+            seen += page
+        self.assertEqual(len(seen), 35)
+        self.assertEqual(len({row['id'] for row in seen}), 35)
+        self.assertEqual(seen, sorted(seen, key=lambda row: (row['timestamp'], row['id']), reverse=True))
+
+    def test_endpoints(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        yesterday = (self.today - timedelta(days=1)).isoformat()
+
+        data = self.client.get(reverse('status_analytics'), {'from': yesterday}).json()
+        self.assertEqual([row['visits'] for row in data['series']][-2:], [
+            VisitDaily.objects.filter(day=self.today - timedelta(days=1)).aggregate(Sum('count'))['count__sum'],
+            VisitDaily.objects.filter(day=self.today).aggregate(Sum('count'))['count__sum'],
+        ])
+        self.assertEqual(data['top_referers'], [{'referer': 'https://www.google.de/', 'visits': 10}])
+        hourly = self.client.get(reverse('status_analytics'), {'from': yesterday, 'bucket': 'hour'}).json()
+        self.assertEqual(len(hourly['series']), 48)
+        self.assertEqual(self.client.get(reverse('status_analytics'), {'from': 'gestern'}).status_code, 400)
+
+        first = self.client.get(reverse('status_visits'), {'limit': 20}).json()
+        second = self.client.get(reverse('status_visits'), {'limit': 20, 'cursor': first['next']}).json()
+        self.assertEqual(len(first['visits']) + len(second['visits']), 30)
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.client.get(reverse('status_visits'), {'cursor': 'x'}).status_code, 400)
+
+    def test_out_of_range_input_rejected(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        # Beyond what timedelta holds, and beyond the year 9999
+        for cursor in ('99999999999999999999-1', '10000000000000000000-1', '-99999999999999999-1'):
+            self.assertEqual(self.client.get(reverse('status_visits'), {'cursor': cursor}).status_code, 400, cursor)
+        for params in ({'to': '9999-12-31'}, {'from': '9999-12-31', 'to': '9999-12-31'},
+                       {'from': '0001-01-01', 'to': '0001-01-01'}):
+            self.assertEqual(self.client.get(reverse('status_analytics'), params).status_code, 400, params)
+        self.assertEqual(
+            self.client.get(reverse('status_analytics'), {'from': '9999-12-29', 'to': '9999-12-30'}).status_code, 200)
+
+    def test_dashboard_shows_day_over_day_delta(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('status'))
+        delta = analytics.percent_change(response.context['visits_today'], response.context['visits_yesterday'])
+        self.assertEqual(response.context['visits_delta'], delta)
+        self.assertNotContains(response, '+12%')
+
+
+class ArchiveVisitsTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        Visit.objects.bulk_create(
+            [Visit(timestamp=now - timedelta(days=100, minutes=i), path=f'/old/{i}/') for i in range(25)]
+            + [Visit(timestamp=now - timedelta(days=1), path='/recent/')]
+        )
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def archive(self, **options):
+        options.setdefault('days', 90)
+        call_command('archive_visits', output_dir=self.tmp.name, stdout=StringIO(), **options)
+        return sorted(Path(self.tmp.name).iterdir())
+
+    def test_archives_and_deletes_old_visits(self):
+        files = self.archive(chunk_size=10, batch_size=3)
+
+        self.assertEqual(len(files), 3)
+        rows = []
+        for f in files:
+            with gzip.open(f, 'rt', encoding='utf-8') as fh:
+                rows.extend(json.loads(line) for line in fh)
+        self.assertEqual(len(rows), 25)
+        self.assertTrue(all(row['path'].startswith('/old/') for row in rows))
+
+        self.assertEqual(list(Visit.objects.values_list('path', flat=True)), ['/recent/'])
+
+    def test_csv_format(self):
+        files = self.archive(format='csv')
+        with gzip.open(files[0], 'rt', encoding='utf-8') as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,path,method,user_agent,ip_address_anonymized,referer,weight')
+        self.assertEqual(len(lines), 26)
+        self.assertEqual(len(archived_ids(files[0], 'csv')), 25)
+
+    def test_csv_archive_keeps_values(self):
+        Visit.objects.filter(path='/old/0/').update(path='=1+1')
+        files = self.archive(format='csv')
+        with gzip.open(files[0], 'rt', encoding='utf-8', newline='') as fh:
+            paths = [row[2] for row in csv.reader(fh)]
+        self.assertIn('=1+1', paths)
+
+    def test_rerun_is_idempotent(self):
+        self.archive(chunk_size=10)
+        files = self.archive(chunk_size=10)
+        self.assertEqual(len(files), 3)
+        self.assertEqual(Visit.objects.count(), 1)
+
+    def test_interrupted_run_not_archived_twice(self):
+        ids = set(Visit.objects.filter(path__startswith='/old/').values_list('id', flat=True))
+        # Stopped after the second DELETE batch of the first chunk
+        with patch('pages.management.commands.archive_visits.time.sleep', side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                self.archive(chunk_size=10, batch_size=3, pause=0.01)
+        self.assertEqual(Visit.objects.count(), 26 - 6)
+
+        files = self.archive(chunk_size=10, batch_size=3)
+        archived = [visit_id for f in files for visit_id in archived_ids(f, 'jsonl')]
+        self.assertEqual(sorted(archived), sorted(ids))
+        self.assertEqual(Visit.objects.count(), 1)
+
+    def test_invalid_days(self):
+        with self.assertRaisesMessage(CommandError, '--days is too large.'):
+            self.archive(days=10 ** 9)
+
+    def test_instant_run_reports_rate(self):
+        with patch('pages.management.commands.archive_visits.time.monotonic', return_value=1.0):
+            self.archive()
+        self.assertEqual(Visit.objects.count(), 1)
+
+    def test_prune_without_archive(self):
+        call_command('prune_visits', days=90, output_dir=self.tmp.name, stdout=StringIO())
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+        self.assertEqual(Visit.objects.count(), 1)
+
+    def test_unused_lookup_rows_deleted(self):
+        lookup = lambda model, value: model.objects.create(value=value, digest=model.make_digest(value))
+        shared, old_agent = lookup(UserAgent, 'Firefox'), lookup(UserAgent, 'Netscape')
+        old_referers = [lookup(Referer, f'https://example.com/{i}') for i in range(5)]
+        Visit.objects.filter(path__startswith='/old/').update(user_agent=old_agent)
+        for referer, visit in zip(old_referers, Visit.objects.filter(path__startswith='/old/')):
+            Visit.objects.filter(pk=visit.pk).update(referer=referer)
+        Visit.objects.filter(path='/old/0/').update(user_agent=shared)
+        Visit.objects.filter(path='/recent/').update(user_agent=shared, referer=old_referers[0])
+
+        call_command('prune_visits', days=90, batch_size=2, stdout=StringIO())
+        self.assertEqual(list(UserAgent.objects.values_list('value', flat=True)), ['Firefox'])
+        self.assertEqual(list(Referer.objects.values_list('value', flat=True)), ['https://example.com/0'])
+
+
+class ExportVisitsTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        agent = UserAgent.objects.create(value='Mozilla/5.0')
+        Visit.objects.bulk_create(
+            [Visit(timestamp=now - timedelta(days=10), path=f'/leistungen/{i}/', user_agent=agent) for i in range(5)]
+            + [Visit(timestamp=now - timedelta(days=10), path='/kontakt/'), Visit(timestamp=now, path='/leistungen/')]
+        )
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def export(self, name, *args, **options):
+        target = os.path.join(self.tmp.name, name)
+        out = StringIO()
+        call_command('export_visits', target, *args, stdout=out, chunk_size=2, **options)
+        return target, out.getvalue()
+
+    def test_csv(self):
+        target, out = self.export('visits.csv')
+        with open(target, encoding='utf-8') as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,path,method,user_agent,ip_address_anonymized,referer,weight')
+        self.assertEqual(len(lines), 8)
+        self.assertIn(',/leistungen/0/,GET,Mozilla/5.0,,,1', lines[1])
+        self.assertIn('Exported 7 visits', out)
+
+    def test_csv_formulas_escaped(self):
+        Visit.objects.create(
+            timestamp=timezone.now(), path='/-/',
+            user_agent=UserAgent.objects.create(value='=HYPERLINK("http://example.com","x")'),
+            referer=Referer.objects.create(value='@SUM(1+1)'),
+        )
+        target, _ = self.export('visits.csv')
+        with open(target, encoding='utf-8', newline='') as fh:
+            row = list(csv.reader(fh))[-1]
+        self.assertEqual(row[2], '/-/')
+        self.assertEqual(row[4], '\'=HYPERLINK("http://example.com","x")')
+        self.assertEqual(row[6], "'@SUM(1+1)")
+        self.assertEqual(row[7], '1')
+
+        target, _ = self.export('visits.jsonl', '--format=jsonl')
+        with open(target, encoding='utf-8') as fh:
+            last = json.loads(fh.read().splitlines()[-1])
+        self.assertEqual(last['referer'], '@SUM(1+1)')
+        for prefix in ('+', '-', '\t', '\r'):
+            rows = list(csv.reader(serialize_rows([(prefix + '1', -1)], 'csv', ('path', 'weight'), escape_formulas=True)))
+            self.assertEqual(rows[1], ["'" + prefix + '1', '-1'])
+
+    def test_gzip_jsonl_with_filters(self):
+        day = (timezone.localdate() - timedelta(days=10)).isoformat()
+        target, out = self.export('visits.jsonl.gz', '--format=jsonl', f'--since={day}', f'--until={day}', '--path-prefix=/leistungen/')
+        with gzip.open(target, 'rt', encoding='utf-8') as fh:
+            rows = [json.loads(line) for line in fh]
+        self.assertEqual([row['path'] for row in rows], [f'/leistungen/{i}/' for i in range(5)])
+        self.assertIn('Exported 5 visits', out)
+
+    def test_invalid_date(self):
+        with self.assertRaises(CommandError):
+            self.export('visits.csv', '--since=gestern')
+        for option in ('--until=9999-12-31', '--since=0001-01-01'):
+            with self.assertRaisesMessage(CommandError, 'out of range'):
+                self.export('visits.csv', option)
+
+    def test_admin_action_streams(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        data = {'action': 'export_jsonl', 'select_across': '1', 'index': '0',
+                '_selected_action': list(Visit.objects.values_list('id', flat=True))}
+        url = reverse('admin:pages_visit_changelist')
+
+        response = self.client.post(url, data)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('attachment; filename="visits-', response['Content-Disposition'])
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 7)
+
+        response = self.client.post(url, data, headers={'accept-encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 7)
+
+
+class VisitAdminTests(TestCase):
+    def setUp(self):
+        firefox = UserAgent.objects.create(value='Mozilla/5.0 (X11; Linux x86_64; rv:140.0) Gecko/20100101 Firefox/140.0')
+        curl = UserAgent.objects.create(value='curl/8.5')
+        google = Referer.objects.create(value='https://www.google.de/')
+        Visit.objects.bulk_create([
+            Visit(path='/leistungen/', user_agent=firefox, referer=google),
+            Visit(path='/kontakt/', user_agent=curl),
+            Visit(path='/impressum/', user_agent=curl, method='HEAD'),
+        ])
+        # Paths are searched in the daily rollups
+        rebuild_rollups()
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        self.url = reverse('admin:pages_visit_changelist')
+
+    def paths(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(visit.path for visit in response.context['cl'].result_list)
+
+    def test_search(self):
+        self.assertEqual(self.paths(q='FIREFOX'), ['/leistungen/'])
+        self.assertEqual(self.paths(q='google'), ['/leistungen/'])
+        self.assertEqual(self.paths(q='takt'), ['/kontakt/'])
+        self.assertEqual(self.paths(q='curl impressum'), ['/impressum/'])
+        self.assertEqual(self.paths(q='"curl/8"'), ['/impressum/', '/kontakt/'])
+        # Shorter than a trigram
+        self.assertEqual(self.paths(q='rv'), ['/leistungen/'])
+        self.assertEqual(self.paths(q='nirgends'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite full-text search')
+    def test_search_uses_fts_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.paths(q='firefox')
+        sql = '\n'.join(query['sql'] for query in queries)
+        self.assertIn('pages_useragent_fts MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+
+    def test_search_index_follows_lookup_tables(self):
+        agent = UserAgent.objects.get(value='curl/8.5')
+        agent.value = 'Wget/1.21'
+        agent.save()
+        self.assertEqual(self.paths(q='wget'), ['/impressum/', '/kontakt/'])
+        self.assertEqual(self.paths(q='curl'), [])
+
+    def test_estimated_count(self):
+        self.assertEqual(self.client.get(self.url).context['cl'].result_count, 3)
+        Visit.objects.create(id=Visit.objects.order_by('id').first().id + 20000, path='/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 20001)
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()])
+        # Filtered counts are exact
+        self.assertEqual(self.client.get(self.url, {'method': 'HEAD'}).context['cl'].result_count, 1)
+
+    def test_user_agent_truncated_in_query(self):
+        content = self.client.get(self.url).content.decode()
+        self.assertIn('Mozilla/5.0 (X11; Linux x86_64; rv:140.0) Gecko/20...', content)
+        self.assertNotIn('Firefox/140.0', content)
+        self.assertIn('<td class="field-user_agent_truncated">curl/8.5</td>', content)
+
+
+class ExclusionRulesTests(TestCase):
+    def test_prefixes_and_exact_paths(self):
+        rules = ExclusionRules(prefixes=['/static/', '/admin/'], paths=['/favicon.ico', '/static'])
+        self.assertTrue(rules.excludes('/static/css/site.css'))
+        self.assertTrue(rules.excludes('/static'))
+        self.assertTrue(rules.excludes('/admin/'))
+        self.assertTrue(rules.excludes('/favicon.ico'))
+        self.assertFalse(rules.excludes('/favicon.ico.bak'))
+        self.assertFalse(rules.excludes('/staticfiles/'))
+        self.assertFalse(rules.excludes('/'))
+        self.assertFalse(rules.excludes('/kontakt/'))
+
+    def test_matches_naive_implementation(self):
+        rng = random.Random(5)
+        alphabet = 'ab/.'
+        word = lambda: '/' + ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 5)))
+        prefixes = [word() for _ in range(60)]
+        paths = [word() for _ in range(60)]
+        rules = ExclusionRules(prefixes=prefixes, paths=paths)
+
+        for _ in range(2000):
+            path = word()
+            expected = path in paths or any(path.startswith(p) for p in prefixes)
+            self.assertEqual(rules.excludes(path), expected, path)
+
+    def test_user_agents_methods_and_statuses(self):
+        rules = ExclusionRules(user_agents=[r'bot\b', r'^curl/'], methods=['HEAD'], statuses=[404])
+        self.assertTrue(rules.excludes('/', user_agent='Mozilla/5.0 (compatible; Googlebot/2.1)'))
+        self.assertTrue(rules.excludes('/', user_agent='curl/8.4.0'))
+        self.assertFalse(rules.excludes('/', user_agent='Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0'))
+        self.assertTrue(rules.excludes('/', method='HEAD'))
+        self.assertTrue(rules.excludes_status(404))
+        self.assertFalse(rules.excludes_status(200))
+
+    def test_empty_rules_exclude_nothing(self):
+        rules = ExclusionRules()
+        self.assertFalse(rules.excludes('/', user_agent='Googlebot'))
+        self.assertFalse(rules.excludes_status(404))
+
+
+class VisitSamplingTests(TestCase):
+    GOOGLEBOT = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+    BROWSER = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0'
+
+    def estimate(self, sampler, requests, user_agent=''):
+        return sum(sampler.weight(user_agent) for _ in range(requests))
+
+    def test_bot_classifier_is_cached(self):
+        is_bot.cache_clear()
+        self.assertTrue(is_bot(self.GOOGLEBOT))
+        self.assertTrue(is_bot(self.GOOGLEBOT))
+        self.assertFalse(is_bot(self.BROWSER))
+        self.assertFalse(is_bot(''))
+        self.assertEqual(is_bot.cache_info().hits, 1)
+
+    @override_settings(VISIT_BOT_USER_AGENTS=[r'^Firefox'])
+    def test_classifier_follows_settings(self):
+        self.assertTrue(is_bot('firefox/1.0'))
+        self.assertFalse(is_bot(self.GOOGLEBOT))
+
+    @override_settings(VISIT_SAMPLING='off', VISIT_BOT_SAMPLE_RATE=0)
+    def test_bots_dropped_humans_kept(self):
+        sampler = VisitSampler()
+        self.assertEqual(sampler.weight(self.GOOGLEBOT), 0)
+        self.assertEqual(sampler.weight(self.BROWSER), 1)
+        self.assertEqual(sampler.stats()['bots_dropped'], 1)
+
+    @override_settings(VISIT_SAMPLING='off', VISIT_BOT_SAMPLE_RATE=0.1)
+    def test_bots_down_sampled(self):
+        sampler = VisitSampler(random=random.Random(1).random)
+        weights = {sampler.weight(self.GOOGLEBOT) for _ in range(100)}
+        self.assertEqual(weights, {0, 10})
+
+    @override_settings(VISIT_SAMPLING='fixed', VISIT_SAMPLE_RATE=0.25)
+    def test_fixed_rate_is_unbiased(self):
+        sampler = VisitSampler(random=random.Random(2).random)
+        self.assertAlmostEqual(self.estimate(sampler, 20000), 20000, delta=20000 * 0.05)
+        self.assertAlmostEqual(sampler.stats()['sampled_out'], 15000, delta=20000 * 0.05)
+
+    @override_settings(VISIT_SAMPLING='adaptive', VISIT_SAMPLING_TARGET_RATE=20)
+    def test_adaptive_sampling_kicks_in_under_load(self):
+        sampler = VisitSampler(random=random.Random(3).random)
+        self.assertEqual(self.estimate(sampler, 20), 20)  # below target, all kept
+
+        estimate = self.estimate(sampler, 5000)
+        self.assertGreater(sampler.stats()['sampled_out'], 4000)
+        self.assertAlmostEqual(estimate, 5000, delta=5000 * 0.15)
+
+    def test_weights_reach_rollups(self):
+        buffer = VisitBuffer()
+        buffer.add({'path': '/', 'weight': 2})
+        buffer.add({'path': '/', 'weight': 2})
+        buffer.add({'path': '/', 'weight': 1})
+        buffer.flush()
+        self.assertEqual(VisitDaily.objects.get().count, 5)
+
+
+def ipv4_forms(rng, address):
+    """Ways an IPv4 address shows up in REMOTE_ADDR or X-Forwarded-For."""
+    mapped = ipaddress.IPv6Address(int(address) | 0xffff00000000)
+    return [
+        str(address),
+        f'{address}:{rng.randrange(1, 65536)}',
+        f' {address}\t',
+        f'::ffff:{address}',
+        f'[::ffff:{address}]:443',
+        mapped.exploded.upper(),
+    ]
+
+
+def ipv6_forms(rng, address):
+    return [
+        str(address),
+        address.exploded,
+        address.exploded.upper(),
+        f'[{address}]:{rng.randrange(1, 65536)}',
+        f'{address}%eth{rng.randrange(4)}',
+        f' {address} ',
+    ]
+
+
+def random_ipv6(rng):
+    # Runs of zero groups, so that every :: position is covered
+    groups = [rng.randrange(65536) if rng.random() < 0.6 else 0 for _ in range(8)]
+    address = ipaddress.IPv6Address(int.from_bytes(b''.join(g.to_bytes(2, 'big') for g in groups), 'big'))
+    return address if address.ipv4_mapped is None else ipaddress.IPv6Address(int(address) ^ 1 << 100)
+
+
+@override_settings(VISIT_TRUSTED_PROXIES=['127.0.0.1', '::1', '10.0.0.0/8', '2001:db8:ff::/48'])
+class ClientIPTests(SimpleTestCase):
+    def test_ipv4_masked_to_24(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            address = ipaddress.IPv4Address(rng.getrandbits(32))
+            expected = str(ipaddress.ip_network(f'{address}/24', strict=False).network_address)
+            for form in ipv4_forms(rng, address):
+                self.assertEqual(anonymize_ip(form), expected, form)
+
+    def test_ipv6_masked_to_48(self):
+        rng = random.Random(8)
+        for _ in range(2000):
+            address = random_ipv6(rng)
+            expected = str(ipaddress.ip_network(f'{address}/48', strict=False).network_address)
+            for form in ipv6_forms(rng, address):
+                self.assertEqual(anonymize_ip(form), expected, form)
+        self.assertEqual(anonymize_ip('2001:0db8:85a3:0000:0000:8a2e:0370:7334'), '2001:db8:85a3::')
+
+    def test_accepts_what_ipaddress_accepts(self):
+        rng = random.Random(9)
+        alphabet = '0123456789abcdefABCDEF:.'
+        for _ in range(5000):
+            address = str(random_ipv6(rng) if rng.random() < 0.5 else ipaddress.IPv4Address(rng.getrandbits(32)))
+            # Mutate valid addresses, random strings are almost never close to one
+            chars = list(address)
+            for _ in range(rng.randint(0, 2)):
+                position = rng.randrange(len(chars) + 1)
+                if rng.random() < 0.5 and position < len(chars):
+                    del chars[position]
+                else:
+                    chars.insert(position, rng.choice(alphabet))
+            value = ''.join(chars)
+            if value.count(':') == 1:  # read as address and port
+                continue
+            try:
+                expected = ipaddress.ip_address(value)
+            except ValueError:
+                self.assertIsNone(anonymize_ip(value), value)
+                continue
+            result = anonymize_ip(value)
+            self.assertEqual(str(ipaddress.ip_address(result)), result)
+            self.assertIn(getattr(expected, 'ipv4_mapped', None) or expected, ipaddress.ip_network(
+                f'{result}/{24 if ":" not in result else 48}'))
+
+    def test_invalid_addresses(self):
+        for value in (None, '', ' ', 'unknown', '1.2.3', '256.1.1.1', '01.2.3.4', '1::2::3',
+                      '2001:db8::g', '[2001:db8::1', '%eth0', '1.2.3.4\x00', '_hidden'):
+            self.assertIsNone(anonymize_ip(value), repr(value))
+
+    def test_cache_is_bounded(self):
+        anonymize_ip.cache_clear()
+        anonymize_ip('203.0.113.7')
+        anonymize_ip('203.0.113.7')
+        info = anonymize_ip.cache_info()
+        self.assertEqual((info.hits, info.maxsize), (1, 4096))
+
+    def test_forwarded_for_only_from_trusted_proxies(self):
+        self.assertEqual(client_ip({'REMOTE_ADDR': '198.51.100.4'}), '198.51.100.4')
+        # A client cannot choose its address by sending the header itself
+        self.assertEqual(client_ip({'REMOTE_ADDR': '198.51.100.4', 'HTTP_X_FORWARDED_FOR': '203.0.113.7'}),
+                         '198.51.100.4')
+        self.assertEqual(client_ip({'REMOTE_ADDR': '127.0.0.1', 'HTTP_X_FORWARDED_FOR': ' 203.0.113.7 '}),
+                         '203.0.113.7')
+        # Forged hops left of the client are ignored, our proxies right of it skipped
+        self.assertEqual(client_ip({
+            'REMOTE_ADDR': '10.1.2.3',
+            'HTTP_X_FORWARDED_FOR': '1.1.1.1, 2001:db8:1::5 ,10.0.0.9,  [2001:db8:ff::2]:80',
+        }), '2001:db8:1::5')
+        # Only our own proxies: the leftmost is the client
+        self.assertEqual(client_ip({'REMOTE_ADDR': '::1', 'HTTP_X_FORWARDED_FOR': '10.0.0.5, 10.0.0.6'}), '10.0.0.5')
+        self.assertEqual(client_ip({'REMOTE_ADDR': '127.0.0.1', 'HTTP_X_FORWARDED_FOR': ' , '}), '127.0.0.1')
+        self.assertIsNone(client_ip({}))
+        self.assertIsNone(anonymize_ip(client_ip({'REMOTE_ADDR': '127.0.0.1', 'HTTP_X_FORWARDED_FOR': 'unknown'})))
+
+    def test_resolves_rightmost_untrusted_hop(self):
+        rng = random.Random(10)
+        proxies = ['10.0.0.1', '10.200.3.4', '::ffff:10.9.9.9', '2001:db8:ff::1', '2001:db8:ff:1::7']
+        clients = ['203.0.113.7', '2001:db8:1::5', '::ffff:198.51.100.1', '2001:db8:fe::1']
+        for _ in range(2000):
+            hops = [rng.choice(proxies + clients) for _ in range(rng.randint(1, 6))]
+            header = ','.join(' ' * rng.randint(0, 2) + hop + ' ' * rng.randint(0, 2) for hop in hops)
+            untrusted = [hop for hop in hops if hop in clients]
+            expected = untrusted[-1] if untrusted else hops[0]
+            self.assertEqual(client_ip({'REMOTE_ADDR': rng.choice(proxies), 'HTTP_X_FORWARDED_FOR': header}),
+                             expected, header)
+
+    def test_trusted_proxies_follow_settings(self):
+        self.assertTrue(is_trusted_proxy('10.255.0.1'))
+        with self.settings(VISIT_TRUSTED_PROXIES=['192.0.2.0/24']):
+            self.assertFalse(is_trusted_proxy('10.255.0.1'))
+            self.assertTrue(is_trusted_proxy('192.0.2.200'))
+        for invalid in (['localhost'], ['10.0.0.0/33'], ['10.0.0.0/x']):
+            with self.settings(VISIT_TRUSTED_PROXIES=invalid), self.assertRaises(ImproperlyConfigured):
+                is_trusted_proxy('10.0.0.1')
+
+
+@override_settings(VISIT_LOOKUP_CACHE_SIZE=2)
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        self.cache = LookupCache(UserAgent)
+
+    def test_resolves_and_creates_values(self):
+        ids = self.cache.resolve(['A', 'B', '', None, 'A'])
+        self.assertEqual(set(ids), {'A', 'B'})
+        self.assertEqual(UserAgent.objects.get(pk=ids['A']).value, 'A')
+        self.assertEqual(UserAgent.objects.get(pk=ids['A']).digest, UserAgent.make_digest('A'))
+
+    def test_cached_values_need_no_queries(self):
+        first = self.cache.resolve(['A', 'B'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.resolve(['B', 'A']), first)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_least_recently_used_value_is_evicted(self):
+        self.cache.resolve(['A', 'B'])
+        self.cache.resolve(['A'])
+        self.cache.resolve(['C'])
+        with self.assertNumQueries(0):
+            self.cache.resolve(['A', 'C'])
+        with self.assertNumQueries(2):
+            self.cache.resolve(['B'])
+
+    def test_existing_rows_are_reused(self):
+        existing = UserAgent.objects.create(value='A')
+        self.assertEqual(self.cache.resolve(['A']), {'A': existing.pk})
+        self.assertEqual(UserAgent.objects.count(), 1)
+
+    def test_buffer_writes_foreign_keys(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        buffer = VisitBuffer()
+        for _ in range(3):
+            buffer.add({'path': '/', 'user_agent': 'Firefox', 'referer': 'https://example.com/'})
+            buffer.flush()
+
+        self.assertEqual(UserAgent.objects.count(), 1)
+        self.assertEqual(Referer.objects.count(), 1)
+        self.assertEqual(
+            set(Visit.objects.values_list('user_agent__value', 'referer__value')),
+            {('Firefox', 'https://example.com/')})
+
+
+class EncodeVisitsMigrationTests(TransactionTestCase):
+    before = [('pages', '0005_visit_weight')]
+    after = [('pages', '0006_encode_user_agent_referer')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_existing_rows_are_encoded(self):
+        apps = self.migrate(self.before)
+        OldVisit = apps.get_model('pages', 'Visit')
+        OldVisit.objects.create(path='/', user_agent='Firefox', referer='https://example.com/')
+        OldVisit.objects.create(path='/a/', user_agent='Firefox', referer='')
+        OldVisit.objects.create(path='/b/', user_agent=None, referer=None)
+
+        apps = self.migrate(self.after)
+        NewVisit = apps.get_model('pages', 'Visit')
+        rows = NewVisit.objects.order_by('path').values_list('path', 'user_agent__value', 'referer__value')
+        self.assertEqual(list(rows), [
+            ('/', 'Firefox', 'https://example.com/'),
+            ('/a/', 'Firefox', None),
+            ('/b/', None, None),
+        ])
+        self.assertEqual(apps.get_model('pages', 'UserAgent').objects.count(), 1)
+
+        # And back again
+        apps = self.migrate(self.before)
+        OldVisit = apps.get_model('pages', 'Visit')
+        self.assertEqual(OldVisit.objects.get(path='/').user_agent, 'Firefox')
+
+    def test_encoded_in_chunks(self):
+        migration = importlib.import_module('pages.migrations.0006_encode_user_agent_referer')
+        apps = self.migrate(self.before)
+        OldVisit = apps.get_model('pages', 'Visit')
+        OldVisit.objects.bulk_create([
+            OldVisit(path=f'/{i}/', user_agent=f'Agent {i % 3}', referer=f'https://example.com/{i}' if i % 2 else '')
+            for i in range(11)
+        ])
+
+        with patch.object(migration, 'CHUNK_SIZE', 4):
+            apps = self.migrate(self.after)
+        rows = apps.get_model('pages', 'Visit').objects.values_list('path', 'user_agent__value', 'referer__value')
+        for path, user_agent, referer in rows:
+            i = int(path.strip('/'))
+            self.assertEqual((user_agent, referer), (f'Agent {i % 3}', f'https://example.com/{i}' if i % 2 else None))
+        self.assertEqual(apps.get_model('pages', 'UserAgent').objects.count(), 3)
+        self.assertEqual(apps.get_model('pages', 'Referer').objects.count(), 5)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def get_rendered(self, client, url):
+        """Return the response and whether a template was rendered for it."""
+        response = client.get(url)
+        return response, bool(response.templates)
+
+    def test_second_request_served_from_cache(self):
+        first, rendered = self.get_rendered(self.client, reverse('about'))
+        self.assertTrue(rendered)
+        second, rendered = self.get_rendered(self.client, reverse('about'))
+        self.assertFalse(rendered)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+
+    def test_pages_are_cached_per_url(self):
+        self.client.get(reverse('imprint'))
+        response, rendered = self.get_rendered(self.client, reverse('privacy'))
+        self.assertTrue(rendered)
+
+    def test_authenticated_users_bypass_cache(self):
+        self.client.get(reverse('about'))
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response, rendered = self.get_rendered(self.client, reverse('about'))
+        self.assertTrue(rendered)
+
+    def test_pending_messages_bypass_cache(self):
+        self.client.get(reverse('about'))
+        other = Client()
+        other.post(reverse('contact'), {
+            'name': 'Test Firma GmbH', 'email': 'test@example.com', 'message': 'Hallo',
+        })
+        response, rendered = self.get_rendered(other, reverse('about'))
+        self.assertTrue(rendered)
+
+    def test_new_deploy_invalidates_cache(self):
+        self.client.get(reverse('about'))
+        self.addCleanup(deploy_version.cache_clear)
+        with override_settings(DEPLOY_REVISION='next-release'):
+            deploy_version.cache_clear()
+            response, rendered = self.get_rendered(self.client, reverse('about'))
+        self.assertTrue(rendered)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self.client.get(reverse('services'))
+                response, rendered = self.get_rendered(self.client, reverse('services'))
+        self.assertFalse(rendered)
+        self.assertContains(response, 'Südwest Energie')
+
+    def test_contact_form_is_not_cached(self):
+        self.client.get(reverse('contact'))
+        response, rendered = self.get_rendered(self.client, reverse('contact'))
+        self.assertTrue(rendered)
+
+    def test_template_fingerprint_is_stable(self):
+        first = template_fingerprint()
+        template_fingerprint.cache_clear()
+        self.assertEqual(template_fingerprint(), first)
+
+
+@override_settings(PAGE_VALIDATORS_ENABLED=True, PAGE_CACHE_ENABLED=False, PAGE_MAX_AGE=300)
+class ConditionalPageTests(TestCase):
+    def test_validators_and_cache_control(self):
+        response = self.client.get(reverse('services'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], page_etag(RequestFactory().get(reverse('services'))))
+        self.assertIn('Last-Modified', response)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=300', response['Cache-Control'])
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_if_none_match_returns_304_without_rendering(self):
+        etag = self.client.get(reverse('home'))['ETag']
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.templates, [])
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since_returns_304(self):
+        last_modified = self.client.get(reverse('home'))['Last-Modified']
+        response = self.client.get(reverse('home'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_asset_deploy_updates_last_modified(self):
+        """A deploy that only rebuilt the assets must not be answered with 304."""
+        before = self.client.get(reverse('home'))
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = Path(tmp) / 'manifest.json'
+            manifest.write_text('{"css/site.css": "css/site.0123abcd.css"}')
+            deployed = templates_last_modified() + 3600
+            os.utime(manifest, (deployed, deployed))
+            with override_settings(ASSETS_OUTPUT_DIR=tmp):
+                response = self.client.get(reverse('home'), HTTP_IF_MODIFIED_SINCE=before['Last-Modified'])
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Last-Modified'], http_date(deployed))
+                # If-None-Match takes precedence, the ETag has to change as well
+                response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=before['ETag'])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], before['ETag'])
+
+    def test_stale_etag_renders_page(self):
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'home.html')
+
+    def test_etag_differs_per_page(self):
+        self.assertNotEqual(
+            self.client.get(reverse('about'))['ETag'],
+            self.client.get(reverse('process'))['ETag'])
+
+    def test_logged_in_users_get_no_validators(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('about'))
+        self.assertNotIn('ETag', response)
+
+    def test_etag_changes_with_deploy(self):
+        before = self.client.get(reverse('about'))['ETag']
+        self.addCleanup(deploy_version.cache_clear)
+        with override_settings(DEPLOY_REVISION='next-release'):
+            deploy_version.cache_clear()
+            after = self.client.get(reverse('about'))['ETag']
+        self.assertNotEqual(before, after)
+
+    @override_settings(DEPLOY_REVISION='release-1')
+    def test_validators_stable_across_workers(self):
+        """A separate process (another worker) computes the same validators."""
+        self.addCleanup(deploy_version.cache_clear)
+        deploy_version.cache_clear()
+        request = RequestFactory().get(reverse('about'))
+        expected = f'{page_etag(request)} {pages_last_modified()}'
+
+        script = (
+            'import django; django.setup()\n'
+            'from django.test import RequestFactory\n'
+            'from pages.caching import page_etag\n'
+            'from pages.revision import pages_last_modified\n'
+            f'print(page_etag(RequestFactory().get({reverse("about")!r})), pages_last_modified())\n'
+        )
+        env = dict(os.environ, DEPLOY_REVISION='release-1')
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'suedwest_project.settings')
+        output = subprocess.check_output([sys.executable, '-c', script], env=env, cwd=settings.BASE_DIR)
+        self.assertEqual(output.decode('utf-8').strip(), expected)
+
+
+class PrerenderTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        call_command('prerender_pages', output_dir=self.root, stdout=StringIO())
+        override = override_settings(PRERENDER_ENABLED=True, PRERENDER_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = Client()
+
+    def test_only_content_routes_are_rendered(self):
+        self.assertEqual(sorted(static_routes()), sorted([
+            '/', '/ueber-uns/', '/leistungen/', '/ablauf/', '/impressum/', '/datenschutz/', '/agb/',
+        ]))
+        manifest = json.loads((Path(self.root) / 'manifest.json').read_text())
+        self.assertEqual(manifest['version'], deploy_version())
+        self.assertTrue((Path(self.root) / 'ueber-uns' / 'index.html.gz').exists())
+
+    def test_served_from_memory_and_tracked(self):
+        response = self.client.get(reverse('about'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.templates, [])
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('Südwest Energie', gzip.decompress(response.content).decode('utf-8'))
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+
+        self.assertEqual(list(Visit.objects.values_list('path', flat=True)), ['/ueber-uns/'])
+
+    def test_brotli_preferred_when_available(self):
+        response = self.client.get(reverse('home'), HTTP_ACCEPT_ENCODING='gzip, br')
+        expected = 'br' if (Path(self.root) / 'index.html.br').exists() else 'gzip'
+        self.assertEqual(response['Content-Encoding'], expected)
+
+    def test_identity_when_compression_not_accepted(self):
+        response = self.client.get(reverse('home'), HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertContains(response, 'Südwest Energie')
+
+    def test_not_modified(self):
+        etag = self.client.get(reverse('home'))['ETag']
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_forms_and_status_stay_dynamic(self):
+        response = self.client.get(reverse('contact'))
+        self.assertTemplateUsed(response, 'contact.html')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_session_cookie_falls_through(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('about'))
+        self.assertTemplateUsed(response, 'about.html')
+
+    def test_stale_render_is_ignored(self):
+        self.addCleanup(deploy_version.cache_clear)
+        with override_settings(DEPLOY_REVISION='next-release'):
+            deploy_version.cache_clear()
+            response = Client().get(reverse('about'))
+        self.assertTemplateUsed(response, 'about.html')
+
+
+@cached_page
+def form_page(request):
+    # Stands for a content page with a form, {% csrf_token %} calls get_token()
+    return HttpResponse(get_token(request))
+
+
+# Used as ROOT_URLCONF by ContentFastPathTests
+urlpatterns = [
+    path('formular/', form_page),
+    path('', include('suedwest_project.urls')),
+]
+
+
+class ContentFastPathTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.session = patch.object(SessionMiddleware, 'process_request', autospec=True,
+                                     side_effect=SessionMiddleware.process_request)
+
+    def test_content_page_skips_session_and_auth(self):
+        with self.session as session:
+            response = self.client.get(reverse('about'))
+        session.assert_not_called()
+        self.assertTemplateUsed(response, 'about.html')
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+        self.assertEqual(list(Visit.objects.values_list('path', flat=True)), ['/ueber-uns/'])
+
+    def test_other_routes_and_cookies_take_full_stack(self):
+        with self.session as session:
+            self.client.get(reverse('contact'))
+            self.client.cookies[settings.SESSION_COOKIE_NAME] = 'abc'
+            self.client.get(reverse('about'))
+            self.client.get(reverse('home'))
+        self.assertEqual(session.call_count, 3)
+        self.assertEqual(Visit.objects.count(), 3)
+
+    @override_settings(CONTENT_FAST_PATH=False)
+    def test_disabled(self):
+        with self.session as session:
+            self.client.get(reverse('about'))
+        session.assert_called_once()
+
+    @override_settings(ROOT_URLCONF='pages.tests')
+    def test_form_gets_valid_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        with self.session as session:
+            response = client.get('/formular/')
+        session.assert_not_called()
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertIn('Cookie', response['Vary'])
+
+        response = client.post(reverse('contact'), {
+            'name': 'Test Firma GmbH', 'email': 'test@example.com', 'message': 'Hallo',
+            'csrfmiddlewaretoken': response.content.decode(),
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_metrics_route_label(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.client.get(reverse('about'))
+        self.assertEqual(
+            registry.counters.get('["http_requests_total", [["method", "GET"], ["route", "about"], ["status", "200"]]]'),
+            1)
+
+
+class CountingBackend(LocmemBackend):
+    """Counts connection opens and fails for subjects listed in fail_subjects."""
+    opened = 0
+    fail_subjects = ()
+    unreachable = False
+
+    def open(self):
+        if self.unreachable:
+            raise ConnectionRefusedError('no mail server')
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.subject in self.fail_subjects:
+                raise OSError('550 rejected')
+        return super().send_messages(messages)
+
+
+@override_settings(MAIL_QUEUE_BATCH_SIZE=10, MAIL_QUEUE_MAX_ATTEMPTS=3, MAIL_QUEUE_RETRY_DELAY=60)
+class MailOutboxTests(TestCase):
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.fail_subjects = ()
+        CountingBackend.unreachable = False
+
+    def queue(self, count, subject='Anfrage'):
+        for i in range(count):
+            enqueue_mail(f'{subject} {i}', 'Text', 'noreply@example.com', ['kontakt@example.com'])
+
+    def test_batch_reuses_one_connection(self):
+        self.queue(15)
+        self.assertEqual(send_queued_mail(connection=CountingBackend()), (10, 0))
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 10)
+
+        self.assertEqual(send_queued_mail(connection=CountingBackend()), (5, 0))
+        self.assertEqual(send_queued_mail(connection=CountingBackend()), (0, 0))
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.SENT).count(), 15)
+
+    def test_failed_email_is_retried_with_backoff(self):
+        self.queue(2)
+        CountingBackend.fail_subjects = ('Anfrage 0',)
+        self.assertEqual(send_queued_mail(connection=CountingBackend()), (1, 1))
+
+        failed = OutboundEmail.objects.get(subject='Anfrage 0')
+        self.assertEqual(failed.status, OutboundEmail.PENDING)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('550 rejected', failed.last_error)
+        delay = failed.next_attempt_at - timezone.now()
+        self.assertTrue(timedelta(seconds=50) < delay <= timedelta(seconds=60))
+
+        # Not due yet
+        self.assertEqual(send_queued_mail(connection=CountingBackend()), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        send_queued_mail(connection=CountingBackend())
+        failed.refresh_from_db()
+        delay = failed.next_attempt_at - timezone.now()
+        self.assertTrue(timedelta(seconds=110) < delay <= timedelta(seconds=120))
+
+    def test_gives_up_after_max_attempts(self):
+        self.queue(1)
+        CountingBackend.fail_subjects = ('Anfrage 0',)
+        for _ in range(3):
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            send_queued_mail(connection=CountingBackend())
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+        self.assertEqual(email.attempts, 3)
+
+    def test_unreachable_server_keeps_batch_queued(self):
+        self.queue(3)
+        CountingBackend.unreachable = True
+        self.assertEqual(send_queued_mail(connection=CountingBackend()), (0, 3))
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.PENDING, attempts=1).count(), 3)
+
+    def test_command_sends_queue(self):
+        self.queue(2)
+        out = StringIO()
+        call_command('send_queued_mail', stdout=out)
+        self.assertIn('2 sent, 0 failed', out.getvalue())
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class BenchmarkCommandTests(TestCase):
+    # The command itself creates its own test database, so only its parts are tested here
+    def setUp(self):
+        from .management.commands.benchmark import Command
+        self.command = Command()
+
+    def test_covers_every_named_route(self):
+        routes = self.command.routes(None)
+        self.assertEqual(routes['home'], '/')
+        self.assertIn('status_visits', routes)
+        self.assertEqual(self.command.routes(['home', 'contact']), {'home': '/', 'contact': '/kontakt/'})
+
+    def test_workload_is_reproducible(self):
+        routes = self.command.routes(None)
+        first = list(self.command.workload(routes, 'sessionid=x', 50, seed=3))
+        self.assertEqual(first, list(self.command.workload(routes, 'sessionid=x', 50, seed=3)))
+        for name, _, headers in first:
+            self.assertEqual('HTTP_COOKIE' in headers, name.startswith('status'))
+
+    def test_latency_percentiles(self):
+        latency = self.command.latency([i / 1000 for i in range(1, 101)])
+        self.assertEqual((latency['p50'], latency['p99'], latency['max']), (51, 99, 100))
+
+    def test_metrics_kept_out_of_metrics_dir(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        env = dict(os.environ, METRICS_DIR=tmp.name, METRICS_FLUSH_INTERVAL='0')
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'suedwest_project.settings')
+        subprocess.check_call(
+            [sys.executable, 'manage.py', 'benchmark', '--requests=5', '--warmup=0', '--routes', 'home',
+             '--interface=wsgi', '--no-memory'],
+            env=env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL,
+        )
+        self.assertEqual(os.listdir(tmp.name), [])
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(setattr, DjangoTemplate, 'render', profiling._template_render)
+        histograms.clear()
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('home'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_server_timing_breakdown(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('status'))
+        stages = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(stages), {'db', 'template', 'view', 'middleware', 'total'})
+        self.assertRegex(stages['db'], r'dur=[\d.]+;desc="\d+ queries"')
+
+        snapshot = histograms.snapshot()
+        self.assertEqual(snapshot['total']['count'], 1)
+        self.assertEqual(snapshot['total']['buckets'][-1][1], 1)
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_mail_and_tracking_stages(self):
+        response = self.client.post(reverse('contact'), {
+            'name': 'Test Firma GmbH', 'contact_person': 'Max Mustermann',
+            'email': 'test@example.com', 'message': 'Hallo',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('mail;dur=', response['Server-Timing'])
+        self.assertIn('tracking;dur=', response['Server-Timing'])
+
+    def test_profile_on_request(self):
+        with override_settings(PROFILING_ENABLED=True, PROFILING_TOKEN='geheim', PROFILING_DIR=self.tmp.name):
+            self.assertNotIn('X-Profile-Dump', self.client.get(reverse('home'), HTTP_X_PROFILE='falsch'))
+            response = self.client.get(reverse('home'), HTTP_X_PROFILE='geheim')
+        dump = Path(self.tmp.name) / response['X-Profile-Dump']
+        self.assertEqual([dump], list(Path(self.tmp.name).iterdir()))
+        self.assertTrue(dump.name.endswith('.prof'))
+
+    @override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1)
+    def test_sampled_profiles(self):
+        with override_settings(PROFILING_DIR=self.tmp.name):
+            self.client.get(reverse('about'))
+        self.assertEqual(len(list(Path(self.tmp.name).glob('*-ueber-uns-*.prof'))), 1)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.settings = override_settings(METRICS_DIR=tmp.name, METRICS_FLUSH_INTERVAL=0)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def scrape(self, **headers):
+        response = self.client.get(reverse('metrics'), **headers)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode('utf-8')
+
+    def test_requests_counted_per_route(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        self.client.get('/wp-login.php')
+        self.client.generic('SCAN1', reverse('about'))
+        self.client.generic('SCAN2', reverse('about'))
+        output = self.scrape()
+        self.assertIn('http_requests_total{method="GET",route="home",status="200"} 2', output)
+        self.assertIn('http_requests_total{method="other",route="about",status="200"} 2', output)
+        self.assertNotIn('SCAN', output)
+        self.assertIn('http_requests_total{method="GET",route="<unmatched>",status="404"} 1', output)
+        self.assertIn('http_request_duration_seconds_bucket{route="home",le="+Inf"} 2', output)
+        self.assertIn('http_request_duration_seconds_count{route="home"} 2', output)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', output)
+        self.assertIn('visit_queue_depth 0', output)
+        self.assertIn('mail_queue_pending 0', output)
+
+    def test_totals_include_other_workers(self):
+        self.client.get(reverse('about'))
+        key = '["http_requests_total", [["method", "GET"], ["route", "about"], ["status", "200"]]]'
+        # A live worker (our parent process) and one that has exited
+        for pid, depth in ((os.getppid(), 3), (2 ** 22 + 1, 7)):
+            (self.dir / f'worker-{pid}.json').write_text(json.dumps({
+                'pid': pid, 'counters': {key: 10}, 'histograms': {},
+                'gauges': {'["visit_queue_depth", []]': depth},
+            }))
+        output = self.scrape()
+        self.assertIn('http_requests_total{method="GET",route="about",status="200"} 21', output)
+        # Gauges of exited workers no longer count
+        self.assertIn('visit_queue_depth 3', output)
+
+    def test_other_process_flushes_to_shared_directory(self):
+        script = (
+            'import django; django.setup()\n'
+            'from pages.metrics import registry\n'
+            'registry.inc("smtp_errors_total", 4)\n'
+            'registry.flush(force=True, final=True)\n'
+        )
+        env = dict(os.environ, METRICS_DIR=str(self.dir))
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'suedwest_project.settings')
+        subprocess.check_call([sys.executable, '-c', script], env=env, cwd=settings.BASE_DIR)
+        registry.inc('smtp_errors_total')
+        self.assertIn('smtp_errors_total 5', self.scrape())
+
+    def test_own_file_written(self):
+        self.client.get(reverse('home'))
+        state = json.loads((self.dir / f'{registry.name}.json').read_text())
+        self.assertEqual(
+            state['counters']['["http_requests_total", [["method", "GET"], ["route", "home"], ["status", "200"]]]'], 1)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0.1)
+    def test_idle_worker_flushed_in_background(self):
+        self.client.get(reverse('home'))
+        # Counted after the last request, e.g. by the visit writer or a signal
+        registry.inc('smtp_errors_total', 2)
+        path = self.dir / f'{registry.name}.json'
+        written = lambda: json.loads(path.read_text())['counters']
+        deadline = time.monotonic() + 5
+        while '["smtp_errors_total", []]' not in written() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(written()['["smtp_errors_total", []]'], 2)
+
+    def test_reused_pid_keeps_exited_workers_counts(self):
+        key = '["smtp_errors_total", []]'
+        registry.inc('smtp_errors_total')
+        registry.flush(force=True, final=True)
+        first = registry.name
+        # A new process with the same PID, like a restarted worker in a container
+        registry.reset()
+        registry.inc('smtp_errors_total')
+        registry.flush(force=True)
+        self.assertNotEqual(registry.name, first)
+        self.assertEqual(json.loads((self.dir / f'{first}.json').read_text())['counters'][key], 1)
+        self.assertIn('smtp_errors_total 2', self.scrape())
+
+    @override_settings(METRICS_TOKEN='geheim')
+    def test_token_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.assertIn('# TYPE', self.scrape(HTTP_AUTHORIZATION='Bearer geheim'))
+
+
+class HealthTests(TestCase):
+    def setUp(self):
+        health.clear_cache()
+        self.addCleanup(health.clear_cache)
+
+    def test_live(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/health/live')
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertEqual(self.client.get('/health/live/').status_code, 200)
+
+    def test_ready(self):
+        response = self.client.get('/health/ready')
+        self.assertEqual(response.status_code, 200)
+        checks = response.json()['checks']
+        self.assertEqual(set(checks), {'database', 'migrations', 'cache', 'static_manifest', 'mail'})
+        self.assertEqual(checks['database']['status'], 'ok')
+        self.assertEqual(checks['mail']['status'], 'skipped')
+
+    def test_probes_run_concurrently_with_timeout(self):
+        def slow():
+            time.sleep(0.3)
+
+        def broken():
+            raise RuntimeError('kaputt')
+
+        started = time.perf_counter()
+        with override_settings(HEALTH_PROBE_TIMEOUT=0.2):
+            results = health.run_probes({'a': slow, 'b': slow, 'c': broken, 'd': lambda: None})
+        self.assertLess(time.perf_counter() - started, 0.3)
+        self.assertEqual({name: r['status'] for name, r in results.items()},
+                         {'a': 'timeout', 'b': 'timeout', 'c': 'error', 'd': 'ok'})
+        self.assertEqual(results['c']['error'], 'RuntimeError: kaputt')
+
+    def test_failure_returns_503_without_details(self):
+        def broken():
+            raise RuntimeError('db.internal:5432 refused')
+
+        with patch.dict(health.PROBES, {'database': broken}):
+            response = self.client.get('/health/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks']['database']['status'], 'error')
+        self.assertNotContains(response, 'db.internal', status_code=503)
+
+    @override_settings(HEALTH_CACHE_TTL=60)
+    def test_result_cached(self):
+        calls = []
+        with patch.dict(health.PROBES, {'database': lambda: calls.append(1)}):
+            for _ in range(5):
+                self.client.get('/health/ready')
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1', EMAIL_PORT=1)
+    def test_mail_probe_connects(self):
+        self.assertEqual(health.run_probes({'mail': health.check_mail})['mail']['status'], 'error')
+
+    @override_settings(HEALTH_INFO_TTL=60)
+    def test_mail_reported_but_not_gating(self):
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise OSError('smtp.internal refused')
+
+        with patch.dict(health.INFO_PROBES, {'mail': broken}):
+            for _ in range(3):
+                response = self.client.get('/health/ready')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['checks']['mail']['status'], 'error')
+        # Reported from the earlier result, the SMTP server is not contacted on every poll
+        self.assertEqual(len(calls), 1)
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def run_worker(self, script, **environ):
+        env = dict(os.environ, **environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'suedwest_project.settings')
+        output = subprocess.check_output([sys.executable, '-c', script], env=env, cwd=settings.BASE_DIR)
+        return output.decode('utf-8').split('\n')
+
+    def test_postgresql_harness_reports_missing_server(self):
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            call_command('test_postgresql', bin_dir='/nonexistent', stdout=StringIO())
+
+    def test_tuned_sqlite_connections(self):
+        """A worker process writes in WAL mode and reads analytics read-only."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        script = (
+            'import django; django.setup()\n'
+            'from django.core.management import call_command\n'
+            'from django.db import OperationalError, connections\n'
+            'call_command("migrate", verbosity=0)\n'
+            'with connections["default"].cursor() as cursor:\n'
+            '    cursor.execute("PRAGMA journal_mode")\n'
+            '    print(cursor.fetchone()[0])\n'
+            'try:\n'
+            '    with connections["analytics"].cursor() as cursor:\n'
+            '        cursor.execute("DELETE FROM pages_visit")\n'
+            'except OperationalError as e:\n'
+            '    print(e)\n'
+        )
+        output = self.run_worker(
+            script, DATABASE_ENGINE='sqlite', SQLITE_PATH=os.path.join(tmp.name, 'db.sqlite3'))
+        self.assertEqual(output[:2], ['wal', 'attempt to write a readonly database'])
+
+    def test_postgresql_profile(self):
+        # Only the settings are loaded, the backend (and psycopg) is not needed
+        script = (
+            'import json\n'
+            'from django.conf import settings\n'
+            'print(json.dumps(settings.DATABASES))\n'
+        )
+        databases = json.loads(self.run_worker(script, DATABASE_ENGINE='postgresql', DATABASE_POOL='False', POSTGRES_HOST='db')[0])
+        self.assertEqual(databases['default']['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(databases['default']['HOST'], 'db')
+        self.assertEqual(databases['default']['CONN_MAX_AGE'], 60)
+        self.assertEqual(databases['analytics']['OPTIONS'], {'options': '-c default_transaction_read_only=on'})
+
+        databases = json.loads(self.run_worker(script, DATABASE_ENGINE='postgresql', DATABASE_POOL='True')[0])
+        # Django refuses persistent connections together with the pool
+        self.assertEqual(databases['default']['CONN_MAX_AGE'], 0)
+        self.assertEqual(databases['default']['OPTIONS']['pool']['max_size'], 10)
+        self.assertIn('pool', databases['analytics']['OPTIONS'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL, see manage.py test_postgresql')
+class PostgreSQLTests(TestCase):
+    def test_visits_written_with_copy(self):
+        agent = UserAgent.objects.create(value='Mozilla/5.0')
+        stamp = timezone.now() - timedelta(minutes=5)
+        insert_visits([
+            Visit(timestamp=stamp, path='/', user_agent=agent, ip_address_anonymized='192.168.1.0', weight=3),
+            Visit(path='/kontakt/'),
+        ])
+        visit = Visit.objects.get(path='/')
+        self.assertEqual(
+            (visit.timestamp, visit.user_agent_id, visit.ip_address_anonymized, visit.weight, visit.method),
+            (stamp, agent.id, '192.168.1.0', 3, 'GET'))
+        self.assertIsNone(Visit.objects.get(path='/kontakt/').referer_id)
+
+    def test_buffer_flush_uses_copy(self):
+        buffer = VisitBuffer()
+        buffer.add({'timestamp': timezone.now(), 'path': '/', 'user_agent': 'Bot', 'referer': ''})
+        self.assertEqual(buffer.stats()['flushed'], 1)
+        self.assertEqual(VisitDaily.objects.get(path='/').count, 1)
+
+    def test_timestamp_brin_index(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Visit._meta.db_table)
+        self.assertEqual(constraints['visit_ts_brin']['type'], 'brin')
+
+
+class AssetBuildTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.output = Path(tempfile.mkdtemp())
+        cls.addClassCleanup(shutil.rmtree, cls.output)
+        cls.image_cache = Path(tempfile.mkdtemp())
+        cls.addClassCleanup(shutil.rmtree, cls.image_cache)
+        cls.enterClassContext(override_settings(IMAGE_CACHE_DIR=cls.image_cache))
+        assets.build(output_dir=cls.output)
+        cls.site_css = (cls.output / 'site.css').read_text()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_purge(self):
+        css = (
+            '.used{a:1}.unused{a:2}.used .unused,.used:not(.unused){a:3}@media (min-width:1px){.alert-ok{a:4}.x{a:5}}'
+            '@keyframes spin{to{b:1}}@-webkit-keyframes spin{to{b:1}}@keyframes gone{to{b:2}}.used{animation:spin 1s}'
+        )
+        usage = assets.Usage(['used'], prefixes=['alert-'])
+        self.assertEqual(
+            assets.drop_unused_keyframes(assets.purge(css, usage)),
+            '.used{a:1}.used:not(.unused){a:3}@media (min-width:1px){.alert-ok{a:4}}'
+            '@keyframes spin{to{b:1}}@-webkit-keyframes spin{to{b:1}}.used{animation:spin 1s}')
+
+    def test_site_css_keeps_used_rules_only(self):
+        for rule in ('.navbar-toggler{', '.fa-envelope:before', '.alert-success', '.form-control{', '.reveal.active'):
+            self.assertIn(rule, self.site_css)
+        for rule in ('.carousel', '.fa-ad:before', 'fa-bounce'):
+            self.assertNotIn(rule, self.site_css)
+        self.assertTrue(self.site_css.startswith('@charset "UTF-8";/*!'))
+
+    def test_critical_css(self):
+        critical = (self.output / 'critical.css').read_text()
+        self.assertIn('.top-bar{', critical)
+        self.assertIn('.navbar-toggler{', critical)
+        self.assertNotIn('footer', critical)
+        self.assertLess(len(gzip.compress(critical.encode())), 14 * 1024)
+
+    @skipUnless(assets.font_subset, 'fontTools is not installed')
+    def test_icon_fonts_subset(self):
+        from fontTools.ttLib import TTFont
+        font = TTFont(self.output / 'fonts' / 'fa-solid-900.woff2')
+        codepoints = set(font.getBestCmap())
+        self.assertIn(0xf0e0, codepoints)  # envelope
+        self.assertLessEqual(codepoints, set(assets.icon_codepoints(self.site_css)))
+
+    def test_page_inlines_critical_css(self):
+        with override_settings(ASSETS_OUTPUT_DIR=self.output):
+            content = self.client.get(reverse('home')).content.decode()
+        self.assertIn('<style>', content)
+        self.assertIn('.top-bar{', content)
+        self.assertIn('/static/dist/fonts/fa-solid-900.woff2', content)
+        self.assertIn('/static/dist/site.css', content)
+        self.assertNotIn('cdn.jsdelivr.net', content)
+        self.assertNotIn('cdnjs.cloudflare.com', content)
+        # Inter is self-hosted, no request goes to Google
+        self.assertIn('<link rel="preload" href="/static/dist/fonts/inter.woff2" as="font"', content)
+        self.assertNotIn('fonts.googleapis.com', content)
+
+    @skipUnless(images.Image, 'Pillow is not installed')
+    def test_image_variants(self):
+        logo = json.loads((self.output / 'manifest.json').read_text())['images']['img/logo.png']
+        self.assertEqual((logo['width'], logo['height']), (1280, 590))
+        self.assertEqual([width for width, _ in logo['variants']['avif']], [160, 240, 320, 480, 640, 960, 1280])
+        with images.Image.open(self.output / 'img' / 'logo-320w.webp') as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (320, 148)))
+        self.assertLess((self.output / 'img' / 'logo-320w.avif').stat().st_size, logo['bytes'] / 10)
+
+    @skipUnless(images.Image, 'Pillow is not installed')
+    def test_image_variants_cached_by_content(self):
+        source = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, source)
+        (source / 'img').mkdir()
+        images.Image.new('RGB', (300, 100), 'green').save(source / 'img' / 'a.png')
+        output = source / 'out'
+        # 160, 240 and its own 300 pixels, as AVIF and WebP
+        self.assertEqual(images.build_images(source, output, source / 'cache')[1], 6)
+        shutil.rmtree(output)
+        built, encoded = images.build_images(source, output, source / 'cache')
+        self.assertEqual(encoded, 0)
+        self.assertTrue((output / 'img' / 'a-300w.avif').exists())
+        self.assertEqual(
+            built['img/a.png']['variants']['webp'],
+            [[160, 'img/a-160w.webp'], [240, 'img/a-240w.webp'], [300, 'img/a-300w.webp']])
+        images.Image.new('RGB', (300, 100), 'red').save(source / 'img' / 'a.png')
+        self.assertEqual(images.build_images(source, output, source / 'cache')[1], 6)
+
+    @skipUnless(images.Image, 'Pillow is not installed')
+    def test_picture_tag(self):
+        with override_settings(ASSETS_OUTPUT_DIR=self.output):
+            content = self.client.get(reverse('home')).content.decode()
+        self.assertIn(
+            '<picture><source type="image/avif" srcset="/static/dist/img/logo-160w.avif 160w, '
+            '/static/dist/img/logo-240w.avif 240w', content)
+        self.assertIn('<img src="/static/img/logo.png" width="1280" height="590" alt="Logo"></picture>', content)
+        # The logo size is part of the critical CSS
+        self.assertIn('.navbar-brand img{', (self.output / 'critical.css').read_text())
+
+    def test_picture_tag_without_build(self):
+        template = Template("{% load assets %}{% picture 'img/logo.png' alt='Logo' class='x' %}")
+        with override_settings(ASSETS_OUTPUT_DIR=self.output / 'missing'):
+            self.assertEqual(template.render(Context()), '<img src="/static/img/logo.png" alt="Logo" class="x">')
+
+    def test_collectstatic_builds_hashed_immutable_files(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        output = root / 'build'
+        storages = {**settings.STORAGES, 'staticfiles': {
+            'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'}}
+        with override_settings(
+            ASSETS_OUTPUT_DIR=output, STATIC_ROOT=root / 'collected', STORAGES=storages,
+            STATICFILES_DIRS=[('dist', output), ('img', settings.BASE_DIR / 'static' / 'img')],
+            # Compressing the admin files would take most of the time
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO())
+            self.assertTrue((output / 'manifest.json').exists())
+            content = Client().get(reverse('home')).content.decode()
+            url = content.split('<link rel="preload" href="')[1].split('"')[0]
+            self.assertRegex(url, r'^/static/dist/site\.[0-9a-f]{12}\.css$')
+            response = Client().get(url, headers={'accept-encoding': 'br'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('immutable', response['Cache-Control'])
@@ -1,9 +1,21 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core import mail
 from django.contrib.auth.models import User
-from .models import Visit
+from .models import UserAgent, Visit
+from .outbox import send_queued_mail
+from .tracking import insert_visits, visit_buffer
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
 import time
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
+from django.conf import settings
 
 class MiddlewareIntegrationTests(TestCase):
     def setUp(self):
@@ -22,7 +34,7 @@ class MiddlewareIntegrationTests(TestCase):
         self.assertEqual(Visit.objects.count(), initial_count + 1)
         visit = Visit.objects.latest('timestamp')
         self.assertEqual(visit.path, '/')
-        self.assertEqual(visit.user_agent, 'TestAgent')
+        self.assertEqual(visit.user_agent.value, 'TestAgent')
         # Client IP is 127.0.0.1 by default in tests, anonymized should be 127.0.0.0
         self.assertEqual(visit.ip_address_anonymized, '127.0.0.0')
 
@@ -40,6 +52,24 @@ class MiddlewareIntegrationTests(TestCase):
         # Count should still be the same
         self.assertEqual(Visit.objects.count(), initial_count)
 
+    def test_configured_exclusions_not_logged(self):
+        """Bots, HEAD requests, status polling and 404 responses are not logged."""
+        self.client.get(reverse('home'), HTTP_USER_AGENT='Mozilla/5.0 (compatible; bingbot/2.0)')
+        self.client.head(reverse('home'))
+        self.client.get(reverse('status'))
+        self.client.get('/wp-login.php')
+        self.client.get('/robots.txt')
+
+        self.assertEqual(Visit.objects.count(), 0)
+
+    async def test_async_request_tracked(self):
+        """The middleware also records visits when served through ASGI."""
+        response = await self.async_client.get(reverse('about'))
+        self.assertEqual(response.status_code, 200)
+
+        visit = await Visit.objects.alatest('timestamp')
+        self.assertEqual(visit.path, '/ueber-uns/')
+
     def test_ipv6_anonymization(self):
         """Test that IPv6 addresses are correctly anonymized by the middleware."""
         # We need to simulate an IPv6 REMOTE_ADDR
@@ -48,7 +78,51 @@ class MiddlewareIntegrationTests(TestCase):
         self.client.get(reverse('home'), REMOTE_ADDR='2001:0db8:85a3:0000:0000:8a2e:0370:7334')
         
         visit = Visit.objects.latest('timestamp')
-        self.assertEqual(visit.ip_address_anonymized, '2001:0db8::XXXX')
+        self.assertEqual(visit.ip_address_anonymized, '2001:db8:85a3::')
+
+    def test_forwarded_client_anonymized(self):
+        """Behind a trusted proxy the client from X-Forwarded-For is recorded."""
+        self.client.get(reverse('home'), HTTP_X_FORWARDED_FOR='203.0.113.7 , 127.0.0.1')
+        self.client.get(reverse('home'), REMOTE_ADDR='198.51.100.4', HTTP_X_FORWARDED_FOR='203.0.113.7')
+
+        addresses = list(Visit.objects.order_by('id').values_list('ip_address_anonymized', flat=True))
+        self.assertEqual(addresses, ['203.0.113.0', '198.51.100.0'])
+
+
+class VisitLatencyTests(TestCase):
+    DB_WRITE_DELAY = 0.05
+
+    def setUp(self):
+        self.client = Client()
+
+    def tearDown(self):
+        visit_buffer.flush()
+
+    def slow_insert(self, visits):
+        time.sleep(self.DB_WRITE_DELAY)
+        return insert_visits(visits)
+
+    def p99_of_home(self, requests):
+        durations = []
+        with patch('pages.tracking.insert_visits', self.slow_insert):
+            for _ in range(requests):
+                start = time.perf_counter()
+                self.client.get(reverse('home'))
+                durations.append(time.perf_counter() - start)
+        durations.sort()
+        return durations[int(len(durations) * 0.99) - 1]
+
+    @override_settings(VISIT_BUFFER_SIZE=1)
+    def test_unbuffered_latency_includes_db_write(self):
+        self.assertGreaterEqual(self.p99_of_home(20), self.DB_WRITE_DELAY)
+
+    @override_settings(VISIT_BUFFER_SIZE=500, VISIT_BUFFER_MAX_AGE=60)
+    def test_buffered_latency_independent_of_db_write(self):
+        self.assertLess(self.p99_of_home(100), self.DB_WRITE_DELAY)
+
+        # Nothing is lost, it is only written later in one batch
+        self.assertEqual(visit_buffer.flush(), 100)
+        self.assertEqual(Visit.objects.count(), 100)
 
 
 class TemplateIntegrationTests(TestCase):
@@ -106,7 +180,9 @@ class WorkflowIntegrationTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Vielen Dank!')
         
-        # 5. Verify email integration
+        # 5. Verify email integration (queued, then sent in the background)
+        self.assertEqual(len(mail.outbox), 0)
+        send_queued_mail()
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn('Integration Test Corp', mail.outbox[0].subject)
         
@@ -121,3 +197,61 @@ class WorkflowIntegrationTests(TestCase):
         self.assertContains(response, '5') # visits_total should be 5
         self.assertContains(response, '/ueber-uns/')
         self.assertContains(response, '/kontakt/')
+
+
+@skipUnless(os.getenv('EXPORT_RSS_TEST'), 'slow, set EXPORT_RSS_TEST=1 to run')
+class ExportMemoryTests(TestCase):
+    """
+    export_visits over a million rows in its own process, on its own SQLite
+    file: its peak RSS must stay under a fixed ceiling and barely above
+    that of a tiny export.
+    """
+    ROWS = 1_000_000
+    CEILING_MB = 150
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = Path(tempfile.mkdtemp())
+        cls.env = dict(
+            os.environ, DJANGO_SETTINGS_MODULE='suedwest_project.settings',
+            DATABASE_ENGINE='sqlite', SQLITE_PATH=str(cls.tmp / 'db.sqlite3'),
+            # The mapped file and SQLite's page cache are bounded anyway and fill up
+            # during any full scan; keep them small to see the memory of the export
+            SQLITE_MMAP_SIZE='0', SQLITE_CACHE_SIZE='-2000',
+        )
+        subprocess.check_call([sys.executable, 'manage.py', 'migrate', '-v0'], env=cls.env, cwd=settings.BASE_DIR)
+        conn = sqlite3.connect(cls.tmp / 'db.sqlite3')
+        with conn:
+            agent = 'Mozilla/5.0 (X11; Linux x86_64) Firefox/140.0'
+            conn.execute(
+                'INSERT INTO pages_useragent (value, digest) VALUES (?, ?)', (agent, UserAgent.make_digest(agent)))
+            conn.execute(f"""
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {cls.ROWS})
+                INSERT INTO pages_visit (timestamp, path, method, user_agent_id, ip_address_anonymized, weight)
+                SELECT datetime('2026-01-01', '+' || (i % 2592000) || ' seconds'),
+                       '/seite-' || (i % 50) || '/', 'GET', 1, '192.168.' || (i % 256) || '.0', 1
+                FROM n
+            """)
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+        super().tearDownClass()
+
+    def export_peak_mb(self, *args):
+        process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'export_visits', str(self.tmp / 'out.csv.gz'), *args],
+            env=self.env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL,
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        self.assertEqual(process.returncode, 0)
+        return usage.ru_maxrss / 1024  # KiB on Linux
+
+    def test_peak_rss_constant(self):
+        small = self.export_peak_mb('--until=2026-01-01')
+        full = self.export_peak_mb()
+        self.assertLess(full, self.CEILING_MB)
+        self.assertLess(full - small, 20)
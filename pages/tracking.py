@@ -0,0 +1,236 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from .lookups import clear_caches, encode_records
+from .models import Visit
+from .rollups import add_to_rollups
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = 'drop-newest'
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+
+
+def _can_copy(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    # psycopg2 has no cursor.copy()
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+
+def insert_visits(visits):
+    """
+    Insert a batch of visits without fetching their ids: one multi-row
+    INSERT, or COPY on PostgreSQL with psycopg 3.
+    """
+    connection = connections[router.db_for_write(Visit)]
+    if not _can_copy(connection):
+        Visit.objects.bulk_create(visits)
+        return
+
+    quote = connection.ops.quote_name
+    fields = [field for field in Visit._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(quote(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        with cursor.copy(f'COPY {quote(Visit._meta.db_table)} ({columns}) FROM STDIN') as copy:
+            for visit in visits:
+                copy.write_row([field.get_db_prep_save(getattr(visit, field.attname), connection) for field in fields])
+
+
+class VisitBuffer:
+    """
+    Collects visit records in memory and writes them with insert_visits()
+    once VISIT_BUFFER_SIZE records are pending or the oldest one is older
+    than VISIT_BUFFER_MAX_AGE seconds. The hourly and daily rollups
+    are updated in the same transaction.
+
+    With VISIT_WRITER_THREAD enabled the write happens on a dedicated writer
+    thread and add() never touches the database. Otherwise the request that
+    crosses a threshold flushes inline.
+
+    At most VISIT_BUFFER_MAX_PENDING records are held. What happens to a
+    record that does not fit is decided by VISIT_BUFFER_POLICY:
+    'drop-newest' discards it, 'drop-oldest' discards the oldest pending
+    record instead, 'block' waits up to VISIT_BUFFER_BLOCK_TIMEOUT seconds
+    for the writer thread to make room and then discards it.
+
+    A failed batch is retried after VISIT_BUFFER_MAX_AGE seconds. After
+    VISIT_BUFFER_MAX_ATTEMPTS failures in a row it is dropped and logged.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._oldest = None
+        self._retry_at = 0.0
+        self._attempts = 0
+        self._thread = None
+        self._stopping = False
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def add(self, record):
+        threaded = settings.VISIT_WRITER_THREAD
+        if threaded:
+            self._ensure_writer()
+
+        with self._cond:
+            if not self._make_room(threaded):
+                self.dropped += 1
+                return False
+            now = time.monotonic()
+            if not self._pending:
+                self._oldest = now
+            self._pending.append(record)
+            due = self._is_due(now)
+            if threaded:
+                # Wake the writer for a full batch, or so it can start the age timer
+                if due or len(self._pending) == 1:
+                    self._cond.notify_all()
+                return True
+
+        if due:
+            self.flush()
+        return True
+
+    def may_block(self):
+        """Whether add() can wait or hit the database in the calling thread."""
+        return not settings.VISIT_WRITER_THREAD or settings.VISIT_BUFFER_POLICY == BLOCK
+
+    def flush(self):
+        with self._cond:
+            batch = list(self._pending)
+            self._pending.clear()
+            self._oldest = None
+            # Space was freed for producers waiting under the 'block' policy
+            self._cond.notify_all()
+        if not batch:
+            return 0
+
+        try:
+            with transaction.atomic():
+                visits = [Visit(**record) for record in encode_records(batch)]
+                insert_visits(visits)
+                add_to_rollups(visits)
+        except Exception as e:
+            # Do not crash the site if logging fails. Keep the batch for the
+            # next attempt as far as the memory cap allows, and forget cached
+            # lookup ids in case one of them has become invalid.
+            clear_caches()
+            with self._cond:
+                self.failed += 1
+                self._attempts += 1
+                if self._attempts >= settings.VISIT_BUFFER_MAX_ATTEMPTS:
+                    logger.error('Dropping %s visits after %s failed attempts: %s', len(batch), self._attempts, e)
+                    self._attempts = 0
+                    self.dropped += len(batch)
+                    return 0
+                logger.warning('Writing %s visits failed, retrying later: %s', len(batch), e)
+                room = settings.VISIT_BUFFER_MAX_PENDING - len(self._pending)
+                keep = batch[:max(room, 0)]
+                self.dropped += len(batch) - len(keep)
+                self._pending.extendleft(reversed(keep))
+                if self._pending:
+                    self._oldest = time.monotonic()
+                self._retry_at = time.monotonic() + settings.VISIT_BUFFER_MAX_AGE
+            return 0
+
+        with self._cond:
+            self._attempts = 0
+            self.flushed += len(batch)
+        return len(batch)
+
+    def shutdown(self, timeout=10):
+        """Stop the writer thread after it has drained the buffer."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        # Whatever the writer could not take (or everything, without a writer)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+                'failed_flushes': self.failed,
+            }
+
+    def _make_room(self, threaded):
+        limit = settings.VISIT_BUFFER_MAX_PENDING
+        if len(self._pending) < limit:
+            return True
+
+        policy = settings.VISIT_BUFFER_POLICY
+        if policy == DROP_OLDEST and self._pending:
+            self._pending.popleft()
+            self.dropped += 1
+            return True
+        if policy == BLOCK and threaded:
+            deadline = time.monotonic() + settings.VISIT_BUFFER_BLOCK_TIMEOUT
+            while len(self._pending) >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+            return True
+        return False
+
+    def _is_due(self, now):
+        if not self._pending or now < self._retry_at:
+            return False
+        return (
+            len(self._pending) >= settings.VISIT_BUFFER_SIZE
+            or now - self._oldest >= settings.VISIT_BUFFER_MAX_AGE
+        )
+
+    def _seconds_until_due(self, now):
+        if not self._pending:
+            return None
+        return max(self._oldest + settings.VISIT_BUFFER_MAX_AGE - now, self._retry_at - now, 0.01)
+
+    def _ensure_writer(self):
+        # A thread does not survive fork(), so this also restarts the writer
+        # in every pre-forked worker.
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='visit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._stopping and not self._is_due(time.monotonic()):
+                        self._cond.wait(self._seconds_until_due(time.monotonic()))
+                    stopping = self._stopping
+                self.flush()
+                if stopping:
+                    break
+        finally:
+            connections.close_all()
+
+
+visit_buffer = VisitBuffer()
+
+# Drain whatever is left when the worker process shuts down
+atexit.register(visit_buffer.shutdown)
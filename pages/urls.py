@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 from . import views
 
 urlpatterns = [
@@ -10,6 +10,13 @@ urlpatterns = [
     path('impressum/', views.imprint, name='imprint'),
     path('datenschutz/', views.privacy, name='privacy'),
     path('health/', views.health_check, name='health_check'),
+    # Without the trailing slash too, load balancers do not follow redirects
+    re_path(r'^health/live/?$', views.health_live, name='health_live'),
+    re_path(r'^health/ready/?$', views.health_ready, name='health_ready'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('status/', views.status_view, name='status'),
+    path('status/metrics/', views.status_metrics, name='status_metrics'),
+    path('status/analytics/', views.status_analytics, name='status_analytics'),
+    path('status/visits/', views.status_visits, name='status_visits'),
     path('agb/', views.terms, name='terms'),
 ]
\ No newline at end of file
@@ -1,63 +1,124 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
-from django.core.mail import send_mail
 from django.contrib import messages
 from django.conf import settings
 from .forms import ContactForm
 from django.contrib.auth.decorators import login_required, user_passes_test
-import subprocess
-from django.db import connections
-from django.db.utils import OperationalError
 from django.utils import timezone
-from .models import Visit
+from datetime import date, timedelta, timezone as dt_timezone
+from django.db import DatabaseError
+from django.utils.crypto import constant_time_compare
+from . import analytics, health, metrics
+from .models import OutboundEmail
+from .caching import cached_page
+from .dashboard import get_status_snapshot
+from .outbox import enqueue_mail
+from .revision import get_git_revision_hash
 
 def health_check(request):
     return JsonResponse({'status': 'ok'})
 
-def get_git_revision_hash():
+def health_live(request):
+    # The process answers, nothing else is checked
+    return JsonResponse({'status': 'ok'})
+
+def health_ready(request):
+    ready, results = health.readiness()
+    if not settings.DEBUG:
+        # Error details go to the log, not to anyone who can reach the URL
+        results = {name: {k: v for k, v in result.items() if k != 'error'} for name, result in results.items()}
+    return JsonResponse({'status': 'ok' if ready else 'unavailable', 'checks': results}, status=200 if ready else 503)
+
+def metrics_view(request):
+    # Prometheus scrape target, totals over all workers (see metrics.py)
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
     try:
-        # Get the latest git commit hash
-        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode('utf-8').strip()
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return 'N/A'
+        pending = OutboundEmail.objects.filter(status=OutboundEmail.PENDING).count()
+    except DatabaseError:
+        metrics.registry.inc('database_errors_total', source='metrics')
+        pending = None
+    extra = {'mail_queue_pending': pending} if pending is not None else {}
+    return HttpResponse(metrics.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @login_required
 @user_passes_test(lambda u: u.is_superuser)
 def status_view(request):
-    # Check database connection
-    db_conn = connections['default']
+    # Shared, briefly cached snapshot (see dashboard.py)
+    return render(request, 'status.html', get_status_snapshot())
+
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def status_metrics(request):
+    return JsonResponse(get_status_snapshot())
+
+def _date_range(request, default_days=7):
+    today = timezone.localdate()
+    start = date.fromisoformat(request.GET.get('from') or (today - timedelta(days=default_days - 1)).isoformat())
+    end = date.fromisoformat(request.GET['to']) if request.GET.get('to') else today
+    try:
+        end += timedelta(days=1)
+        # Queried as aware datetimes, which must exist in UTC as well
+        for day in (start, end):
+            analytics.day_start(day).astimezone(dt_timezone.utc)
+    except OverflowError as e:  # ?to=9999-12-31, ?from=0001-01-01
+        raise ValueError('Ungültiger Zeitraum') from e
+    if not start < end or (end - start).days > 366:
+        raise ValueError('Ungültiger Zeitraum')
+    return start, end
+
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def status_analytics(request):
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive), bucket=hour|day, path=/...
+    try:
+        start, end = _date_range(request)
+    except ValueError:
+        return JsonResponse({'error': 'Ungültiger Zeitraum'}, status=400)
+    bucket = analytics.HOUR if request.GET.get('bucket') == analytics.HOUR else analytics.DAY
+    if bucket == analytics.HOUR:
+        series = analytics.time_series(
+            analytics.day_start(start), analytics.day_start(end), bucket, request.GET.get('path'))
+    else:
+        series = analytics.time_series(start, end, bucket, request.GET.get('path'))
+    return JsonResponse({
+        'from': start,
+        'to': end - timedelta(days=1),
+        'bucket': bucket,
+        'series': [{'bucket': b, 'visits': v} for b, v in series],
+        'top_paths': analytics.top_paths(start, end),
+        'top_referers': [
+            {'referer': row['referer__value'], 'visits': row['visits']}
+            for row in analytics.top_referers(start, end)
+        ],
+    })
+
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def status_visits(request):
+    # Keyset pagination: pass the returned 'next' as ?cursor= for the next page
     try:
-        db_conn.cursor()
-        db_status = 'ok'
-    except OperationalError:
-        db_status = 'error'
-
-    # Stats
-    today = timezone.now().date()
-    visits_today = Visit.objects.filter(timestamp__date=today).count()
-    visits_total = Visit.objects.count()
-    latest_visits = Visit.objects.all()[:10]
-
-    context = {
-        'db_status': db_status,
-        'debug_mode': settings.DEBUG,
-        'git_commit': get_git_revision_hash(),
-        'visits_today': visits_today,
-        'visits_total': visits_total,
-        'latest_visits': latest_visits,
-    }
-    return render(request, 'status.html', context)
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 200)
+        visits, next_cursor = analytics.visit_page(request.GET.get('cursor'), limit, request.GET.get('path'))
+    except ValueError:
+        return JsonResponse({'error': 'Ungültige Anfrage'}, status=400)
+    return JsonResponse({'visits': visits, 'next': next_cursor})
 
 
+@cached_page
 def home(request):
     return render(request, 'home.html')
 
+@cached_page
 def about(request):
     return render(request, 'about.html')
 
+@cached_page
 def services(request):
     return render(request, 'services.html')
 
+@cached_page
 def process(request):
     return render(request, 'process.html')
 
@@ -87,13 +148,12 @@ def contact(request):
             """
             
             try:
-                # Send email
-                send_mail(
+                # Queue email, it is sent in the background by send_queued_mail
+                enqueue_mail(
                     subject,
                     email_message,
                     settings.DEFAULT_FROM_EMAIL,
                     ['kontakt@suedwest-energie.de'],
-                    fail_silently=False,
                 )
                 messages.success(request, 'Vielen Dank! Ihre Nachricht wurde erfolgreich gesendet. Wir melden uns umgehend bei Ihnen.')
                 return redirect('contact')
@@ -105,11 +165,14 @@ def contact(request):
 
     return render(request, 'contact.html', {'form': form})
 
+@cached_page
 def imprint(request):
     return render(request, 'home.html') # Placeholder, reusing home for now
 
+@cached_page
 def privacy(request):
     return render(request, 'home.html') # Placeholder, reusing home for now
 
+@cached_page
 def terms(request):
     return render(request, 'home.html') # Placeholder, reusing home for now
\ No newline at end of file
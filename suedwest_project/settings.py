@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -28,6 +29,9 @@ DEBUG = os.getenv('DJANGO_DEBUG', 'False') == 'True'
 
 ALLOWED_HOSTS = os.getenv('DJANGO_ALLOWED_HOSTS', '127.0.0.1,localhost').split(',')
 
+# True while the test suite runs (python manage.py test)
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 
 # Application definition
 
@@ -37,14 +41,19 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # Before staticfiles so that its collectstatic (which builds the assets) is used
+    'pages',
     'django.contrib.staticfiles',
     'django_extensions',
-    'pages',
 ]
 
 MIDDLEWARE = [
+    'pages.profiling.ProfilingMiddleware',
+    'pages.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'pages.middleware.PrerenderedPageMiddleware',
+    'pages.middleware.ContentFastPathMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -52,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'pages.middleware.VisitTrackingMiddleware',
+    'pages.profiling.ViewTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'suedwest_project.urls'
@@ -78,12 +88,88 @@ WSGI_APPLICATION = 'suedwest_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+SQLITE_PATH = Path(os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'))
+
+# Applied to every new SQLite connection. SQLITE_TUNING=False gives stock SQLite.
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'True') == 'True'
+SQLITE_PRAGMAS = [
+    f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}",
+    # Negative values are KiB
+    f"PRAGMA cache_size={int(os.getenv('SQLITE_CACHE_SIZE', -64000))}",
+]
+SQLITE_OPTIONS = {}
+SQLITE_READ_OPTIONS = {}
+if SQLITE_TUNING:
+    SQLITE_READ_OPTIONS = {
+        'init_command': ';'.join(SQLITE_PRAGMAS),
+        # busy_timeout in seconds: wait for a lock instead of failing with "database is locked"
+        'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 20)),
+    }
+    SQLITE_OPTIONS = {
+        **SQLITE_READ_OPTIONS,
+        # WAL: readers no longer block the writer and vice versa.
+        # synchronous=NORMAL is safe with WAL and skips an fsync per commit.
+        'init_command': ';'.join([
+            f"PRAGMA journal_mode={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')}",
+            f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+            *SQLITE_PRAGMAS,
+        ]),
+        # Take the write lock at BEGIN. A deferred transaction that reads first
+        # cannot wait for the lock when it later writes and fails right away.
+        'transaction_mode': 'IMMEDIATE',
+    }
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'NAME': SQLITE_PATH,
+        'OPTIONS': SQLITE_OPTIONS,
+    },
 }
+# Read-only connection for the dashboard analytics (see pages/analytics.py),
+# so long reports never hold a write lock.
+ANALYTICS_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': f'{SQLITE_PATH.absolute().as_uri()}?mode=ro',
+    'OPTIONS': {**SQLITE_READ_OPTIONS, 'uri': True},
+}
+
+# DATABASE_ENGINE=postgresql switches to the PostgreSQL profile (needs psycopg 3)
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'sqlite')
+if DATABASE_ENGINE == 'postgresql':
+    # Either Django's connection pool (per worker process) or persistent
+    # connections that live for DATABASE_CONN_MAX_AGE seconds, not both.
+    DATABASE_POOL = os.getenv('DATABASE_POOL', 'False') == 'True'
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB', 'suedwest'),
+        'USER': os.getenv('POSTGRES_USER', 'suedwest'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.getenv('DATABASE_CONN_MAX_AGE', 60)),
+        # Replace a persistent connection the server has closed instead of failing the request
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if DATABASE_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),  # seconds to wait for a free connection
+        }
+    ANALYTICS_DATABASE = {
+        **DATABASES['default'],
+        'OPTIONS': {
+            **DATABASES['default']['OPTIONS'],
+            'options': '-c default_transaction_read_only=on',
+        },
+    }
+
+if not TESTING:
+    # Tests read through 'default': a second connection to the test database
+    # would not see the data of the test transaction.
+    DATABASES['analytics'] = ANALYTICS_DATABASE
 
 
 # Password validation
@@ -124,6 +210,15 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Sources and output of build_assets (see pages/assets.py). The output is
+# collected with the other static files as dist/.
+ASSETS_SOURCE_DIR = BASE_DIR / 'assets'
+ASSETS_OUTPUT_DIR = BASE_DIR / 'static' / 'dist'
+# Images under img/ here get responsive variants (pages/images.py), cached
+# across builds in IMAGE_CACHE_DIR
+IMAGES_SOURCE_DIR = BASE_DIR / 'static'
+IMAGE_CACHE_DIR = BASE_DIR / '.image-cache'
+
 STORAGES = {
     "default": {
         "BACKEND": "django.core.files.storage.FileSystemStorage",
@@ -138,6 +233,74 @@ if DEBUG:
 
 LOGIN_URL = '/admin/login/'
 
+# Cache
+# Local memory by default, DJANGO_CACHE_BACKEND=file shares entries
+# between the gunicorn workers of one machine.
+if os.getenv('DJANGO_CACHE_BACKEND') == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', BASE_DIR / '.cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# The status dashboard and its JSON endpoint share one snapshot per TTL
+STATUS_CACHE_ALIAS = 'default'
+STATUS_CACHE_TTL = int(os.getenv('STATUS_CACHE_TTL', 0 if TESTING else 5))  # seconds
+
+# Identifies the deployed code for cache keys; falls back to `git rev-parse HEAD`
+DEPLOY_REVISION = os.getenv('DEPLOY_REVISION', '')
+
+# Rendered HTML of the content pages is cached per URL and language.
+# Off in DEBUG (templates change without a deploy) and in tests.
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'False' if DEBUG or TESTING else 'True') == 'True'
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', 3600))  # seconds
+# ETag/Last-Modified per deploy and 304 answers for the content pages, plus
+# Cache-Control: public so a CDN or reverse proxy may keep them PAGE_MAX_AGE
+# seconds. Off in DEBUG, where templates change without a deploy.
+PAGE_VALIDATORS_ENABLED = os.getenv('PAGE_VALIDATORS_ENABLED', 'False' if DEBUG else 'True') == 'True'
+PAGE_MAX_AGE = int(os.getenv('PAGE_MAX_AGE', 300))  # seconds
+
+# Serve the content pages from files written by `manage.py prerender_pages`,
+# skipping most of the middleware stack (see PrerenderedPageMiddleware)
+PRERENDER_ENABLED = os.getenv('PRERENDER_ENABLED', 'False') == 'True'
+PRERENDER_ROOT = os.getenv('PRERENDER_ROOT', BASE_DIR / 'prerendered')
+
+# Content pages requested without a session or messages cookie skip the
+# session, auth and message middleware (see ContentFastPathMiddleware)
+CONTENT_FAST_PATH = os.getenv('CONTENT_FAST_PATH', 'True') == 'True'
+
+# Per-stage request timings with a Server-Timing header (see pages/profiling.py).
+# Off by default, the middleware then removes itself from the stack.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+# Profile requests sending "X-Profile: <token>" (disabled while empty) ...
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+# ... and this share of all requests
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_PROFILER = os.getenv('PROFILING_PROFILER', 'cprofile')  # or 'pyinstrument'
+PROFILING_DIR = os.getenv('PROFILING_DIR', BASE_DIR / 'profiles')
+
+# /health/ready runs its probes concurrently with this timeout each and
+# reuses the result for HEALTH_CACHE_TTL seconds
+HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', 2))  # seconds
+HEALTH_CACHE_TTL = float(os.getenv('HEALTH_CACHE_TTL', 0 if TESTING else 2))  # seconds
+# Probes that are only reported, like the SMTP server, run less often
+HEALTH_INFO_TTL = float(os.getenv('HEALTH_INFO_TTL', 0 if TESTING else 60))  # seconds
+
+# /metrics: every process writes its counters to METRICS_DIR so a scrape of
+# any worker returns the totals of the whole server. Empty keeps them per process.
+METRICS_DIR = os.getenv('METRICS_DIR', '' if TESTING else BASE_DIR / '.metrics')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))  # seconds
+# Require "Authorization: Bearer <token>" from the scraper when set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 # Email Configuration
 # For development/testing: prints emails to console
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -148,6 +311,69 @@ EMAIL_HOST_USER = 'user@example.com'
 EMAIL_HOST_PASSWORD = 'password'
 DEFAULT_FROM_EMAIL = 'noreply@suedwest-energie.de'
 
+# Outgoing mail is queued in the database and sent by
+# `manage.py send_queued_mail --loop` (worker process in the Procfile)
+MAIL_QUEUE_BATCH_SIZE = int(os.getenv('MAIL_QUEUE_BATCH_SIZE', 50))
+MAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv('MAIL_QUEUE_MAX_ATTEMPTS', 6))
+MAIL_QUEUE_RETRY_DELAY = int(os.getenv('MAIL_QUEUE_RETRY_DELAY', 60))  # seconds, doubled per attempt
+
+# Visit Tracking
+# Visits are queued per worker process and written in batches by a
+# background writer thread. Tests write every visit immediately in the
+# request thread so they can assert on the table.
+VISIT_WRITER_THREAD = os.getenv('VISIT_WRITER_THREAD', 'False' if TESTING else 'True') == 'True'
+VISIT_BUFFER_SIZE = int(os.getenv('VISIT_BUFFER_SIZE', 1 if TESTING else 50))
+VISIT_BUFFER_MAX_AGE = float(os.getenv('VISIT_BUFFER_MAX_AGE', 5))  # seconds
+VISIT_BUFFER_MAX_PENDING = int(os.getenv('VISIT_BUFFER_MAX_PENDING', 10000))
+# What to do when the queue is full: drop-newest, drop-oldest or block
+VISIT_BUFFER_POLICY = os.getenv('VISIT_BUFFER_POLICY', 'drop-newest')
+VISIT_BUFFER_BLOCK_TIMEOUT = float(os.getenv('VISIT_BUFFER_BLOCK_TIMEOUT', 0.1))  # seconds
+# A batch that still cannot be written after this many attempts in a row is
+# dropped, so one bad record does not stop tracking for good
+VISIT_BUFFER_MAX_ATTEMPTS = int(os.getenv('VISIT_BUFFER_MAX_ATTEMPTS', 5))
+# User agents and referers are stored once in lookup tables. Ids of the most
+# recent strings are cached per process (disabled in tests, where every
+# test rolls back the lookup rows it created).
+VISIT_LOOKUP_CACHE_SIZE = int(os.getenv('VISIT_LOOKUP_CACHE_SIZE', 0 if TESTING else 2048))
+# Proxies in front of the app whose X-Forwarded-For is believed, addresses
+# or networks (192.0.2.0/24). Without a trusted proxy REMOTE_ADDR is the client.
+VISIT_TRUSTED_PROXIES = [
+    proxy.strip() for proxy in os.getenv('VISIT_TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if proxy.strip()
+]
+# Requests that are never recorded. Compiled once at startup, so the
+# check stays cheap no matter how many rules are listed here.
+VISIT_TRACKING_EXCLUDE = {
+    # Path prefixes and exact paths
+    'prefixes': ['/static/', '/media/', '/admin/', '/health/', '/status/'],
+    'paths': ['/favicon.ico', '/robots.txt', '/sitemap.xml', '/apple-touch-icon.png', '/metrics'],
+    # Regular expressions, matched case-insensitively anywhere in the
+    # User-Agent. Bots are handled by VISIT_BOT_USER_AGENTS below.
+    'user_agents': [],
+    'methods': ['HEAD', 'OPTIONS'],
+    # Response status codes, e.g. scanners probing for /wp-login.php
+    'statuses': [404],
+}
+# User agents classified as bots (cached per distinct User-Agent).
+# VISIT_BOT_SAMPLE_RATE 0 drops them, 0.1 keeps one in ten, 1 keeps all.
+VISIT_BOT_USER_AGENTS = [
+    r'bot\b', r'crawl', r'spider', r'slurp', r'headless', r'lighthouse',
+    r'^curl/', r'^wget/', r'python-requests', r'^go-http-client',
+]
+VISIT_BOT_SAMPLE_RATE = float(os.getenv('VISIT_BOT_SAMPLE_RATE', 0))
+# Sampling under traffic spikes: 'off', 'fixed' (keep VISIT_SAMPLE_RATE of
+# all visits) or 'adaptive' (aim for VISIT_SAMPLING_TARGET_RATE stored
+# visits per second and worker). Stored visits carry a weight so the
+# dashboard counts stay unbiased estimates.
+VISIT_SAMPLING = os.getenv('VISIT_SAMPLING', 'off')
+VISIT_SAMPLE_RATE = float(os.getenv('VISIT_SAMPLE_RATE', 1))
+VISIT_SAMPLING_TARGET_RATE = float(os.getenv('VISIT_SAMPLING_TARGET_RATE', 20))
+# Raw visits older than this are archived/deleted by archive_visits and prune_visits
+VISIT_RETENTION_DAYS = int(os.getenv('VISIT_RETENTION_DAYS', 90))
+VISIT_ARCHIVE_DIR = os.getenv('VISIT_ARCHIVE_DIR', BASE_DIR / 'archive')
+# Visit admin: filtered and searched result counts are cached this long;
+# the unfiltered total is the database's estimate of the table size
+VISIT_ADMIN_COUNT_TIMEOUT = int(os.getenv('VISIT_ADMIN_COUNT_TIMEOUT', 0 if TESTING else 60))  # seconds
+
 # Security Settings for Production
 SECURE_SSL_REDIRECT = os.getenv('DJANGO_SECURE_SSL_REDIRECT', 'False') == 'True'
 SESSION_COOKIE_SECURE = os.getenv('DJANGO_SESSION_COOKIE_SECURE', 'False') == 'True'